@@ -0,0 +1,131 @@
+"""
+Throughput (images/s) of albumentations' ElasticTransform against BankedElasticTransform,
+which draws its displacement fields from a precomputed bank, against image size.
+Both run with p=1 on random uint8 images, the bank is built before timing starts.
+The parameters default to those of the ElasticTransform in DEFAULT_AUGMENTATION_LIST.
+
+Also compares the deformations themselves, with alpha_affine=0: x and y coordinate ramps
+are transformed to read back the displacement of every pixel, whose std and
+autocorrelation at a lag of sigma pixels should match between the two.
+
+    python benchmarks/elastic_bank.py --sizes 128 256 512 1024 --output elastic_bank.json
+"""
+import argparse
+import json
+import random
+import time
+from pathlib import Path
+
+import albumentations as A
+import numpy as np
+
+from bioimage_embed.augmentations import BankedElasticTransform
+
+
+def transforms(alpha, sigma, alpha_affine, bank_size):
+    return {
+        "ElasticTransform": A.ElasticTransform(
+            alpha=alpha, sigma=sigma, alpha_affine=alpha_affine, p=1
+        ),
+        "BankedElasticTransform": BankedElasticTransform(
+            alpha=alpha,
+            sigma=sigma,
+            alpha_affine=alpha_affine,
+            bank_size=bank_size,
+            p=1,
+        ),
+    }
+
+
+def throughput(transform, size, num_images, max_seconds):
+    rng = np.random.default_rng(0)
+    images = rng.integers(0, 256, (num_images, size, size, 3), dtype=np.uint8)
+    # Warm up, which also builds the bank
+    transform(image=images[0])
+    done = 0
+    start = time.perf_counter()
+    for image in images:
+        transform(image=image)
+        done += 1
+        if time.perf_counter() - start > max_seconds:
+            break
+    elapsed = time.perf_counter() - start
+    return done, elapsed
+
+
+def displacement_stats(transform, size, sigma, num_images):
+    y, x = np.mgrid[:size, :size].astype(np.float32)
+    ramps = np.dstack([x, y])
+    # Away from the borders, where reflection folds the ramps, keeping half the image
+    # for large sigma
+    border = max(1, min(int(3 * sigma), size // 4))
+    displacements = []
+    for _ in range(num_images):
+        out = transform(image=ramps)["image"]
+        displacements.append((out - ramps)[border:-border, border:-border])
+    d = np.stack(displacements)
+    lag = max(1, int(sigma))
+    autocorrelation = np.mean(
+        [
+            np.corrcoef(d[..., lag:, :, i].ravel(), d[..., :-lag, :, i].ravel())[0, 1]
+            for i in range(2)
+        ]
+    )
+    return float(d.std()), float(autocorrelation)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=[128, 256, 512, 1024])
+    parser.add_argument("--images", type=int, default=32)
+    # The ElasticTransform of DEFAULT_AUGMENTATION_LIST
+    parser.add_argument("--alpha", type=float, default=1)
+    parser.add_argument("--sigma", type=float, default=50)
+    parser.add_argument("--alpha-affine", type=float, default=50)
+    parser.add_argument("--bank-size", type=int, default=64)
+    parser.add_argument("--max-seconds", type=float, default=10)
+    parser.add_argument("--output", type=Path, help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    random.seed(0)
+    np.random.seed(0)
+    results = []
+    print(
+        f"{'transform':<24}{'size':>6}{'images':>8}{'images/s':>10}"
+        f"{'speedup':>9}{'disp std':>10}{'autocorr':>10}"
+    )
+    for size in args.sizes:
+        baseline = None
+        timed = transforms(args.alpha, args.sigma, args.alpha_affine, args.bank_size)
+        pure = transforms(args.alpha, args.sigma, 0, args.bank_size)
+        for name, transform in timed.items():
+            done, elapsed = throughput(transform, size, args.images, args.max_seconds)
+            std, autocorrelation = displacement_stats(
+                pure[name], size, args.sigma, min(args.images, 8)
+            )
+            images_per_sec = done / elapsed
+            baseline = baseline or images_per_sec
+            result = {
+                "transform": name,
+                "size": size,
+                "images": done,
+                "seconds": elapsed,
+                "images_per_sec": images_per_sec,
+                "speedup": images_per_sec / baseline,
+                "displacement_std": std,
+                "autocorrelation": autocorrelation,
+            }
+            results.append(result)
+            print(
+                f"{name:<24}{size:>6}{done:>8}{images_per_sec:>10.1f}"
+                f"{result['speedup']:>9.2f}{std:>10.3f}{autocorrelation:>10.3f}"
+            )
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Throughput (masks/s) and peak RSS of each stage of the shapes preprocessing chain against interp size.
+Masks come from the random ellipse generator of the shape tests, shapes/tests/utils.py.
+The inputs of a stage are prepared with the stages before it, untimed, and every
+(stage, size) runs in a fresh process so the peak RSS of one does not leak into the next.
+A stage stops early once it has run for --max-seconds, so the slow MDS fits stay bounded.
+
+    python benchmarks/shapes_throughput.py --sizes 64 128 256 512 --output shapes_throughput.json
+"""
+import argparse
+import json
+import multiprocessing
+import resource
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from bioimage_embed.shapes import transforms
+from bioimage_embed.shapes.tests.utils import random_ellipse_masks
+
+
+def crop(masks, window_size, size):
+    crop = transforms.CropCentroidPipeline(window_size)
+    return [crop(Image.fromarray(mask)) for mask in masks]
+
+
+def coords(method):
+    def stage(images, window_size, size):
+        to_coords = transforms.ImageToCoords(size)
+        return [to_coords.get_coords(np.array(image), size, method=method) for image in images]
+
+    return stage
+
+
+def distogram(coords, window_size, size):
+    to_distogram = transforms.CoordsToDistogram(size)
+    return [to_distogram(xy)[None, None] for xy in coords]
+
+
+def distogram_to_coords(method):
+    def stage(distograms, window_size, size):
+        to_coords = transforms.DistogramToCoords(window_size, method=method)
+        return [to_coords(d) for d in distograms]
+
+    return stage
+
+
+def mask(rasteriser):
+    def stage(vertices, window_size, size):
+        to_mask = transforms.VerticesToMask(window_size, rasteriser=rasteriser)
+        return [to_mask(v) for v in vertices]
+
+    return stage
+
+
+# Each stage with the stage whose output it consumes
+STAGES = {
+    "CropCentroidPipeline": (crop, None),
+    "ImageToCoords uniform_spline": (coords("uniform_spline"), "CropCentroidPipeline"),
+    "ImageToCoords cubic_polar": (coords("cubic_polar"), "CropCentroidPipeline"),
+    "CoordsToDistogram": (distogram, "ImageToCoords uniform_spline"),
+    "DistogramToCoords MDS": (distogram_to_coords("MDS"), "CoordsToDistogram"),
+    "DistogramToCoords calculate_positions": (
+        distogram_to_coords("Matrix"),
+        "CoordsToDistogram",
+    ),
+    "DistogramToCoords classical": (
+        distogram_to_coords("classical"),
+        "CoordsToDistogram",
+    ),
+    "VerticesToMask skimage": (mask("skimage"), "DistogramToCoords classical"),
+    "VerticesToMask torch": (mask("torch"), "DistogramToCoords classical"),
+}
+
+
+def stage_input(name, masks, window_size, size):
+    _, parent = STAGES[name]
+    if parent is None:
+        return masks
+    fn, _ = STAGES[parent]
+    return fn(stage_input(parent, masks, window_size, size), window_size, size)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+def measure(name, size, num_masks, image_size, window_size, max_seconds):
+    masks = random_ellipse_masks(num_masks, image_size)
+    inputs = stage_input(name, masks, window_size, size)
+    fn, _ = STAGES[name]
+    baseline = peak_rss_mb()
+    done = 0
+    start = time.perf_counter()
+    for x in inputs:
+        fn([x], window_size, size)
+        done += 1
+        if time.perf_counter() - start > max_seconds:
+            break
+    elapsed = time.perf_counter() - start
+    return {
+        "stage": name,
+        "interp_size": size,
+        "masks": done,
+        "seconds": elapsed,
+        "masks_per_sec": done / elapsed,
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_rss_increase_mb": peak_rss_mb() - baseline,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 128, 256, 512])
+    parser.add_argument("--stages", nargs="+", default=list(STAGES))
+    parser.add_argument("--masks", type=int, default=64)
+    parser.add_argument("--image-size", type=int, default=96)
+    parser.add_argument("--window-size", type=int, default=64)
+    parser.add_argument("--max-seconds", type=float, default=10)
+    parser.add_argument("--output", type=Path, help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    print(f"{'stage':<40}{'size':>6}{'masks':>7}{'masks/s':>11}{'peak MB':>10}{'+MB':>8}")
+    for size in args.sizes:
+        for name in args.stages:
+            with context.Pool(1) as pool:
+                result = pool.apply(
+                    measure,
+                    (
+                        name,
+                        size,
+                        args.masks,
+                        args.image_size,
+                        args.window_size,
+                        args.max_seconds,
+                    ),
+                )
+            results.append(result)
+            print(
+                f"{name:<40}{size:>6}{result['masks']:>7}{result['masks_per_sec']:>11.1f}"
+                f"{result['peak_rss_mb']:>10.1f}{result['peak_rss_increase_mb']:>8.1f}"
+            )
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
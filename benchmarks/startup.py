@@ -0,0 +1,155 @@
+"""
+Startup benchmarks: cold imports, BioImageEmbed(Config()) construction, create_model
+and one forward/backward pass for every model in __all_small_models__.
+Every measurement runs in a fresh process, so imports and caches of one do not speed up the next,
+and the best of --repeats runs is kept.
+
+Results are compared against a JSON baseline and the script exits non-zero
+when any metric is more than --threshold percent slower. Timings only compare on one
+machine, so no baseline is committed: the first run on a machine saves its results as
+the baseline of that host in the user cache, and later runs compare against it.
+Save a new one after a deliberate change, e.g. on the base branch in CI:
+
+    python benchmarks/startup.py --save-baseline
+    python benchmarks/startup.py --threshold 20
+
+The machine independent budgets, which heavy modules `import bioimage_embed` and the
+CLI must not import, are tests in bioimage_embed/tests/test_import_time.py.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BASELINE = (
+    Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+    / "bioimage_embed"
+    / f"startup_baseline-{platform.node()}.json"
+)
+
+
+def cold_import(module):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", f"import {module}"], check=True)
+    return time.perf_counter() - start
+
+
+def construct():
+    from bioimage_embed import BioImageEmbed, Config
+
+    # make_dirs writes models/, logs/ etc. to the working directory
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        start = time.perf_counter()
+        BioImageEmbed(Config())
+        return time.perf_counter() - start
+
+
+def create(model, input_dim):
+    from bioimage_embed.models import create_model
+
+    # The first build also pays for the lazy pythae/pl_bolts imports, timed separately
+    create_model(model, input_dim, 64, pretrained=False)
+    start = time.perf_counter()
+    create_model(model, input_dim, 64, pretrained=False)
+    return time.perf_counter() - start
+
+
+def forward_backward(model, input_dim):
+    import torch
+    from bioimage_embed.lightning import AEUnsupervised
+    from bioimage_embed.models import create_model
+
+    lit_model = AEUnsupervised(create_model(model, input_dim, 64, pretrained=False))
+    # Batch of two, batchnorm needs more than one value per channel in training mode
+    x = torch.rand(2, *input_dim)
+    # Warm up so one-off allocator and thread pool setup is not timed
+    lit_model(x).loss.backward()
+    start = time.perf_counter()
+    lit_model(x).loss.backward()
+    return time.perf_counter() - start
+
+
+def benchmarks(input_dim):
+    from bioimage_embed.models.factory import __all_small_models__
+
+    yield "import bioimage_embed", cold_import, ("bioimage_embed",)
+    yield "import bioimage_embed.bie", cold_import, ("bioimage_embed.bie",)
+    yield "import bioimage_embed.models.bolts", cold_import, ("bioimage_embed.models.bolts",)
+    yield "BioImageEmbed(Config())", construct, ()
+    for model in __all_small_models__:
+        yield f"create_model {model}", create, (model, input_dim)
+    for model in __all_small_models__:
+        yield f"forward/backward {model}", forward_backward, (model, input_dim)
+
+
+def regressions(results, baseline, threshold):
+    """
+    Metrics that got more than `threshold` percent slower than the baseline
+    """
+    return {
+        name: (baseline[name], seconds)
+        for name, seconds in results.items()
+        if name in baseline and seconds > baseline[name] * (1 + threshold / 100)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument(
+        "--threshold", type=float, default=20, help="Allowed slowdown in percent"
+    )
+    parser.add_argument("--baseline", type=Path, default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--output", type=Path, help="Write the results to this JSON file")
+    parser.add_argument("--input-dim", type=int, nargs=3, default=None)
+    args = parser.parse_args()
+
+    from bioimage_embed.config import Model
+
+    input_dim = args.input_dim or list(Model().input_dim)
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.is_file() else {}
+
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    print(f"{'benchmark':<40}{'seconds':>10}{'baseline':>10}{'change':>9}")
+    for name, fn, fn_args in benchmarks(input_dim):
+        timings = []
+        for _ in range(args.repeats):
+            with context.Pool(1) as pool:
+                timings.append(pool.apply(fn, fn_args))
+        results[name] = min(timings)
+        if name in baseline:
+            change = f"{100 * (results[name] / baseline[name] - 1):+.0f}%"
+            print(f"{name:<40}{results[name]:>10.3f}{baseline[name]:>10.3f}{change:>9}")
+        else:
+            print(f"{name:<40}{results[name]:>10.3f}{'-':>10}{'-':>9}")
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2) + "\n")
+    if args.save_baseline or not baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"Saved baseline to {args.baseline}")
+        return
+
+    slower = regressions(results, baseline, args.threshold)
+    for name, (before, after) in slower.items():
+        print(
+            f"REGRESSION {name}: {before:.3f}s -> {after:.3f}s "
+            f"(more than {args.threshold:g}% slower)"
+        )
+    sys.exit(1 if slower else 0)
+
+
+if __name__ == "__main__":
+    main()
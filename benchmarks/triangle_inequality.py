@@ -0,0 +1,78 @@
+"""
+Peak memory and time of the triangle inequality losses against distogram size n.
+Every measurement runs in a fresh process so the peak RSS of one run does not leak into the next.
+
+    python benchmarks/triangle_inequality.py --sizes 64 128 256 512
+"""
+import argparse
+import multiprocessing
+import resource
+import time
+
+import torch
+
+from bioimage_embed.shapes import loss_functions as lf
+
+
+def combinations_loss(D):
+    flat_D = D.view(-1, *D.shape[-2:])
+    return torch.stack([lf.triangle_inequality_loss_2D(d) for d in flat_D]).mean()
+
+
+METHODS = {
+    "combinations": combinations_loss,
+    "sampled": lf.triangle_inequality_loss,
+    "minplus": lf.triangle_inequality_loss_minplus,
+}
+
+
+def peak_memory_mb(device):
+    if device.type == "cuda":
+        return torch.cuda.max_memory_allocated(device) / 2**20
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+def measure(method, n, batch, device):
+    device = torch.device(device)
+    D = torch.rand(batch, 3, n, n, device=device, requires_grad=True)
+    if device.type == "cuda":
+        torch.cuda.reset_peak_memory_stats(device)
+    baseline = peak_memory_mb(device)
+    start = time.perf_counter()
+    METHODS[method](D).backward()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    elapsed = time.perf_counter() - start
+    return peak_memory_mb(device) - baseline, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 128, 256, 512])
+    parser.add_argument("--batch", type=int, default=4)
+    parser.add_argument("--methods", nargs="+", default=list(METHODS))
+    parser.add_argument(
+        "--max-combinations",
+        type=int,
+        default=256,
+        help="Largest n to run the O(n^3) combinations loss at",
+    )
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    print(f"{'method':<14}{'n':>6}{'peak MB':>12}{'seconds':>10}")
+    for n in args.sizes:
+        for method in args.methods:
+            if method == "combinations" and n > args.max_combinations:
+                continue
+            with context.Pool(1) as pool:
+                memory, elapsed = pool.apply(
+                    measure, (method, n, args.batch, args.device)
+                )
+            print(f"{method:<14}{n:>6}{memory:>12.1f}{elapsed:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
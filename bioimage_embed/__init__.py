@@ -1,26 +1,63 @@
-import torch
-
-torch.cuda.empty_cache()
-# from . import models, lightning, cli, export, config
-from .lightning import AESupervised, AEUnsupervised, AE,  AutoEncoderSupervised, AutoEncoderUnsupervised, AutoEncoder
-
-# TODO: Fix this import as it currently produces too many warnings
-from .models import ModelFactory, create_model
-from .bie import BioImageEmbed
-from .config import Config
-from . import augmentations
-
+# Everything is imported on first access (PEP 562), so that `import bioimage_embed`
+# and the CLI stay fast and only pull in torch, lightning and the model zoo when used
+import importlib
 import logging
+
 logging.captureWarnings(True)
 
+_attributes = {
+    "AESupervised": ".lightning",
+    "AEUnsupervised": ".lightning",
+    "AE": ".lightning",
+    "AutoEncoderSupervised": ".lightning",
+    "AutoEncoderUnsupervised": ".lightning",
+    "AutoEncoder": ".lightning",
+    "ModelFactory": ".models",
+    "create_model": ".models",
+    "BioImageEmbed": ".bie",
+    "Config": ".config",
+    "app": ".cli",
+}
+_submodules = {
+    "augmentations",
+    "batch_augmentations",
+    "bie",
+    "cli",
+    "config",
+    "datasets",
+    "evaluation",
+    "inference",
+    "lightning",
+    "models",
+    "shapes",
+    "transforms",
+    "utils",
+}
+
 __all__ = [
     "AESupervised",
     "AutoEncoderUnsupervised",
     "AEUnsupervised",
     "AutoEncoderSupervised",
-    "AutoEncoder"
-    "AE"
+    "AutoEncoder",
+    "AE",
     "BioImageEmbed",
     "Config",
+    "ModelFactory",
+    "create_model",
     "augmentations",
 ]
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module(f".{name}", __name__)
+    if name in _attributes:
+        value = getattr(importlib.import_module(_attributes[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted({*globals(), *_attributes, *_submodules})
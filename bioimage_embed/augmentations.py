@@ -1,7 +1,14 @@
+import os
+import random
+from pathlib import Path
+
 import albumentations as A
+import cv2
 import numpy as np
 from albumentations.pytorch import ToTensorV2
 
+from .utils import INVALID, is_invalid
+
 DEFAULT_AUGMENTATION_LIST = [
     A.OneOf(
         [
@@ -32,19 +39,302 @@ DEFAULT_AUGMENTATION_LIST = [
 DEFAULT_AUGMENTATION = A.Compose(DEFAULT_AUGMENTATION_LIST)
 DEFAULT_ALBUMENTATION = A.Compose(DEFAULT_AUGMENTATION_LIST)
 
+# Displacement field banks of this process, by their parameters other than the size
+_field_banks = {}
+
+
+def bank_file_name(bank_size, size, alpha, sigma, approximate, same_dxdy, seed):
+    flags = f"{int(approximate)}{int(same_dxdy)}"
+    return f"elastic_{bank_size}_{size}_{alpha:g}_{sigma:g}_{flags}_{seed}.npy"
+
+
+def elastic_field_bank(
+    bank_size=64,
+    size=256,
+    alpha=1.0,
+    sigma=50.0,
+    approximate=False,
+    same_dxdy=False,
+    seed=0,
+    bank_dir=None,
+) -> np.ndarray:
+    """
+    (bank_size, 2, S, S) float32 displacement fields (dx, dy), S >= size, smoothed
+    uniform noise as albumentations' ElasticTransform draws it for a S x S image.
+    Built once per process, or with `bank_dir` once per machine: saved there as .npy,
+    named by its parameters, and memory-mapped by every process that needs it.
+    A bank at least `size` wide is reused rather than built again, fields are cropped
+    to the image by BankedElasticTransform.
+    """
+    params = (bank_size, alpha, sigma, approximate, same_dxdy, seed)
+    key = (*params, bank_dir)
+    bank = _field_banks.get(key)
+    if bank is not None and bank.shape[-1] >= size:
+        return bank
+    if bank_dir is not None:
+        pattern = bank_file_name(bank_size, "*", *params[1:])
+        # The smallest bank saved that is large enough
+        for path in sorted(Path(bank_dir).glob(pattern), key=os.path.getsize):
+            saved = np.load(path, mmap_mode="r")
+            if saved.shape[-1] >= size:
+                _field_banks[key] = saved
+                return saved
+
+    from scipy.ndimage import gaussian_filter
+
+    rng = np.random.RandomState(seed)
+    bank = np.empty((bank_size, 2, size, size), dtype=np.float32)
+    for fields in bank:
+        for i in range(1 if same_dxdy else 2):
+            noise = (rng.rand(size, size) * 2 - 1).astype(np.float32)
+            if approximate:
+                fields[i] = cv2.GaussianBlur(noise, (17, 17), sigma) * alpha
+            else:
+                fields[i] = gaussian_filter(noise, sigma) * alpha
+        if same_dxdy:
+            fields[1] = fields[0]
+    if bank_dir is not None:
+        path = Path(bank_dir) / bank_file_name(bank_size, size, *params[1:])
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write then rename, other workers may be loading the same bank
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp.npy")
+        np.save(tmp_path, bank)
+        os.replace(tmp_path, path)
+        bank = np.load(path, mmap_mode="r")
+    _field_banks[key] = bank
+    return bank
+
+
+class BankedElasticTransform(A.DualTransform):
+    """
+    ElasticTransform drawing its smoothed displacement fields from a precomputed bank
+    (see elastic_field_bank) instead of filtering new noise for every image.
+    Each image gets a random field of the bank, in one of its 8 flips/rotations by
+    90 degrees, at a random offset when the field is larger than the image, optionally
+    rescaled by up to `scale_limit`. The random affine part is drawn per image as in
+    ElasticTransform and both are applied in a single remap.
+
+    Fields are square, at least `field_size` wide and grown to the largest image seen.
+    Larger banks already built, or saved in `bank_dir`, are cropped instead of rebuilt.
+    The flips and rotations keep the statistics of the fields, rescaling stretches their
+    smoothness by the same factor, so scale_limit is 0 by default.
+    """
+
+    def __init__(
+        self,
+        alpha=1,
+        sigma=50,
+        alpha_affine=50,
+        interpolation=cv2.INTER_LINEAR,
+        border_mode=cv2.BORDER_REFLECT_101,
+        value=None,
+        mask_value=None,
+        approximate=False,
+        same_dxdy=False,
+        bank_size=64,
+        field_size=256,
+        scale_limit=0.0,
+        seed=0,
+        bank_dir=None,
+        always_apply=False,
+        p=0.5,
+    ):
+        super().__init__(always_apply=always_apply, p=p)
+        self.alpha = alpha
+        self.sigma = sigma
+        self.alpha_affine = alpha_affine
+        self.interpolation = interpolation
+        self.border_mode = border_mode
+        self.value = value
+        self.mask_value = mask_value
+        self.approximate = approximate
+        self.same_dxdy = same_dxdy
+        self.bank_size = bank_size
+        self.field_size = field_size
+        self.scale_limit = scale_limit
+        self.seed = seed
+        self.bank_dir = bank_dir
+
+    @property
+    def targets_as_params(self):
+        return ["image"]
+
+    def bank(self, height, width) -> np.ndarray:
+        self.field_size = max(self.field_size, height, width)
+        return elastic_field_bank(
+            self.bank_size,
+            self.field_size,
+            self.alpha,
+            self.sigma,
+            self.approximate,
+            self.same_dxdy,
+            self.seed,
+            self.bank_dir,
+        )
+
+    def displacement(self, height, width):
+        """
+        (dx, dy) for a height x width image from a random field of the bank
+        """
+        bank = self.bank(height, width)
+        size = bank.shape[-1]
+        scale = 1 + random.uniform(-self.scale_limit, self.scale_limit)
+        crop_height = min(size, max(1, round(height * scale)))
+        crop_width = min(size, max(1, round(width * scale)))
+        y = random.randint(0, size - crop_height)
+        x = random.randint(0, size - crop_width)
+        fields = bank[random.randrange(len(bank))]
+        if random.random() < 0.5:
+            # Transposed field, its components swap
+            dy, dx = (f[x : x + crop_width, y : y + crop_height].T for f in fields)
+        else:
+            dx, dy = (f[y : y + crop_height, x : x + crop_width] for f in fields)
+        # A flip of the field negates the displacement along the flipped axis
+        if random.random() < 0.5:
+            dx, dy = -dx[:, ::-1], dy[:, ::-1]
+        if random.random() < 0.5:
+            dx, dy = dx[::-1], -dy[::-1]
+        if (crop_height, crop_width) != (height, width):
+            dx = cv2.resize(np.ascontiguousarray(dx), (width, height))
+            dy = cv2.resize(np.ascontiguousarray(dy), (width, height))
+        return dx, dy
+
+    def affine(self, height, width) -> np.ndarray:
+        """
+        Inverse of ElasticTransform's random affine warp, mapping output to input pixels
+        """
+        center_square = np.array((height, width), dtype=np.float32) // 2
+        square_size = min((height, width)) // 3
+        pts1 = np.array(
+            [
+                center_square + square_size,
+                [center_square[0] + square_size, center_square[1] - square_size],
+                center_square - square_size,
+            ],
+            dtype=np.float32,
+        )
+        shift = np.random.uniform(-self.alpha_affine, self.alpha_affine, pts1.shape)
+        pts2 = pts1 + shift.astype(np.float32)
+        return cv2.invertAffineTransform(cv2.getAffineTransform(pts1, pts2))
+
+    def get_params_dependent_on_targets(self, params):
+        height, width = params["image"].shape[:2]
+        dx, dy = self.displacement(height, width)
+        y, x = np.mgrid[:height, :width].astype(np.float32)
+        x, y = x + dx, y + dy
+        if self.alpha_affine:
+            m = self.affine(height, width)
+            x, y = (
+                m[0, 0] * x + m[0, 1] * y + m[0, 2],
+                m[1, 0] * x + m[1, 1] * y + m[1, 2],
+            )
+        return {"map_x": x.astype(np.float32), "map_y": y.astype(np.float32)}
+
+    def remap(self, img, map_x, map_y, interpolation, value):
+        return cv2.remap(
+            img,
+            map_x,
+            map_y,
+            interpolation=interpolation,
+            borderMode=self.border_mode,
+            borderValue=value,
+        )
+
+    def apply(
+        self, img, map_x=None, map_y=None, interpolation=cv2.INTER_LINEAR, **params
+    ):
+        return self.remap(img, map_x, map_y, interpolation, self.value)
+
+    def apply_to_mask(self, img, map_x=None, map_y=None, **params):
+        return self.remap(img, map_x, map_y, cv2.INTER_NEAREST, self.mask_value)
+
+    def get_transform_init_args_names(self):
+        return (
+            "alpha",
+            "sigma",
+            "alpha_affine",
+            "interpolation",
+            "border_mode",
+            "value",
+            "mask_value",
+            "approximate",
+            "same_dxdy",
+            "bank_size",
+            "field_size",
+            "scale_limit",
+            "seed",
+            "bank_dir",
+        )
+
+
+def with_elastic_bank(transforms, **kwargs):
+    """
+    `transforms` with every ElasticTransform, also inside OneOf/Compose, swapped for a
+    BankedElasticTransform with the same parameters, kwargs set the bank, e.g.
+    A.Compose(with_elastic_bank(DEFAULT_AUGMENTATION_LIST, bank_dir="elastic_banks")).
+    """
+    swapped = []
+    for t in transforms:
+        if isinstance(t, A.ElasticTransform):
+            args = t.get_base_init_args()
+            args.update({k: getattr(t, k) for k in t.get_transform_init_args_names()})
+            t = BankedElasticTransform(**args, **kwargs)
+        elif isinstance(t, A.BaseCompose):
+            t = type(t)(with_elastic_bank(t.transforms, **kwargs), p=t.p)
+        swapped.append(t)
+    return swapped
+
 
 class VisionWrapper:
-    def __init__(self, transform_dict, *args, **kwargs):
+    """
+    Applies an albumentations pipeline to one image, returning INVALID when that fails.
+
+    With batch=True the transforms that have a batched implementation are left out and
+    returned by `batch_transform` instead, as a BatchAugmentation that the DataModule
+    runs on whole training batches on the device, see batch_augmentations.
+    Transforms up to the last one that sets the image size stay per image, unless
+    same_size=True says the images all share one size already: for the default pipeline
+    batch=True alone only moves GaussNoise and RandomBrightnessContrast to the batch,
+    the flips, Rotate, ElasticTransform and RandomResizedCrop move with same_size=True.
+
+    elastic_bank=True swaps the ElasticTransforms run per image for BankedElasticTransforms
+    with the same parameters, their banks saved in `elastic_bank_dir` when given.
+    """
+
+    def __init__(
+        self,
+        transform_dict,
+        *args,
+        batch: bool = False,
+        same_size: bool = False,
+        elastic_bank: bool = False,
+        elastic_bank_dir=None,
+        **kwargs,
+    ):
         self.transform_dict = transform_dict
+        self.batch_transform = None
+        if batch:
+            from .batch_augmentations import BatchAugmentation, split_transform_dict
+
+            transform_dict, batch_dict = split_transform_dict(
+                transform_dict, same_size=same_size
+            )
+            self.batch_transform = BatchAugmentation(batch_dict)
         self.transform = A.from_dict(transform_dict)
+        if elastic_bank:
+            (self.transform,) = with_elastic_bank(
+                [self.transform], bank_dir=elastic_bank_dir
+            )
 
     def __call__(self, image):
+        if is_invalid(image):
+            return INVALID
         try:
             img = np.array(image)
             transformed = self.transform(image=img)
             return transformed["image"]
         except Exception:
-            return None, 0
+            return INVALID
 
 
 class VisionWrapperSupervised:
@@ -0,0 +1,445 @@
+"""
+Batched augmentation on whole (B, C, H, W) float tensors, on whatever device the batch is on,
+as an alternative to running the albumentations pipeline image by image in the workers.
+
+BatchAugmentation is built from the same albumentations transform_dict as VisionWrapper and
+implements its flips, Rotate, ElasticTransform, RandomResizedCrop, GaussNoise and
+RandomBrightnessContrast, each with its own random parameters per sample. Geometric
+transforms are a single grid_sample per batch. `split_transform_dict` separates a pipeline
+into the part that stays in the workers (decoding, ToFloat, ToTensorV2, anything not
+implemented here, and whatever runs before images are brought to one size) and the part
+run on the batch; see VisionWrapper(batch=True).
+
+Inputs are expected as floats in [0, 1], i.e. after ToFloat, so parameters in pixel units
+(the GaussNoise variance) are divided by `max_value`, 255 for uint8 sources.
+"""
+
+import logging
+import math
+from typing import List, Optional, Tuple
+
+import torch
+import torch.nn.functional as F
+from torch import nn
+
+logger = logging.getLogger(__name__)
+
+# cv2 border modes as grid_sample padding modes, REFLECT_101 is close to "reflection"
+PADDING_MODES = {0: "zeros", 1: "border", 2: "reflection", 4: "reflection"}
+# Transforms that stay in the workers without changing the result, they only convert
+FORMAT_TRANSFORMS = {"ToFloat", "ToTensorV2"}
+
+
+def _uniform(low, high, n, device) -> torch.Tensor:
+    return torch.empty(n, device=device).uniform_(low, high)
+
+
+def _limits(limit) -> Tuple[float, float]:
+    if isinstance(limit, (int, float)):
+        return -abs(limit), abs(limit)
+    return tuple(limit)
+
+
+def pixel_grid(height: int, width: int, device) -> torch.Tensor:
+    """
+    (H, W, 2) pixel coordinates (x, y) of every output pixel.
+    """
+    y, x = torch.meshgrid(
+        torch.arange(height, device=device, dtype=torch.float32),
+        torch.arange(width, device=device, dtype=torch.float32),
+        indexing="ij",
+    )
+    return torch.stack([x, y], dim=-1)
+
+
+def sample_pixels(x, pixels, padding_mode="reflection") -> torch.Tensor:
+    """
+    Bilinear samples of `x` at (B, H, W, 2) pixel coordinates, as cv2.remap does.
+    """
+    height, width = x.shape[-2:]
+    scale = torch.tensor([width, height], device=x.device, dtype=pixels.dtype)
+    grid = (2 * pixels + 1) / scale - 1
+    return F.grid_sample(
+        x, grid, mode="bilinear", padding_mode=padding_mode, align_corners=False
+    )
+
+
+def gaussian_blur(x, sigma: float, radius: Optional[int] = None) -> torch.Tensor:
+    """
+    Separable Gaussian blur of (B, C, H, W) with reflected borders, like scipy's
+    gaussian_filter with its default truncation at 4 sigma.
+    """
+    height, width = x.shape[-2:]
+    if radius is None:
+        radius = int(4 * sigma + 0.5)
+    # Reflection needs the padding to be smaller than the image
+    radius = max(0, min(radius, height - 1, width - 1))
+    offsets = torch.arange(-radius, radius + 1, device=x.device, dtype=x.dtype)
+    kernel = torch.exp(-0.5 * (offsets / sigma) ** 2)
+    kernel = kernel / kernel.sum()
+    channels = x.shape[1]
+    rows = kernel.view(1, 1, 1, -1).expand(channels, 1, 1, -1)
+    x = F.conv2d(F.pad(x, (radius, radius, 0, 0), mode="reflect"), rows, groups=channels)
+    columns = kernel.view(1, 1, -1, 1).expand(channels, 1, -1, 1)
+    return F.conv2d(
+        F.pad(x, (0, 0, radius, radius), mode="reflect"), columns, groups=channels
+    )
+
+
+class BatchTransform(nn.Module):
+    """
+    Applied to each sample with probability p. Subclasses implement `transform` for the
+    samples drawn, or `apply` to see the whole batch and the mask of samples drawn.
+    """
+
+    def __init__(self, p: float = 0.5, always_apply: bool = False, **kwargs):
+        super().__init__()
+        self.p = 1.0 if always_apply else p
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.apply(x, torch.rand(len(x), device=x.device) < self.p)
+
+    def apply(self, x: torch.Tensor, mask: torch.Tensor) -> torch.Tensor:
+        if not mask.any():
+            return x
+        x = x.clone()
+        x[mask] = self.transform(x[mask])
+        return x
+
+    def transform(self, x: torch.Tensor) -> torch.Tensor:
+        raise NotImplementedError
+
+
+class HorizontalFlip(BatchTransform):
+    def transform(self, x):
+        return x.flip(-1)
+
+
+class VerticalFlip(BatchTransform):
+    def transform(self, x):
+        return x.flip(-2)
+
+
+class Rotate(BatchTransform):
+    def __init__(self, limit=90, border_mode=4, p=0.5, **kwargs):
+        super().__init__(p=p, **kwargs)
+        self.limit = _limits(limit)
+        self.padding_mode = PADDING_MODES.get(border_mode, "reflection")
+
+    def transform(self, x):
+        n, _, height, width = x.shape
+        angle = torch.deg2rad(_uniform(*self.limit, n, x.device))
+        cos, sin = torch.cos(angle).view(-1, 1, 1), torch.sin(angle).view(-1, 1, 1)
+        center = torch.tensor([(width - 1) / 2, (height - 1) / 2], device=x.device)
+        offset = pixel_grid(height, width, x.device) - center
+        dx, dy = offset[..., 0], offset[..., 1]
+        pixels = torch.stack([cos * dx - sin * dy, sin * dx + cos * dy], dim=-1)
+        return sample_pixels(x, pixels + center, self.padding_mode)
+
+
+class ElasticTransform(BatchTransform):
+    """
+    albumentations' ElasticTransform: a random affine warp then a smoothed random
+    displacement field, both folded into one sampling grid.
+    """
+
+    def __init__(
+        self,
+        alpha=1,
+        sigma=50,
+        alpha_affine=50,
+        border_mode=4,
+        approximate=False,
+        same_dxdy=False,
+        p=0.5,
+        **kwargs,
+    ):
+        super().__init__(p=p, **kwargs)
+        self.alpha = float(alpha)
+        self.sigma = float(sigma)
+        self.alpha_affine = float(alpha_affine)
+        self.padding_mode = PADDING_MODES.get(border_mode, "reflection")
+        self.radius = 8 if approximate else None
+        self.same_dxdy = same_dxdy
+
+    def affine(self, n, height, width, device) -> torch.Tensor:
+        """
+        (n, 2, 3) maps from output to input pixels of random affine warps,
+        three points of a centred square each moved by up to alpha_affine
+        """
+        center_x, center_y = width // 2, height // 2
+        size = min(height, width) // 3
+        src = torch.tensor(
+            [
+                [center_x + size, center_y + size],
+                [center_x - size, center_y + size],
+                [center_x - size, center_y - size],
+            ],
+            device=device,
+            dtype=torch.float32,
+        ).expand(n, 3, 2)
+        dst = src + _uniform(-self.alpha_affine, self.alpha_affine, (n, 3, 2), device)
+        # Solve [dst, 1] @ M.T = src for the inverse warp, as cv2.warpAffine samples it
+        ones = torch.ones(n, 3, 1, device=device)
+        return torch.linalg.solve(torch.cat([dst, ones], dim=-1), src).transpose(1, 2)
+
+    def transform(self, x):
+        n, _, height, width = x.shape
+        fields = 1 if self.same_dxdy else 2
+        noise = torch.rand(n, fields, height, width, device=x.device) * 2 - 1
+        displacement = gaussian_blur(noise, self.sigma, self.radius) * self.alpha
+        displacement = displacement.expand(n, 2, height, width).permute(0, 2, 3, 1)
+        pixels = pixel_grid(height, width, x.device) + displacement
+        matrix = self.affine(n, height, width, x.device)
+        pixels = torch.einsum("nhwj,nij->nhwi", pixels, matrix[:, :, :2])
+        pixels = pixels + matrix[:, None, None, :, 2]
+        return sample_pixels(x, pixels, self.padding_mode)
+
+
+class RandomResizedCrop(BatchTransform):
+    """
+    Crops of random area and aspect ratio resized to (height, width). Samples not drawn
+    are resized whole, so the batch keeps one shape.
+    """
+
+    def __init__(
+        self,
+        height,
+        width,
+        scale=(0.08, 1.0),
+        ratio=(0.75, 1.3333333333333333),
+        p=1.0,
+        attempts: int = 10,
+        **kwargs,
+    ):
+        super().__init__(p=p, **kwargs)
+        self.size = (height, width)
+        self.scale = tuple(scale)
+        self.ratio = tuple(ratio)
+        self.attempts = attempts
+
+    def boxes(self, n, height, width, device) -> torch.Tensor:
+        """
+        (n, 4) crops as (x0, y0, w, h) drawn like torchvision, the whole image as fallback
+        """
+        shape = (n, self.attempts)
+        area = height * width * _uniform(*self.scale, shape, device)
+        log_ratio = _uniform(*map(math.log, self.ratio), shape, device)
+        w = torch.round(torch.sqrt(area * torch.exp(log_ratio)))
+        h = torch.round(torch.sqrt(area / torch.exp(log_ratio)))
+        valid = (w > 0) & (h > 0) & (w <= width) & (h <= height)
+        # First valid attempt of each sample
+        first = torch.where(valid.any(1), valid.float().argmax(1), -1)
+        rows = torch.arange(n, device=device)
+        w = torch.where(first >= 0, w[rows, first.clamp(min=0)], float(width))
+        h = torch.where(first >= 0, h[rows, first.clamp(min=0)], float(height))
+        x0 = torch.floor(torch.rand(n, device=device) * (width - w + 1))
+        y0 = torch.floor(torch.rand(n, device=device) * (height - h + 1))
+        return torch.stack([x0, y0, w, h], dim=1)
+
+    def apply(self, x, mask):
+        n, _, height, width = x.shape
+        boxes = self.boxes(n, height, width, x.device)
+        whole = torch.tensor([0, 0, width, height], device=x.device, dtype=boxes.dtype)
+        boxes = torch.where(mask[:, None], boxes, whole)
+        out_height, out_width = self.size
+        grid = pixel_grid(out_height, out_width, x.device) + 0.5
+        scale = torch.tensor([out_width, out_height], device=x.device)
+        boxes = boxes[:, None, None]
+        pixels = boxes[..., :2] + grid / scale * boxes[..., 2:] - 0.5
+        return sample_pixels(x, pixels, "border")
+
+
+class GaussNoise(BatchTransform):
+    def __init__(
+        self,
+        var_limit=(10.0, 50.0),
+        mean=0,
+        per_channel=True,
+        p=0.5,
+        max_value=255.0,
+        **kwargs,
+    ):
+        super().__init__(p=p, **kwargs)
+        if isinstance(var_limit, (int, float)):
+            var_limit = (0, var_limit)
+        self.var_limit = tuple(var_limit)
+        self.mean = mean
+        self.per_channel = per_channel
+        self.max_value = max_value
+
+    def transform(self, x):
+        n, channels, height, width = x.shape
+        std = torch.sqrt(_uniform(*self.var_limit, n, x.device)).view(-1, 1, 1, 1)
+        shape = (n, channels if self.per_channel else 1, height, width)
+        noise = torch.randn(shape, device=x.device) * std + self.mean
+        return (x + noise / self.max_value).clamp(0, 1)
+
+
+class RandomBrightnessContrast(BatchTransform):
+    def __init__(
+        self,
+        brightness_limit=0.2,
+        contrast_limit=0.2,
+        brightness_by_max=True,
+        p=0.5,
+        **kwargs,
+    ):
+        super().__init__(p=p, **kwargs)
+        self.brightness_limit = _limits(brightness_limit)
+        self.contrast_limit = _limits(contrast_limit)
+        self.brightness_by_max = brightness_by_max
+
+    def transform(self, x):
+        n = len(x)
+        alpha = 1 + _uniform(*self.contrast_limit, n, x.device).view(-1, 1, 1, 1)
+        beta = _uniform(*self.brightness_limit, n, x.device).view(-1, 1, 1, 1)
+        x = x * alpha
+        if not self.brightness_by_max:
+            beta = beta * x.mean(dim=(1, 2, 3), keepdim=True)
+        return (x + beta).clamp(0, 1)
+
+
+class OneOf(BatchTransform):
+    """
+    With probability p one of `transforms`, chosen per sample with weights their own p.
+    """
+
+    def __init__(self, transforms: List[BatchTransform], p=0.5, **kwargs):
+        super().__init__(p=p, **kwargs)
+        self.transforms = nn.ModuleList(transforms)
+        weights = torch.tensor([t.p for t in transforms], dtype=torch.float32)
+        self.register_buffer("weights", weights / weights.sum(), persistent=False)
+
+    def apply(self, x, mask):
+        choice = torch.multinomial(self.weights, len(x), replacement=True).to(x.device)
+        for i, transform in enumerate(self.transforms):
+            x = transform.apply(x, mask & (choice == i))
+        return x
+
+
+class Compose(BatchTransform):
+    def __init__(self, transforms: List[BatchTransform], p=1.0, **kwargs):
+        super().__init__(p=p, **kwargs)
+        self.transforms = nn.ModuleList(transforms)
+
+    def apply(self, x, mask):
+        for transform in self.transforms:
+            keep = torch.rand(len(x), device=x.device) < transform.p
+            x = transform.apply(x, mask & keep)
+        return x
+
+
+TRANSFORMS = {
+    cls.__name__: cls
+    for cls in (
+        HorizontalFlip,
+        VerticalFlip,
+        Rotate,
+        ElasticTransform,
+        RandomResizedCrop,
+        GaussNoise,
+        RandomBrightnessContrast,
+        OneOf,
+        Compose,
+    )
+}
+
+
+def _name(spec: dict) -> str:
+    return spec["__class_fullname__"].split(".")[-1]
+
+
+def is_supported(spec: dict) -> bool:
+    if _name(spec) not in TRANSFORMS:
+        return False
+    return all(is_supported(child) for child in spec.get("transforms", []))
+
+
+def from_spec(spec: dict, max_value: float = 255.0) -> BatchTransform:
+    """
+    BatchTransform of one entry of an albumentations transform dict.
+    """
+    name = _name(spec)
+    if not is_supported(spec):
+        raise ValueError(f"{name} has no batched implementation")
+    kwargs = {k: v for k, v in spec.items() if k != "__class_fullname__"}
+    if "transforms" in kwargs:
+        kwargs["transforms"] = [from_spec(t, max_value) for t in kwargs["transforms"]]
+    if name == "GaussNoise":
+        kwargs["max_value"] = max_value
+    return TRANSFORMS[name](**kwargs)
+
+
+def changes_shape(spec: dict) -> bool:
+    """
+    True for transforms with an output size, e.g. RandomResizedCrop or Resize.
+    """
+    if "height" in spec or "width" in spec:
+        return True
+    return any(changes_shape(child) for child in spec.get("transforms", []))
+
+
+def split_transform_dict(
+    transform_dict: dict, same_size: bool = False
+) -> Tuple[dict, dict]:
+    """
+    Splits the Compose of an albumentations transform dict into the transforms that stay
+    per image, run first, and the ones with a batched implementation, run on the batch after.
+
+    Images can only be collated into a batch once they share a size, so the last transform
+    that sets the size (RandomResizedCrop in the default pipeline) and everything before it
+    stay per image. With `same_size`, for datasets whose images all have one size anyway,
+    every transform with a batched implementation moves to the batch.
+    """
+    spec = transform_dict.get("transform", transform_dict)
+    transforms = spec["transforms"]
+    start = 0
+    if not same_size:
+        resizing = [i for i, t in enumerate(transforms) if changes_shape(t)]
+        start = resizing[-1] + 1 if resizing else 0
+    cpu, batch = list(transforms[:start]), []
+    for t in transforms[start:]:
+        if is_supported(t):
+            batch.append(t)
+            continue
+        if batch and _name(t) not in FORMAT_TRANSFORMS:
+            logger.warning(
+                f"{_name(t)} now runs before {', '.join(map(_name, batch))}, "
+                "which run on the batch"
+            )
+        cpu.append(t)
+
+    def compose(transforms):
+        new = {**spec, "transforms": transforms}
+        if "transform" in transform_dict:
+            return {**transform_dict, "transform": new}
+        return new
+
+    return compose(cpu), compose(batch)
+
+
+class BatchAugmentation(nn.Module):
+    """
+    The batched transforms of an albumentations transform dict, applied to a (B, C, H, W)
+    float batch in [0, 1]. Transforms without a batched implementation raise ValueError,
+    pass the dict through split_transform_dict first to keep those per image.
+
+    Args:
+        transform_dict: albumentations.to_dict() of a Compose, as in config.Transform.
+        max_value: Maximum of the source dtype, pixel-unit parameters are divided by it.
+    """
+
+    def __init__(self, transform_dict: dict, max_value: float = 255.0):
+        super().__init__()
+        spec = transform_dict.get("transform", transform_dict)
+        self.transform = from_spec(spec, max_value)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        if not torch.is_floating_point(x):
+            raise ValueError(
+                f"Batch augmentation expects floats in [0, 1], got {x.dtype}, "
+                "keep ToFloat in the per image transforms"
+            )
+        with torch.no_grad():
+            return self.transform(x)
@@ -8,7 +8,7 @@ from .lightning import DataModule
 from hydra.utils import instantiate
 from torch.autograd import Variable
 from pytorch_lightning import seed_everything
-from . import utils, config
+from . import utils, config, inference
 
 logging.basicConfig(level=logging.INFO)
 
@@ -126,9 +126,54 @@ class BioImageEmbed:
     def forward(self, x):
         self.icfg.lit_model(x)
 
-    def infer(self, ckpt_path="best"):
+    def infer(self, ckpt_path="best", output=None, **kwargs):
+        """
+        Without `output` this returns the trainer.predict outputs in memory.
+        With `output` the embeddings are streamed to Parquet shards in that directory instead,
+        see inference.stream_embeddings for the keyword arguments.
+        """
+        if output is not None:
+            return self.infer_to_disk(output, ckpt_path=ckpt_path, **kwargs)
         return self(self.icfg.dataset, ckpt_path)
 
+    def resolve_checkpoint(self, ckpt_path):
+        if ckpt_path not in ("best", "last"):
+            return ckpt_path
+        for callback in self.icfg.trainer.callbacks:
+            if isinstance(callback, ModelCheckpoint):
+                if ckpt_path == "best" and callback.best_model_path:
+                    return callback.best_model_path
+                last = callback.last_model_path or os.path.join(
+                    str(callback.dirpath), "last.ckpt"
+                )
+                if os.path.isfile(last):
+                    return last
+        return None
+
+    def infer_to_disk(self, output, ckpt_path="best", **kwargs):
+        """
+        Embeds with the weights of `ckpt_path`, raising FileNotFoundError when "best" or
+        "last" resolves to no checkpoint. Only ckpt_path=None embeds with the current weights.
+        """
+        if ckpt_path is not None:
+            resolved = self.resolve_checkpoint(ckpt_path)
+            if not resolved:
+                raise FileNotFoundError(
+                    f"No {ckpt_path} checkpoint found, pass ckpt_path=None "
+                    "to embed with the current weights"
+                )
+            checkpoint = torch.load(resolved, map_location="cpu")
+            self.icfg.lit_model.load_state_dict(checkpoint["state_dict"])
+        else:
+            logging.warning("Embedding with the current weights, no checkpoint is loaded")
+        kwargs.setdefault("batch_size", self.icfg.recipe.batch_size)
+        return inference.stream_embeddings(
+            self.icfg.lit_model,
+            self.icfg.dataloader.dataset,
+            output,
+            **kwargs,
+        )
+
         # dataloader = DataModule(
 
         #     batch_size=1,
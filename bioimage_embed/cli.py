@@ -1,31 +1,47 @@
-# TODO: CLI autocomplete is currently quite slow
-from . import BioImageEmbed, Config
+"""
+Command line entry points.
 
-from omegaconf import OmegaConf
-from hydra import compose, initialize
-from hydra.core.config_store import ConfigStore
+`bie` is a typer app and the bie_train/bie_check/bie_infer/bie_finetune scripts are hydra apps,
+both take hydra overrides e.g. `bie train recipe.model=resnet18_vqvae`.
+Hydra, torch and the models are only imported once a command actually runs,
+so `bie --help` and tab-completion stay fast.
+"""
 
-import hydra
+from pathlib import Path
+from typing import List, Optional
 
-cs = ConfigStore.instance()
-cs.store(name="config", node=Config)
+import typer
+
+app = typer.Typer(
+    help="Train and run bioimage_embed models, configured with hydra overrides.",
+    no_args_is_help=True,
+    # Plain click help, rendering it with rich costs more than every import put together
+    rich_markup_mode=None,
+    pretty_exceptions_enable=False,
+)
+OVERRIDES = dict(allow_extra_args=True, ignore_unknown_options=True)
+
+
+def register_configs():
+    from hydra.core.config_store import ConfigStore
+    from .config import Config
+
+    cs = ConfigStore.instance()
+    cs.store(name="config", node=Config)
 
 
 def write_default_config_file(config_path):
+    from omegaconf import OmegaConf
+
     cfg = get_default_config()
     config_path.parent.mkdir(parents=True, exist_ok=True)
     with open(config_path, "w") as file:
         file.write(OmegaConf.to_yaml(cfg))
 
 
-# TODO make this work with typer (hard)
-# @typer.command()
-# @hydra.main(config_path="conf", config_name="config")
-# def main(cfg: DictConfig):
-#     print(cfg)
-
-
 def init_hydra(config_dir="conf", config_file="config.yaml", job_name="bie"):
+    import hydra
+
     hydra.initialize(
         version_base=None,
         config_path=config_dir,
@@ -34,36 +50,156 @@ def init_hydra(config_dir="conf", config_file="config.yaml", job_name="bie"):
     return hydra.compose(config_name=config_file)
 
 
-def get_default_config(config_name="config"):
+def get_default_config(config_name="config", overrides=None):
+    from hydra import compose, initialize
+
+    register_configs()
     with initialize(config_path=None, version_base=None):
-        cfg = compose(config_name=config_name)
+        cfg = compose(config_name=config_name, overrides=overrides or [])
     return cfg
 
 
-# TODO smarter way to handle this
-@hydra.main(config_path=".", config_name="config", version_base="1.1.0")
-def infer():
-    pass
+def run_train(cfg):
+    from .bie import BioImageEmbed
 
-
-@hydra.main(config_path=".", config_name="config", version_base="1.1.0")
-def train(cfg: Config):
     bie = BioImageEmbed(cfg)
     bie.train()
 
 
-@hydra.main(config_path=".", config_name="config", version_base="1.1.0")
-def check(cfg: Config):
+def run_check(cfg):
+    from .bie import BioImageEmbed
+
     bie = BioImageEmbed(cfg)
     bie.check()
 
 
-@hydra.main(config_path=".", config_name="config", version_base="1.1.0")
-def finetune(cfg: Config):
-    pass
+def run_infer(cfg):
+    """
+    Batch embedding job, e.g.
+    bie_infer inference.ckpt_path=models/<uuid>/last.ckpt inference.batch_size=512 inference.bf16=true
+    """
+    from .bie import BioImageEmbed
+
+    bie = BioImageEmbed(cfg)
+    return bie.infer(**bie.icfg.inference)
+
+
+def run_finetune(cfg):
+    from .bie import BioImageEmbed
+
     bie = BioImageEmbed(cfg)
     bie.finetune()
 
 
-# app.command()(train)
-# app.command()(infer)
+# Hydra apps for the bie_* scripts, built on first access (PEP 562) as hydra.main needs hydra and the Config schema
+hydra_commands = {
+    "train": run_train,
+    "check": run_check,
+    "infer": run_infer,
+    "finetune": run_finetune,
+}
+
+
+def __getattr__(name):
+    if name in hydra_commands:
+        import hydra
+
+        register_configs()
+        command = hydra.main(config_path=".", config_name="config", version_base="1.1.0")(
+            hydra_commands[name]
+        )
+        globals()[name] = command
+        return command
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+@app.command("train", context_settings=OVERRIDES)
+def train_command(overrides: Optional[List[str]] = typer.Argument(None)):
+    """Train a model."""
+    run_train(get_default_config(overrides=overrides))
+
+
+@app.command("check", context_settings=OVERRIDES)
+def check_command(overrides: Optional[List[str]] = typer.Argument(None)):
+    """Check that the model and trainer run on the configured data."""
+    run_check(get_default_config(overrides=overrides))
+
+
+@app.command("infer", context_settings=OVERRIDES)
+def infer_command(overrides: Optional[List[str]] = typer.Argument(None)):
+    """Embed the configured dataset with a trained checkpoint."""
+    writer = run_infer(get_default_config(overrides=overrides))
+    typer.echo(f"{writer.stats['images_per_sec']:.1f} images/sec")
+
+
+@app.command("finetune", context_settings=OVERRIDES)
+def finetune_command(overrides: Optional[List[str]] = typer.Argument(None)):
+    """Finetune a model."""
+    run_finetune(get_default_config(overrides=overrides))
+
+
+@app.command("pack", context_settings=OVERRIDES)
+def pack_command(
+    output: Path = typer.Argument(..., help="Directory to write the packed dataset to"),
+    overrides: Optional[List[str]] = typer.Argument(None),
+    num_workers: int = typer.Option(4),
+    keep_transform: bool = typer.Option(
+        False, help="Pack the output of a deterministic dataloader.dataset.transform"
+    ),
+):
+    """Decode the configured dataset once into a memory-mapped PackedDataset.
+
+    By default the transform is dropped, as it is usually the random augmentations.
+    Train from the pack with dataloader.dataset._target_=bioimage_embed.datasets.PackedDataset
+    dataloader.dataset.root=OUTPUT.
+    """
+    from hydra.utils import instantiate
+    from .datasets import pack
+
+    cfg = get_default_config(overrides=overrides)
+    if keep_transform:
+        dataset = instantiate(cfg.dataloader.dataset)
+    else:
+        dataset = instantiate(cfg.dataloader.dataset, transform=None)
+    packed = pack(dataset, output, num_workers=num_workers)
+    typer.echo(f"Packed {len(packed)} samples into {output}")
+
+
+@app.command("config")
+def config_command(
+    path: str = typer.Argument("conf/config.yaml"),
+):
+    """Write the default config to a yaml file."""
+    write_default_config_file(Path(path))
+
+
+@app.command("evaluate")
+def evaluate_command(
+    roots: List[Path] = typer.Argument(
+        ..., help="Embedding directories written by bie infer"
+    ),
+    probe: str = typer.Option("forest", help="forest or linear"),
+    n_splits: int = typer.Option(5),
+    n_jobs: int = typer.Option(-1),
+    cache_dir: Optional[Path] = typer.Option(
+        None, help="Cache the scores of each fold here"
+    ),
+    output: Optional[Path] = typer.Option(
+        None, help="Write the scores of every fold to this csv"
+    ),
+):
+    """Score embeddings of one or more checkpoints on shared cross-validation folds."""
+    from .evaluation import embedding_trials, score_trials
+
+    trials, labels = embedding_trials(roots)
+    df = score_trials(
+        trials,
+        labels,
+        n_splits=n_splits,
+        probe=probe,
+        n_jobs=n_jobs,
+        cache_dir=cache_dir,
+    )
+    if output:
+        df.to_csv(output, index=False)
+    typer.echo(df.drop(columns=["fold"]).groupby("trial").mean().to_string())
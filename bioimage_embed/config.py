@@ -14,7 +14,6 @@ are valid.
 
 # TODO need a way to copy signatures from original classes for validation
 from omegaconf import OmegaConf
-from bioimage_embed import augmentations as augs
 import os
 from dataclasses import field
 from pydantic.dataclasses import dataclass
@@ -27,6 +26,13 @@ from omegaconf import II
 from . import utils
 
 
+def default_transform_dict():
+    # Deferred as albumentations takes seconds to import
+    from . import augmentations as augs
+
+    return augs.DEFAULT_ALBUMENTATION.to_dict()
+
+
 @dataclass(config=dict(extra="allow"))
 class Recipe:
     _target_: str = "types.SimpleNamespace"
@@ -59,6 +65,14 @@ class Recipe:
     cooldown_epochs: int = 5
     warmup_t: int = 0
     seed: int = 42
+    # Optional MaskEmbed shape losses, added with these weights to the diagonal,
+    # symmetry and non-negativity losses of the reconstructed distograms
+    triangle_inequality: bool = False
+    triangle_inequality_weight: float = 1.0
+    # Triples drawn per distogram, see shapes.loss_functions.triangle_inequality_loss
+    triangle_inequality_samples: int = 1024
+    clockwise_order: bool = False
+    clockwise_order_weight: float = 1.0
 
 
 # Use the ALbumentations .to_dict() method to get the dictionary
@@ -68,9 +82,7 @@ class ATransform:
     _target_: Any = "albumentations.from_dict"
     _convert_: str = "object"
     # _convert_: str = "all"
-    transform_dict: Dict = Field(
-        default_factory=lambda: augs.DEFAULT_ALBUMENTATION.to_dict()
-    )
+    transform_dict: Dict = Field(default_factory=default_transform_dict)
 
 
 # VisionWrapper is a helper class for applying albumentations pipelines for image augmentations in autoencoding
@@ -81,9 +93,16 @@ class Transform:
     _target_: Any = "bioimage_embed.augmentations.VisionWrapper"
     _convert_: str = "object"
     # transform: ATransform = field(default_factory=ATransform)
-    transform_dict: Dict = Field(
-        default_factory=lambda: augs.DEFAULT_ALBUMENTATION.to_dict()
-    )
+    transform_dict: Dict = Field(default_factory=default_transform_dict)
+    # Run the transforms after the last resizing one on whole batches, in the default
+    # pipeline only GaussNoise and RandomBrightnessContrast
+    batch: bool = False
+    # Images all share one size, so the flips, rotations, elastic and crops run on batches too
+    same_size: bool = False
+    # Per image elastic deformations drawn from a precomputed bank of displacement fields,
+    # saved in elastic_bank_dir when set, see augmentations.BankedElasticTransform
+    elastic_bank: bool = False
+    elastic_bank_dir: Optional[str] = None
 
 
 @dataclass(config=dict(extra="allow"))
@@ -113,6 +132,10 @@ class ImageFolderDataset(Dataset):
 @dataclass(config=dict(extra="allow"))
 class NdDataset(ImageFolderDataset):
     transform: Transform = Field(default_factory=Transform)
+    # Random crops read from a single chunk when they fit in one
+    crop_size: int = 224
+    crops_per_image: int = 1
+    level: int = 0
 
 
 @dataclass(config=dict(extra="allow"))
@@ -120,16 +143,26 @@ class TiffDataset(NdDataset):
     _target_: str = "bioimage_embed.datasets.TiffDataset"
 
 
+@dataclass(config=dict(extra="allow"))
 class NgffDataset(NdDataset):
     _target_: str = "bioimage_embed.datasets.NgffDataset"
 
 
+# Written by `bie pack`, the transform only needs the random augmentations
+@dataclass(config=dict(extra="allow"))
+class PackedDataset(Dataset):
+    _target_: str = "bioimage_embed.datasets.PackedDataset"
+    root: str = II("recipe.data")
+
+
 @dataclass(config=dict(extra="allow"))
 class DataLoader:
     _target_: str = "bioimage_embed.lightning.dataloader.DataModule"
     dataset: Any = Field(default_factory=FakeDataset)
     num_workers: int = 1
     batch_size: int = II("recipe.batch_size")
+    # Top up batches that lost invalid samples from a reservoir of valid ones
+    refill: bool = False
 
 
 @dataclass(config=dict(extra="allow"))
@@ -208,6 +241,20 @@ class Trainer:
 # TODO add argument caching for checkpointing
 
 
+@dataclass(config=dict(extra="allow"))
+class Inference:
+    # "best" and "last" are looked up from the ModelCheckpoint callback,
+    # None embeds with the current weights
+    ckpt_path: Optional[str] = "best"
+    output: str = f"{II('paths.model')}/{II('uuid')}/embeddings"
+    batch_size: int = II("recipe.batch_size")
+    num_workers: int = II("dataloader.num_workers")
+    shard_size: int = 4096
+    reconstructions: bool = False
+    channels_last: bool = False
+    bf16: bool = False
+
+
 @dataclass(config=dict(extra="allow"))
 class Paths:
     model: str = "models"
@@ -229,6 +276,7 @@ class Config:
     trainer: Any = field(default_factory=Trainer)
     lit_model: Any = field(default_factory=LightningModel)
     callbacks: Any = field(default_factory=Callbacks)
+    inference: Any = field(default_factory=Inference)
     uuid: str = field(default_factory=lambda: utils.hashing_fn(Recipe()))
 
 
@@ -245,6 +293,7 @@ __schemas__ = {
     "trainer": Trainer,
     "model": Model,
     "lit_model": LightningModel,
+    "inference": Inference,
 }
 
 
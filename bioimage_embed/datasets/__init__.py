@@ -1,7 +1,25 @@
-from typing import Any, Tuple
-from torchvision.datasets import FakeData, ImageFolder
-from torchvision.transforms import ToTensor
-import albumentations as A
+from typing import Tuple
+from torchvision.datasets import FakeData
+
+from .cache import ImageCache, SharedImageCache
+from .dataset_glob import DatasetGlob, filter_dataset
+from .index import file_index, glob_paths
+from .nd import NgffDataset, TiffDataset
+from .packed import PackedDataset, pack
+
+__all__ = [
+    "FakeImageFolder",
+    "ImageCache",
+    "SharedImageCache",
+    "DatasetGlob",
+    "filter_dataset",
+    "file_index",
+    "glob_paths",
+    "NgffDataset",
+    "TiffDataset",
+    "PackedDataset",
+    "pack",
+]
 
 
 class FakeImageFolder(FakeData):
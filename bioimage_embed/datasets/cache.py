@@ -0,0 +1,275 @@
+"""
+Caches of decoded images for datasets that decode the same files again and again,
+e.g. DatasetGlob with over_sampling > 1, bounded by a byte budget with LRU eviction.
+
+ImageCache lives in one process, so every DataLoader worker fills its own copy.
+SharedImageCache keeps the arrays in a shared memory block of fixed size slots, one copy
+seen by every worker, with its index, LRU clock and hit counters in the same block.
+"""
+
+import multiprocessing
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from multiprocessing import shared_memory
+from typing import Callable, Dict, Hashable
+
+import numpy as np
+
+# Slot header: key, last use, nbytes, ndim, dtype kind, itemsize and up to MAX_NDIM dims
+MAX_NDIM = 4
+SLOT_FIELDS = 6 + MAX_NDIM
+COUNTERS = ("hits", "misses", "evictions", "skipped")
+
+
+def hit_stats(counters: Dict[str, int], nbytes: int) -> Dict[str, float]:
+    lookups = counters["hits"] + counters["misses"]
+    return {
+        **counters,
+        "bytes": nbytes,
+        "hit_rate": counters["hits"] / lookups if lookups else 0.0,
+    }
+
+
+class ImageCache:
+    """
+    LRU cache of decoded arrays in this process, evicting the least recently used arrays
+    once they hold more than `max_bytes`. Arrays larger than the budget are not cached.
+    Lookups return copies, so transforms can modify them in place.
+    """
+
+    def __init__(self, max_bytes: int = 2**30):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        # Datasets may decode in threads, see DatasetGlob.get_batch
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key: Hashable):
+        with self._lock:
+            array = self.entries.get(key)
+            if array is None:
+                self.counters["misses"] += 1
+                return None
+            self.counters["hits"] += 1
+            self.entries.move_to_end(key)
+        return array.copy()
+
+    def put(self, key: Hashable, array: np.ndarray):
+        if array.nbytes > self.max_bytes:
+            with self._lock:
+                self.counters["skipped"] += 1
+            return
+        # Copied outside the lock so decode threads do not wait on each other's copies
+        array = array.copy()
+        with self._lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key).nbytes
+            while self.nbytes + array.nbytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.counters["evictions"] += 1
+            self.entries[key] = array
+            self.nbytes += array.nbytes
+
+    def get_or_load(self, key: Hashable, load: Callable[[Hashable], np.ndarray]):
+        array = self.get(key)
+        if array is None:
+            array = load(key)
+            self.put(key, array)
+        return array
+
+    def stats(self) -> Dict[str, float]:
+        """
+        hits, misses, evictions, skipped (too large to cache), bytes in use and hit_rate
+        """
+        return hit_stats(dict(self.counters), self.nbytes)
+
+    def reset(self):
+        """
+        Returns the stats and zeroes the counters, the cached arrays are kept.
+        """
+        stats = self.stats()
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        return stats
+
+
+def _release(shm: shared_memory.SharedMemory, pid: int):
+    # Forked workers inherit the finalizer, only the creating process frees the block
+    if os.getpid() == pid:
+        shm.close()
+        shm.unlink()
+
+
+class SharedImageCache(ImageCache):
+    """
+    ImageCache in shared memory for integer keys in [0, num_keys), e.g. file indices.
+    The budget is split into max_bytes // slot_bytes slots of one array each, arrays larger
+    than a slot are not cached. Eviction takes the least recently used slot.
+
+    Create it and call `share()` before the DataLoader starts its workers: forked workers
+    inherit the block and spawned ones attach to it by name. Until then copies pickled
+    start empty with a block of their own; once shared, the cache can only be pickled
+    to start workers, as its lock can. The block is freed when the cache of the creating
+    process is garbage collected.
+    """
+
+    def __init__(self, num_keys: int, max_bytes: int = 2**30, slot_bytes: int = 2**20):
+        self.num_keys = num_keys
+        self.max_bytes = max_bytes
+        self.slot_bytes = slot_bytes
+        self.num_slots = max(1, max_bytes // slot_bytes)
+        self.lock = multiprocessing.Lock()
+        self.shm = None
+        self.shared = False
+        # Allocated now so that forked workers inherit the block rather than make their own
+        self._views = self._allocate()
+
+    def share(self):
+        """
+        Pickles of the cache carry the block name and lock from now on, so workers
+        started afterwards, forked or spawned, all fill this one cache.
+        """
+        self.shared = True
+        return self
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_views"] = None
+        # Unshared copies get a block of their own
+        if not self.shared:
+            state["shm"] = None
+            state["lock"] = multiprocessing.Lock()
+        return state
+
+    @property
+    def views(self):
+        if self._views is None:
+            self._views = self._allocate()
+        return self._views
+
+    def _allocate(self):
+        """
+        Creates the block, or attaches to the one named by a shared pickle, and returns
+        the header and data views on it.
+        """
+        header_bytes = 8 * (
+            len(COUNTERS) + 1 + self.num_keys + self.num_slots * SLOT_FIELDS
+        )
+        if self.shm is None:
+            self.shm = shared_memory.SharedMemory(
+                create=True, size=header_bytes + self.num_slots * self.slot_bytes
+            )
+            weakref.finalize(self, _release, self.shm, os.getpid())
+            created = True
+        else:
+            created = False
+        header = np.ndarray(header_bytes // 8, dtype=np.int64, buffer=self.shm.buf)
+        counters, header = np.split(header, [len(COUNTERS) + 1])
+        key_slots, slots = np.split(header, [self.num_keys])
+        views = {
+            "counters": counters,
+            "key_slots": key_slots,
+            "slots": slots.reshape(self.num_slots, SLOT_FIELDS),
+            "data": np.ndarray(
+                (self.num_slots, self.slot_bytes),
+                dtype=np.uint8,
+                buffer=self.shm.buf,
+                offset=header_bytes,
+            ),
+        }
+        if created:
+            views["key_slots"][:] = -1
+            views["slots"][:, 0] = -1
+            views["slots"][:, 1] = -1
+        return views
+
+    def __len__(self):
+        return int((self.views["slots"][:, 0] >= 0).sum())
+
+    def _tick(self):
+        # The last counter is the LRU clock
+        counters = self.views["counters"]
+        counters[-1] += 1
+        return counters[-1]
+
+    def _count(self, name):
+        self.views["counters"][COUNTERS.index(name)] += 1
+
+    def get(self, key: int):
+        views = self.views
+        with self.lock:
+            slot = views["key_slots"][key]
+            if slot < 0:
+                self._count("misses")
+                return None
+            self._count("hits")
+            header = views["slots"][slot]
+            header[1] = self._tick()
+            nbytes, ndim, kind, itemsize = header[2:6]
+            dtype = np.dtype(f"{chr(kind)}{itemsize}")
+            shape = tuple(header[6 : 6 + ndim])
+            return views["data"][slot, :nbytes].view(dtype).reshape(shape).copy()
+
+    def put(self, key: int, array: np.ndarray):
+        views = self.views
+        array = np.ascontiguousarray(array)
+        if not array.dtype.isnative:
+            array = array.astype(array.dtype.newbyteorder("="))
+        if (
+            array.nbytes > self.slot_bytes
+            or array.ndim > MAX_NDIM
+            or array.dtype.hasobject
+        ):
+            with self.lock:
+                self._count("skipped")
+            return
+        with self.lock:
+            slot = views["key_slots"][key]
+            if slot < 0:
+                # Empty slots have never been used, so they go first
+                slot = int(np.argmin(views["slots"][:, 1]))
+                evicted = views["slots"][slot, 0]
+                if evicted >= 0:
+                    views["key_slots"][evicted] = -1
+                    self._count("evictions")
+            header = views["slots"][slot]
+            header[:6] = (
+                key,
+                self._tick(),
+                array.nbytes,
+                array.ndim,
+                ord(array.dtype.kind),
+                array.dtype.itemsize,
+            )
+            header[6 : 6 + array.ndim] = array.shape
+            views["data"][slot, : array.nbytes] = array.reshape(-1).view(np.uint8)
+            views["key_slots"][key] = slot
+
+    def stats(self) -> Dict[str, float]:
+        views = self.views
+        with self.lock:
+            counters = dict(zip(COUNTERS, views["counters"].tolist()))
+            used = views["slots"][:, 0] >= 0
+            nbytes = int(views["slots"][used, 2].sum())
+        return hit_stats(counters, nbytes)
+
+    def reset(self):
+        stats = self.stats()
+        with self.lock:
+            self.views["counters"][: len(COUNTERS)] = 0
+        return stats
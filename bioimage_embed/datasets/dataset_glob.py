@@ -0,0 +1,184 @@
+#  %%
+import glob
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from torch.utils.data import Dataset
+from PIL import Image
+import numpy as np
+
+
+from typing import Callable
+import torch
+
+from ..utils import is_invalid
+from .cache import ImageCache, SharedImageCache
+from .index import glob_paths
+
+
+def filter_dataset(dataset: torch.Tensor, manifest=None, num_workers=4):
+    from ..lightning.dataloader import validate_dataset
+
+    return validate_dataset(dataset, manifest=manifest, num_workers=num_workers)
+
+
+class DatasetGlob(Dataset):
+    """
+    Images matching `path_glob`, each served `over_sampling` times per epoch.
+
+    With `cache_bytes` the decoded images are kept in an LRU cache of that many bytes,
+    so only the first of the over-sampled reads of an image decodes it. The cache is
+    per process, or with `cache_shared` one shared memory cache for all DataLoader workers,
+    made of slots of `cache_slot_bytes` (by default the size of the first image).
+    `cache_stats()` returns its hits, misses and hit rate.
+
+    With `index_dir` the files are listed from a file index (see datasets.index) kept there,
+    which only rescans the directories that changed since the last run.
+
+    Slices and lists of indices are fetched as one batch by `get_batch`, which decodes and
+    transforms the images in `num_threads` threads (PIL and OpenCV release the GIL) straight
+    into one preallocated array. The DataLoader uses it through `__getitems__`; pass
+    collate_fn=utils.collate_none (or the DataModule's Collator) to take that array as the
+    batch, default_collate copies it once more.
+    """
+
+    def __init__(
+        self,
+        path_glob,
+        over_sampling=1,
+        transform: Callable = None,
+        samples=-1,
+        shuffle=True,
+        cache_bytes: int = 0,
+        cache_shared: bool = False,
+        cache_slot_bytes: int = None,
+        num_threads: int = None,
+        index_dir=None,
+        **kwargs,
+    ):
+        if index_dir is not None:
+            self.image_paths = glob_paths(path_glob, index_dir)
+        else:
+            self.image_paths = glob.glob(path_glob, recursive=True)
+        if shuffle:
+            random.shuffle(self.image_paths)
+        if samples > 0 and samples < len(self.image_paths):
+            self.image_paths = self.image_paths[0:samples]
+        self.transform = transform
+        self.samples = samples
+        self.over_sampling = over_sampling
+        self.num_threads = num_threads or min(8, os.cpu_count())
+        assert len(self.image_paths) > 0
+        self.cache = None
+        if cache_bytes and cache_shared:
+            slot_bytes = cache_slot_bytes or self.load_image(0).nbytes
+            self.cache = SharedImageCache(
+                len(self.image_paths), max_bytes=cache_bytes, slot_bytes=slot_bytes
+            ).share()
+        elif cache_bytes:
+            self.cache = ImageCache(max_bytes=cache_bytes)
+
+    def __len__(self):
+        return len(self.image_paths) * self.over_sampling
+
+    def load_image(self, index) -> np.ndarray:
+        with Image.open(self.image_paths[index]) as image:
+            return np.array(image)
+
+    def get_cached_image(self, index) -> np.ndarray:
+        if self.cache is None:
+            return self.load_image(index)
+        return self.cache.get_or_load(index, self.load_image)
+
+    def cache_stats(self):
+        """
+        Hit stats of the image cache, summed over workers only for a shared cache.
+        """
+        return self.cache.stats() if self.cache is not None else None
+
+    def getitem(self, index, cached=True):
+        safe_idx = index % len(self.image_paths)
+
+        if cached:
+            x = self.get_cached_image(safe_idx)
+        else:
+            x = self.load_image(safe_idx)
+
+        if self.transform is not None:
+            augmented = self.transform(image=x)
+            # x = Image.fromarray(augmented['image'])
+            return augmented["image"]
+        return x
+
+    def is_image_cropped(self, image):
+        if (
+            np.sum(
+                np.sum(image[:, 0]),
+                np.sum(image[:, -1]),
+                np.sum(image[0, :]),
+                np.sum(image[-1, :]),
+            )
+            == 0
+        ):
+            return False
+        else:
+            return True
+
+    def get_batch(self, indices):
+        """
+        Samples at `indices` stacked into one array (or tensor, when the transform returns
+        tensors), decoded and transformed in the thread pool.
+        Falls back to a list when the samples differ in shape or dtype, or when a transform
+        returned INVALID, which the list keeps for the Collator to drop or refill.
+        """
+        indices = list(indices)
+        if not indices:
+            return []
+        first = self.getitem(indices[0])
+        batch = None
+        if not is_invalid(first):
+            if isinstance(first, torch.Tensor):
+                batch = first.new_empty((len(indices), *first.shape))
+            else:
+                first = np.asarray(first)
+                batch = np.empty((len(indices), *first.shape), dtype=first.dtype)
+            batch[0] = first
+        samples = [first]
+
+        def stackable(sample):
+            return (
+                batch is not None
+                and not is_invalid(sample)
+                and type(sample) is type(first)
+                and tuple(sample.shape) == tuple(first.shape)
+                and sample.dtype == first.dtype
+            )
+
+        def fill(i):
+            sample = self.getitem(indices[i])
+            if stackable(sample):
+                batch[i] = sample
+            return sample
+
+        # The threads only live for the batch, forking DataLoader workers while the
+        # threads of a pool are alive leaves the workers with a dead pool
+        with ThreadPoolExecutor(min(self.num_threads, len(indices))) as executor:
+            samples += executor.map(fill, range(1, len(indices)))
+        if batch is None or not all(stackable(sample) for sample in samples):
+            return samples
+        return batch
+
+    def __getitems__(self, indices):
+        # The stacked batch goes through Collator and utils.collate_none without another
+        # copy, default_collate still works on it but stacks its rows again
+        return self.get_batch(indices)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.get_batch(range(*index.indices(len(self))))
+        if isinstance(index, (list, tuple, np.ndarray, torch.Tensor)):
+            return self.get_batch(int(i) for i in index)
+        if not -len(self) <= index < len(self):
+            raise IndexError(f"Index {index} out of range for {len(self)} samples")
+        return self.getitem(index)
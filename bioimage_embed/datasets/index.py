@@ -0,0 +1,288 @@
+"""
+File index of large image trees, so datasets start from a saved listing rather than a
+recursive glob over NFS. The index is a directory of two Parquet tables:
+
+    index/
+        files.parquet   path, dir, size, mtime, label and optionally shape of every file
+        dirs.parquet    dir, mtime and subdirectories of every directory walked
+
+Directories are walked with os.scandir in a thread pool. On update a directory whose
+mtime is unchanged keeps its files from the index and is not listed again, only its
+subdirectories are visited, so an update costs one stat per directory rather than per file.
+Files rewritten in place do not change the mtime of their directory, use rescan=True
+to pick those up. Labels are the first directory under root, as with ImageFolder.
+"""
+
+import fnmatch
+import glob
+import json
+import logging
+import os
+import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+FILE_COLUMNS = ("path", "dir", "size", "mtime", "label")
+TIFF_SUFFIXES = (".tif", ".tiff")
+
+
+def image_shape(path) -> Optional[List[int]]:
+    """
+    Shape of an image read from its header, (H, W) or (H, W, C), None when it cannot be read.
+    """
+    try:
+        if str(path).lower().endswith(TIFF_SUFFIXES):
+            import tifffile
+
+            with tifffile.TiffFile(path) as tiff:
+                return list(tiff.series[0].shape)
+        from PIL import Image
+
+        with Image.open(path) as image:
+            bands = len(image.getbands())
+            return [image.height, image.width] + ([bands] if bands > 1 else [])
+    except Exception as e:
+        logger.debug(f"Could not read the shape of {path}: {e}")
+        return None
+
+
+def _scan_dir(path: str, pattern: str, known: Optional[dict], rescan: bool):
+    """
+    (mtime, subdirs, files) of one directory, files None when the index is still current
+    """
+    mtime = os.stat(path).st_mtime_ns
+    if known is not None and not rescan and known["mtime"] == mtime:
+        return mtime, known["subdirs"], None
+    subdirs, files = [], []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            elif entry.is_file() and fnmatch.fnmatch(entry.name, pattern):
+                stat = entry.stat()
+                files.append((entry.path, stat.st_size, stat.st_mtime_ns))
+    return mtime, sorted(subdirs), files
+
+
+def walk(
+    root,
+    pattern: str = "*",
+    dirs: Optional[dict] = None,
+    rescan: bool = False,
+    num_threads: int = 32,
+):
+    """
+    Walks `root` in parallel, listing only directories that changed since `dirs`.
+
+    Returns:
+        (dirs, listings): {dir: {"mtime", "subdirs"}} of the whole tree and
+        {dir: [(path, size, mtime), ...]} of the directories listed again.
+    """
+    dirs = dirs or {}
+    walked, listings = {}, {}
+    with ThreadPoolExecutor(num_threads) as executor:
+        pending = {}
+
+        def submit(path):
+            future = executor.submit(_scan_dir, path, pattern, dirs.get(path), rescan)
+            pending[future] = path
+
+        submit(str(root))
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                try:
+                    mtime, subdirs, files = future.result()
+                except OSError as e:
+                    # Removed while walking or unreadable, left out of the index
+                    logger.warning(f"Skipping {path}: {e}")
+                    continue
+                walked[path] = {"mtime": mtime, "subdirs": subdirs}
+                if files is not None:
+                    listings[path] = files
+                for subdir in subdirs:
+                    submit(subdir)
+    return walked, listings
+
+
+def read_index(index_dir):
+    """
+    (files, dirs, meta) of an index, empty tables when there is none yet.
+    """
+    index_dir = Path(index_dir)
+    if not (index_dir / "meta.json").is_file():
+        return pd.DataFrame(columns=FILE_COLUMNS), {}, {}
+    files = pd.read_parquet(index_dir / "files.parquet")
+    dirs = pd.read_parquet(index_dir / "dirs.parquet")
+    dirs = {
+        row.dir: {"mtime": row.mtime, "subdirs": list(row.subdirs)}
+        for row in dirs.itertuples(index=False)
+    }
+    with open(index_dir / "meta.json") as f:
+        meta = json.load(f)
+    return files, dirs, meta
+
+
+def _write_table(table: pa.Table, path: Path):
+    # Write then rename so an interrupted update leaves the previous index intact
+    tmp_path = path.with_suffix(f".parquet.{os.getpid()}.tmp")
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def write_index(index_dir, files: pd.DataFrame, dirs: dict, meta: dict):
+    index_dir = Path(index_dir)
+    index_dir.mkdir(parents=True, exist_ok=True)
+    _write_table(
+        pa.Table.from_pandas(files, preserve_index=False), index_dir / "files.parquet"
+    )
+    _write_table(
+        pa.table(
+            {
+                "dir": pa.array(list(dirs), type=pa.string()),
+                "mtime": pa.array([d["mtime"] for d in dirs.values()], type=pa.int64()),
+                "subdirs": pa.array(
+                    [d["subdirs"] for d in dirs.values()], type=pa.list_(pa.string())
+                ),
+            }
+        ),
+        index_dir / "dirs.parquet",
+    )
+    # meta.json goes last, it marks the index as complete
+    tmp_path = index_dir / f"meta.json.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f, indent=1)
+    os.replace(tmp_path, index_dir / "meta.json")
+
+
+def file_index(
+    root,
+    index_dir,
+    pattern: str = "*",
+    read_shapes: bool = False,
+    rescan: bool = False,
+    num_threads: int = 32,
+) -> pd.DataFrame:
+    """
+    Updates the index of the files under `root` whose name matches `pattern` and returns it.
+
+    Args:
+        root: Directory to index.
+        index_dir: Where the index is kept, created on first use.
+        pattern: fnmatch pattern of the file names, e.g. "*.tif*".
+        read_shapes: Also read the shape of new and changed files from their headers.
+        rescan: List every directory again, e.g. after files were rewritten in place.
+        num_threads: Threads walking directories and reading headers.
+
+    Returns:
+        One row per file, sorted by path, with columns path, dir, size, mtime, label
+        and with read_shapes shape (None for unreadable files).
+    """
+    root = os.path.abspath(root)
+    previous, dirs, meta = read_index(index_dir)
+    settings = {"root": root, "pattern": pattern, "read_shapes": read_shapes}
+    if meta and meta != settings:
+        logger.info(f"Index settings changed from {meta}, rescanning {root}")
+        previous, dirs = pd.DataFrame(columns=FILE_COLUMNS), {}
+
+    walked, listings = walk(root, pattern, dirs, rescan=rescan, num_threads=num_threads)
+    # Files of directories still current and still in the tree are kept as they are
+    kept = previous[previous["dir"].isin(set(walked) - set(listings))]
+    rows = []
+    for directory, files in listings.items():
+        relative = os.path.relpath(directory, root)
+        label = Path(relative).parts[0] if directory != root else ""
+        rows += [(path, directory, size, mtime, label) for path, size, mtime in files]
+    listed = pd.DataFrame(rows, columns=FILE_COLUMNS)
+    if read_shapes:
+        # Unchanged files keep their shape, only new or modified ones are opened
+        known = {}
+        if "shape" in previous:
+            known = {
+                row.path: (row.size, row.mtime, row.shape)
+                for row in previous.itertuples(index=False)
+            }
+        shapes, to_read = [], []
+        for i, row in enumerate(listed.itertuples(index=False)):
+            size, mtime, shape = known.get(row.path, (None, None, None))
+            shapes.append(shape)
+            if (size, mtime) != (row.size, row.mtime):
+                to_read.append(i)
+        with ThreadPoolExecutor(num_threads) as executor:
+            paths = listed["path"].iloc[to_read]
+            for i, shape in zip(to_read, executor.map(image_shape, paths)):
+                shapes[i] = shape
+        listed["shape"] = shapes
+    files = pd.concat([kept, listed], ignore_index=True)
+    files = files.sort_values("path", ignore_index=True)
+    write_index(index_dir, files, walked, settings)
+    logger.info(
+        f"Indexed {len(files)} files under {root}, "
+        f"{len(listings)} of {len(walked)} directories listed"
+    )
+    return files
+
+
+def split_glob(path_glob: str):
+    """
+    (root, pattern) of a glob, root being its longest leading path without wildcards.
+    """
+    parts = Path(path_glob).parts
+    for i, part in enumerate(parts):
+        if glob.has_magic(part):
+            return os.path.join(*parts[:i]) if i else ".", os.path.join(*parts[i:])
+    return os.path.dirname(path_glob) or ".", os.path.basename(path_glob)
+
+
+def glob_regex(pattern: str) -> str:
+    """
+    Regex of a recursive glob over "/" separated paths, "**/" matching any number of directories.
+    """
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+        elif pattern.startswith("**", i):
+            regex += ".*"
+            i += 2
+        elif pattern[i] == "*":
+            regex += "[^/]*"
+            i += 1
+        elif pattern[i] == "?":
+            regex += "[^/]"
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 2 :]:
+            end = pattern.index("]", i + 2)
+            body = pattern[i + 1 : end]
+            regex += "[" + ("^" + body[1:] if body.startswith("!") else body) + "]"
+            i = end + 1
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+    return regex + r"\Z"
+
+
+def glob_paths(path_glob: str, index_dir, **kwargs) -> List[str]:
+    """
+    The files matching a recursive glob, like glob.glob(path_glob, recursive=True),
+    read from the file index in `index_dir` of the glob's root. See file_index for kwargs.
+    Hidden files are matched too, unlike with glob.
+    """
+    root, pattern = split_glob(path_glob)
+    name_pattern = os.path.basename(pattern)
+    if glob.has_magic(name_pattern) and "**" in name_pattern:
+        name_pattern = "*"
+    files = file_index(root, index_dir, pattern=name_pattern, **kwargs)
+    relative = files["path"].str.slice(len(os.path.join(os.path.abspath(root), "")))
+    matches = relative.str.match(glob_regex(pattern))
+    return [os.path.join(root, path) for path in relative[matches]]
@@ -0,0 +1,366 @@
+"""
+Random-crop datasets over large N-d images that are never read whole:
+tiled (or stripped) TIFFs through tifffile and OME-Zarr/NGFF images through zarr.
+
+Each sample is a random `crop_size` window of one image. The window is placed inside a single
+storage chunk (tile, strip or zarr chunk) when it fits, otherwise aligned to the chunk grid,
+so reading a sample decodes one chunk, or as few as the window allows, instead of the plane.
+Crops are returned as (H, W) or (H, W, C) numpy arrays, the layout albumentations expects,
+zero padded when the image is smaller than the crop.
+
+Images are looked up under `root` like ImageFolder does: files in class subdirectories get
+the class of their directory as label, files directly under `root` get label 0.
+OME-Zarr stores count as one file, every image of a plate gets the class of the plate.
+"""
+
+import json
+import logging
+import os
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+logger = logging.getLogger(__name__)
+
+TIFF_EXTENSIONS = (".tif", ".tiff")
+
+
+def chunk_crop_origin(shape, chunks, crop, rng) -> List[int]:
+    """
+    Origin of a random `crop` window in an array of `shape` stored in `chunks`.
+    Along each axis the window is kept inside one chunk when it fits in one, otherwise it
+    starts on a chunk boundary, and it is clipped to the array either way.
+    """
+    origin = []
+    for size, chunk, length in zip(shape, chunks, crop):
+        if length >= size:
+            origin.append(0)
+            continue
+        if length <= chunk:
+            # Only chunks the window fits in, a clipped last chunk may be too small
+            start = chunk * rng.integers(0, (size - length) // chunk + 1)
+            start += rng.integers(0, min(chunk, size - start) - length + 1)
+        else:
+            start = chunk * rng.integers(0, -(-size // chunk))
+        origin.append(int(min(start, size - length)))
+    return origin
+
+
+def pad_to(array: np.ndarray, shape) -> np.ndarray:
+    """
+    Zero pads the leading axes of `array` up to `shape`, for crops of images smaller than the crop.
+    """
+    padding = [(0, max(0, size - have)) for size, have in zip(shape, array.shape)]
+    if not any(after for _, after in padding):
+        return array
+    padding += [(0, 0)] * (array.ndim - len(padding))
+    return np.pad(array, padding)
+
+
+def find_classes(root: Path, paths: Sequence[Path]):
+    """
+    ImageFolder-style labels, the index of the sorted class subdirectory of each path under `root`.
+    Paths directly under `root`, or `root` itself, get label 0.
+    """
+
+    def class_name(path):
+        parts = path.relative_to(root).parts
+        return parts[0] if len(parts) > 1 else None
+
+    names = [class_name(path) for path in paths]
+    classes = sorted({name for name in names if name is not None})
+    class_to_idx = {name: i for i, name in enumerate(classes)}
+    targets = [class_to_idx[name] if name is not None else 0 for name in names]
+    return classes, class_to_idx, targets
+
+
+class NdDataset(Dataset):
+    """
+    Base class of the random-crop datasets, `crops_per_image` samples per image.
+    Subclasses implement `image_shape`, `image_chunks` and `read` for one image.
+
+    Args:
+        root: Directory to search for images, or a single image.
+        transform: Applied to every crop, e.g. the albumentations VisionWrapper.
+        crop_size: Height and width of the crops.
+        crops_per_image: Samples per image and epoch.
+        level: Resolution level of pyramidal images, 0 is full resolution.
+        seed: Seed of the crop positions, mixed with the torch seed of each DataLoader worker.
+    """
+
+    def __init__(
+        self,
+        root,
+        transform=None,
+        target_transform=None,
+        crop_size: int = 224,
+        crops_per_image: int = 1,
+        level: int = 0,
+        seed: Optional[int] = None,
+    ):
+        self.root = Path(root)
+        self.transform = transform
+        self.target_transform = target_transform
+        self.crop_size = crop_size
+        self.crops_per_image = crops_per_image
+        self.level = level
+        self.seed = seed
+        self.image_paths = self.find_images(self.root)
+        if not self.image_paths:
+            raise FileNotFoundError(f"No images found under {self.root}")
+        root = self.root if self.root.is_dir() else self.root.parent
+        self.classes, self.class_to_idx, image_targets = find_classes(
+            root, [self.label_path(Path(path), root) for path in self.image_paths]
+        )
+        self.targets = np.repeat(image_targets, crops_per_image)
+        self._rng = None
+        self._handles = {}
+
+    def find_images(self, root: Path) -> List[str]:
+        raise NotImplementedError
+
+    def label_path(self, path: Path, root: Path) -> Path:
+        """
+        Path whose directory under `root` is the class of the image at `path`.
+        """
+        return path
+
+    def open(self, path):
+        raise NotImplementedError
+
+    def image_shape(self, image) -> Sequence[int]:
+        raise NotImplementedError
+
+    def image_chunks(self, image) -> Sequence[int]:
+        raise NotImplementedError
+
+    def read(self, image, origin: Sequence[int]) -> np.ndarray:
+        raise NotImplementedError
+
+    @property
+    def rng(self) -> np.random.Generator:
+        # Created on first use in each process, torch seeds every DataLoader worker differently
+        if self._rng is None:
+            seed = [torch.initial_seed() % 2**32, self.seed or 0]
+            self._rng = np.random.default_rng(seed)
+        return self._rng
+
+    def handle(self, index):
+        """
+        Opened image, cached per process
+        """
+        if index not in self._handles:
+            self._handles[index] = self.open(self.image_paths[index])
+        return self._handles[index]
+
+    def __getstate__(self):
+        # File handles and generators are opened anew in each worker
+        state = self.__dict__.copy()
+        state["_handles"] = {}
+        state["_rng"] = None
+        return state
+
+    def __len__(self):
+        return len(self.image_paths) * self.crops_per_image
+
+    def crop_origin(self, image) -> List[int]:
+        return chunk_crop_origin(
+            self.image_shape(image)[:2],
+            self.image_chunks(image)[:2],
+            (self.crop_size, self.crop_size),
+            self.rng,
+        )
+
+    def __getitem__(self, idx):
+        image = self.handle(idx // self.crops_per_image)
+        crop = self.read(image, self.crop_origin(image))
+        crop = pad_to(crop, (self.crop_size, self.crop_size))
+        label = int(self.targets[idx])
+        if self.transform is not None:
+            crop = self.transform(crop)
+        if self.target_transform is not None:
+            label = self.target_transform(label)
+        return crop, label
+
+
+class TiffPlane:
+    """
+    One (H, W[, S]) plane of a TIFF, read chunk by chunk.
+    Uncompressed contiguous planes are memory-mapped and sliced. Tiled and stripped planes
+    decode only the tiles or strips under the window, anything else is read whole once.
+    """
+
+    def __init__(self, path, level: int = 0, page: int = 0):
+        import tifffile
+
+        self.tiff = tifffile.TiffFile(path)
+        self.page = self.tiff.series[0].levels[level].pages[page]
+        if isinstance(self.page, tifffile.TiffFrame):
+            self.page = self.page.aspage()
+        self.shape = tuple(self.page.shape)
+        self.array = None
+        if self.page.is_memmappable:
+            self.array = np.memmap(
+                path,
+                dtype=self.page.dtype.newbyteorder(self.tiff.byteorder),
+                mode="r",
+                offset=self.page.dataoffsets[0],
+                shape=self.shape,
+            )
+            self.chunks = self.shape
+        elif self.page.planarconfig == 1 and self.page.imagedepth == 1:
+            self.chunks = tuple(self.page.chunks)
+        else:
+            logger.warning(f"{path} is not chunked along Y and X, reading it whole")
+            self.array = self.page.asarray()
+            self.chunks = self.shape
+
+    def segment(self, index) -> np.ndarray:
+        fh = self.tiff.filehandle
+        with fh.lock:
+            fh.seek(self.page.dataoffsets[index])
+            data = fh.read(self.page.databytecounts[index])
+        segment, _, _ = self.page.decode(data, index, jpegtables=self.page.jpegtables)
+        # (depth, length, width, samples) -> (length, width[, samples])
+        segment = segment[0]
+        return segment if len(self.shape) > 2 else segment[..., 0]
+
+    def read(self, y0, x0, height, width) -> np.ndarray:
+        y1, x1 = min(y0 + height, self.shape[0]), min(x0 + width, self.shape[1])
+        if self.array is not None:
+            return np.asarray(self.array[y0:y1, x0:x1])
+        out = np.empty((y1 - y0, x1 - x0, *self.shape[2:]), dtype=self.page.dtype)
+        chunk_y, chunk_x = self.chunks[:2]
+        tiles_x = -(-self.shape[1] // chunk_x)
+        for ty in range(y0 // chunk_y, (y1 - 1) // chunk_y + 1):
+            for tx in range(x0 // chunk_x, (x1 - 1) // chunk_x + 1):
+                segment = self.segment(ty * tiles_x + tx)
+                top, left = ty * chunk_y, tx * chunk_x
+                # Overlap of the window and the tile, clipped edge tiles included
+                ya, yb = max(y0, top), min(y1, top + chunk_y)
+                xa, xb = max(x0, left), min(x1, left + chunk_x)
+                out[ya - y0 : yb - y0, xa - x0 : xb - x0] = segment[
+                    ya - top : yb - top, xa - left : xb - left
+                ]
+        return out
+
+
+class TiffDataset(NdDataset):
+    """
+    Random crops of (multi-GB) tiled TIFF or OME-TIFF images,
+    see NdDataset for the arguments.
+    Pyramidal OME-TIFFs are read at `level`.
+    """
+
+    def find_images(self, root: Path) -> List[str]:
+        if root.is_file():
+            return [str(root)]
+        return sorted(
+            str(path)
+            for path in root.rglob("*")
+            if path.suffix.lower() in TIFF_EXTENSIONS and path.is_file()
+        )
+
+    def open(self, path):
+        return TiffPlane(path, level=self.level)
+
+    def image_shape(self, image):
+        return image.shape
+
+    def image_chunks(self, image):
+        return image.chunks
+
+    def read(self, image, origin):
+        return image.read(*origin, self.crop_size, self.crop_size)
+
+
+def is_zarr_group(path: Path) -> bool:
+    return (path / ".zgroup").is_file() or (path / ".zattrs").is_file()
+
+
+class NgffImage:
+    """
+    One resolution level of an OME-Zarr (NGFF) multiscale image as a lazy zarr array,
+    with the positions of its y, x and channel axes from the multiscales metadata.
+    """
+
+    def __init__(self, path, level: int = 0):
+        import zarr
+
+        group = zarr.open_group(str(path), mode="r")
+        multiscales = group.attrs["multiscales"][0]
+        self.array = group[multiscales["datasets"][level]["path"]]
+        axes = [
+            axis["name"] if isinstance(axis, dict) else axis
+            for axis in multiscales.get("axes", "tczyx"[-self.array.ndim :])
+        ]
+        self.axes = axes
+        self.y, self.x = axes.index("y"), axes.index("x")
+        self.c = axes.index("c") if "c" in axes else None
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+    @property
+    def chunks(self):
+        return self.array.chunks
+
+
+class NgffDataset(NdDataset):
+    """
+    Random crops of OME-Zarr (NGFF) images, including the fields of HCS plates,
+    see NdDataset for the arguments. Only the chunks under each crop are read, at `level`.
+    Crops span every channel, time points and z planes are drawn at random.
+    """
+
+    def find_images(self, root: Path) -> List[str]:
+        # Groups with multiscales metadata are images, plates nest them in row/col/field
+        images = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            if ".zattrs" in filenames:
+                with open(os.path.join(dirpath, ".zattrs")) as f:
+                    if "multiscales" in json.load(f):
+                        images.append(dirpath)
+                        dirnames.clear()
+            dirnames.sort()
+        return sorted(images)
+
+    def label_path(self, path, root):
+        # The store around the image, so the fields of a plate get the class of the plate
+        # rather than that of their row
+        while path != root and is_zarr_group(path.parent):
+            path = path.parent
+        return path
+
+    def open(self, path):
+        return NgffImage(path, level=self.level)
+
+    def image_shape(self, image):
+        return image.shape[image.y], image.shape[image.x]
+
+    def image_chunks(self, image):
+        return image.chunks[image.y], image.chunks[image.x]
+
+    def read(self, image, origin):
+        y0, x0 = origin
+        index = []
+        for axis, size in enumerate(image.shape):
+            if axis == image.y:
+                index.append(slice(y0, y0 + self.crop_size))
+            elif axis == image.x:
+                index.append(slice(x0, x0 + self.crop_size))
+            elif axis == image.c:
+                index.append(slice(None))
+            else:
+                index.append(int(self.rng.integers(size)))
+        crop = np.asarray(image.array[tuple(index)])
+        # Remaining axes are in metadata order, e.g. (c, y, x), move channels last
+        kept = [axis for axis in (image.c, image.y, image.x) if axis is not None]
+        order = np.argsort(np.argsort(kept))
+        if image.c is None:
+            return crop.transpose(order)
+        return np.moveaxis(crop.transpose(order), 0, -1)
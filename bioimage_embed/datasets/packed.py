@@ -0,0 +1,223 @@
+"""
+Packed datasets: every sample of a dataset, after its deterministic transforms (decoding,
+grayscale, cropping...), stored back to back in one uint8/uint16 file that is memory-mapped
+on read. An index holds the offset, shape and label of each sample, so serving a sample
+is a slice of the map rather than a PIL decode.
+
+    root/
+        data.bin      raw samples, C order
+        index.npz     offsets (n + 1,), shapes (n, ndim), labels (n,), source_indices (n,)
+        meta.json     dtype, sample count, whether samples are labelled, paths of the source
+                      files and the packed transform
+
+Random augmentations still run per access, as the transform of the PackedDataset.
+"""
+
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from ..utils import is_invalid
+
+logger = logging.getLogger(__name__)
+
+
+def packed_dtype(array: np.ndarray) -> np.dtype:
+    """
+    uint8 or uint16 by the dtype of an integer or boolean sample rather than its values,
+    so a dim first image does not decide the dtype of the brighter ones after it:
+    8 bit and boolean samples pack to uint8, wider integers (e.g. the int32 PIL decodes
+    16 bit PNGs to) to uint16.
+    """
+    if array.dtype == bool:
+        return np.dtype(np.uint8)
+    if not np.issubdtype(array.dtype, np.integer):
+        raise ValueError(
+            f"Only integer samples can be packed, got {array.dtype}; "
+            "pack before ToTensor/ToFloat and apply them as the transform of the PackedDataset"
+        )
+    return np.dtype(np.uint8 if array.dtype.itemsize == 1 else np.uint16)
+
+
+def check_fits(array: np.ndarray, dtype) -> bool:
+    if np.can_cast(array.dtype, dtype) or array.size == 0:
+        return True
+    info = np.iinfo(dtype)
+    return array.min() >= info.min and array.max() <= info.max
+
+
+def _widen(path: Path, dtype, chunk_size: int = 2**24):
+    """
+    Rewrites the uint8 samples written to `path` so far as `dtype`.
+    """
+    if path.stat().st_size == 0:
+        return
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    wide_path = path.with_suffix(".wide")
+    with open(wide_path, "wb") as f:
+        for start in range(0, len(data), chunk_size):
+            f.write(data[start : start + chunk_size].astype(dtype).tobytes())
+    del data
+    os.replace(wide_path, path)
+
+
+def _identity(batch):
+    return batch
+
+
+def pack(dataset: Dataset, root, num_workers: int = 4, dtype=None) -> "PackedDataset":
+    """
+    Writes every (image, label) or bare image sample (e.g. of DatasetGlob, labelled -1)
+    of `dataset` to a PackedDataset under `root`.
+    Samples are loaded in order by DataLoader workers. Invalid samples (see utils.is_invalid) are skipped,
+    `source_indices` maps the packed samples back to the dataset.
+
+    Args:
+        dataset: The dataset with only its deterministic transforms, PIL images, arrays or integer tensors.
+        dtype: uint8 or uint16, by default that of the samples (see packed_dtype). Samples
+            are written as uint8 until one needs uint16, then what was written is widened.
+    """
+    from ..inference import sample_path
+
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    fixed_dtype = dtype is not None
+    labelled = False
+    offsets, shapes, labels, source_indices, paths = [0], [], [], [], []
+    loader = DataLoader(
+        dataset, batch_size=None, num_workers=num_workers, collate_fn=_identity
+    )
+    data_path = root / "data.bin"
+    # Write then rename so a half written pack never looks complete
+    tmp_path = data_path.with_suffix(f".bin.{os.getpid()}.tmp")
+    f = open(tmp_path, "wb")
+    try:
+        for idx, sample in enumerate(loader):
+            if is_invalid(sample):
+                logger.warning(f"Skipping invalid sample {idx}")
+                continue
+            # A bare image is not unpacked, a two row image would pass for (image, label)
+            if isinstance(sample, tuple):
+                image, label = sample
+                labelled = True
+            else:
+                image, label = sample, -1
+            if isinstance(image, torch.Tensor):
+                image = image.numpy()
+            array = np.ascontiguousarray(np.asarray(image))
+            sample_dtype = packed_dtype(array)
+            if dtype is None:
+                dtype = sample_dtype
+            elif sample_dtype.itemsize > np.dtype(dtype).itemsize and not fixed_dtype:
+                logger.info(f"Sample {idx} needs {sample_dtype}, widening the pack")
+                f.close()
+                _widen(tmp_path, sample_dtype)
+                f = open(tmp_path, "ab")
+                dtype = sample_dtype
+            if not check_fits(array, dtype):
+                raise ValueError(
+                    f"Sample {idx} values {array.min()}..{array.max()} "
+                    f"do not fit in {np.dtype(dtype)}"
+                )
+            f.write(array.astype(dtype, copy=False).tobytes())
+            offsets.append(offsets[-1] + array.size)
+            shapes.append(array.shape)
+            labels.append(int(label))
+            source_indices.append(idx)
+            paths.append(sample_path(dataset, idx))
+    finally:
+        f.close()
+    os.replace(tmp_path, data_path)
+
+    ndim = max((len(shape) for shape in shapes), default=0)
+    np.savez(
+        root / "index.npz",
+        offsets=np.asarray(offsets, dtype=np.int64),
+        # Shapes are left padded with ones so samples of different rank share one array
+        shapes=np.asarray(
+            [(1,) * (ndim - len(shape)) + tuple(shape) for shape in shapes],
+            dtype=np.int64,
+        ).reshape(len(shapes), ndim),
+        ndims=np.asarray([len(shape) for shape in shapes], dtype=np.int64),
+        labels=np.asarray(labels, dtype=np.int64),
+        source_indices=np.asarray(source_indices, dtype=np.int64),
+    )
+    meta = {
+        "dtype": np.dtype(dtype or np.uint8).name,
+        "samples": len(labels),
+        "labelled": labelled,
+        "paths": paths if any(path is not None for path in paths) else None,
+        "transform": repr(getattr(dataset, "transform", None)),
+    }
+    with open(root / "meta.json", "w") as f:
+        json.dump(meta, f, indent=1)
+    logger.info(f"Packed {len(labels)} samples ({offsets[-1]} values) into {root}")
+    return PackedDataset(root)
+
+
+class PackedDataset(Dataset):
+    """
+    Dataset over a directory written by `pack` (or `bie pack`).
+    Samples are (image, label) pairs, or only the image for packs of unlabelled samples.
+    Images are zero-copy torch.from_numpy views of the memory map, which is opened
+    copy-on-write and lazily in each DataLoader worker, so transforms may write to them
+    without touching the file.
+
+    Args:
+        root: Directory written by `pack`.
+        transform: Applied to every sample, e.g. the random augmentations.
+    """
+
+    def __init__(self, root, transform=None, target_transform=None):
+        self.root = Path(root)
+        self.transform = transform
+        self.target_transform = target_transform
+        with open(self.root / "meta.json") as f:
+            self.meta = json.load(f)
+        with np.load(self.root / "index.npz") as index:
+            self.offsets = index["offsets"]
+            self.shapes = index["shapes"]
+            self.ndims = index["ndims"]
+            self.labels = index["labels"]
+            self.source_indices = index["source_indices"]
+        # ImageFolder-style metadata, read by StratifiedSampler and sample_path
+        self.targets = self.labels
+        if self.meta["paths"] is not None:
+            self.image_paths = self.meta["paths"]
+        self._data = None
+
+    @property
+    def data(self) -> np.ndarray:
+        if self._data is None:
+            self._data = np.memmap(
+                self.root / "data.bin", dtype=self.meta["dtype"], mode="c"
+            )
+        return self._data
+
+    def __getstate__(self):
+        # Workers map the file themselves rather than receive a pickled copy of it
+        state = self.__dict__.copy()
+        state["_data"] = None
+        return state
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, idx):
+        shape = self.shapes[idx][len(self.shapes[idx]) - self.ndims[idx] :]
+        array = self.data[self.offsets[idx] : self.offsets[idx + 1]].reshape(shape)
+        image = torch.from_numpy(array)
+        if self.transform is not None:
+            image = self.transform(image)
+        # Packs written before "labelled" was recorded always had labels
+        if not self.meta.get("labelled", True):
+            return image
+        label = int(self.labels[idx])
+        if self.target_transform is not None:
+            label = self.target_transform(label)
+        return image, label
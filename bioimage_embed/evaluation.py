@@ -0,0 +1,201 @@
+"""
+Scoring of embeddings and baseline features (EFD, regionprops, ...) by how well a classifier
+predicts the class labels from them.
+
+Every feature set is scored on the same precomputed stratified folds, all trials x folds run in
+parallel with joblib, and with a `cache_dir` the scores of each fold are cached under the hash
+of the features, so comparing a new checkpoint only fits the folds of the new embeddings.
+probe="linear" swaps the random forest for a logistic regression, a much faster linear probe.
+"""
+
+import hashlib
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from joblib import Memory, Parallel, delayed
+from sklearn import metrics
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import StratifiedKFold
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+logger = logging.getLogger(__name__)
+
+Fold = Tuple[np.ndarray, np.ndarray]
+
+
+def fold_indices(y, n_splits: int = 5, random_state: int = 42) -> List[Fold]:
+    """
+    (train, test) indices of stratified k-fold splits, computed once and shared by every trial.
+    """
+    y = np.asarray(y)
+    splitter = StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=random_state)
+    return list(splitter.split(np.zeros((len(y), 1)), y))
+
+
+def feature_hash(*arrays) -> str:
+    """
+    Hash of the content, dtype and shape of arrays, used as the cache key of a feature set.
+    """
+    hasher = hashlib.sha256()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        if array.dtype == object:
+            array = array.astype(str)
+        hasher.update(f"{array.dtype}{array.shape}".encode())
+        hasher.update(array.tobytes())
+    return hasher.hexdigest()
+
+
+def make_classifier(probe: str = "forest", random_state: int = 42) -> Pipeline:
+    if probe == "forest":
+        clf = RandomForestClassifier(random_state=random_state)
+    elif probe == "linear":
+        clf = LogisticRegression(max_iter=1000)
+    else:
+        raise ValueError(f"Unknown probe {probe!r}, expected 'forest' or 'linear'")
+    return Pipeline([("scaler", StandardScaler()), ("clf", clf)])
+
+
+def score_fold(X, y, train, test, probe: str = "forest", random_state: int = 42) -> dict:
+    """
+    Fits the probe on `train` and scores it on `test`,
+    with the same test_<metric> keys as sklearn's cross_validate.
+    """
+    clf = make_classifier(probe, random_state)
+    start = time.perf_counter()
+    clf.fit(X[train], y[train])
+    fit_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    y_pred = clf.predict(X[test])
+    y_score = clf.predict_proba(X[test])
+    if y_score.shape[1] == 2:
+        y_score = y_score[:, 1]
+    scores = {
+        "fit_time": fit_time,
+        "score_time": time.perf_counter() - start,
+        "test_accuracy": metrics.balanced_accuracy_score(y[test], y_pred),
+        "test_precision": metrics.precision_score(
+            y[test], y_pred, average="macro", zero_division=0
+        ),
+        "test_recall": metrics.recall_score(
+            y[test], y_pred, average="macro", zero_division=0
+        ),
+        "test_f1": metrics.f1_score(y[test], y_pred, average="macro", zero_division=0),
+        "test_roc_auc": metrics.roc_auc_score(
+            y[test], y_score, average="macro", multi_class="ovr", labels=clf.classes_
+        ),
+    }
+    return scores
+
+
+def _cached_score_fold(key, fold, probe, random_state, X, y, train, test):
+    # Only key, fold, probe and random_state make up the cache key, hashing X for every fold would be slow
+    return score_fold(X, y, train, test, probe=probe, random_state=random_state)
+
+
+def score_trials(
+    trials: Dict[str, np.ndarray],
+    y,
+    folds: Optional[List[Fold]] = None,
+    n_splits: int = 5,
+    probe: str = "forest",
+    n_jobs: int = -1,
+    cache_dir=None,
+    random_state: int = 42,
+) -> pd.DataFrame:
+    """
+    Scores every feature set in `trials` against the labels `y` on shared folds.
+
+    Args:
+        trials: Feature sets by name, arrays or DataFrames of shape (n_samples, n_features) in the order of `y`.
+        folds: (train, test) indices, by default fold_indices(y, n_splits).
+        probe: "forest" for a random forest, "linear" for a logistic regression.
+        n_jobs: joblib workers shared by all trials x folds.
+        cache_dir: Cache the scores of each fold here, keyed by the hash of the features, labels and folds.
+
+    Returns:
+        One row per trial and fold with the trial, fold, fit_time, score_time and test_<metric> columns.
+    """
+    y = np.asarray(y)
+    folds = fold_indices(y, n_splits, random_state) if folds is None else folds
+    score = _cached_score_fold
+    if cache_dir is not None:
+        score = Memory(cache_dir, verbose=0).cache(
+            _cached_score_fold, ignore=["X", "y", "train", "test"]
+        )
+
+    folds_key = feature_hash(*[index for fold in folds for index in fold])
+    tasks = []
+    for name, X in trials.items():
+        X = np.asarray(X, dtype=float)
+        key = feature_hash(X, y) + folds_key
+        for i, (train, test) in enumerate(folds):
+            tasks.append((name, i, (key, i, probe, random_state, X, y, train, test)))
+
+    results = Parallel(n_jobs=n_jobs)(delayed(score)(*args) for _, _, args in tasks)
+    df = pd.DataFrame(results)
+    df.insert(0, "fold", [i for _, i, _ in tasks])
+    df.insert(0, "trial", [name for name, _, _ in tasks])
+    return df
+
+
+def scoring_df(X, y, **kwargs) -> pd.DataFrame:
+    """
+    Cross-validated scores of a single feature set, see score_trials.
+    """
+    return score_trials({"features": X}, y, **kwargs).drop(columns=["trial", "fold"])
+
+
+def embedding_trials(roots) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+    """
+    Loads the embeddings written by `bie infer` from each directory in `roots` as one trial,
+    keeping the samples present in all of them.
+
+    Returns:
+        (trials, labels), the trials keyed by directory.
+    """
+    from .inference import read_embeddings
+
+    dfs = {str(root): read_embeddings(root) for root in roots}
+    index = None
+    for df in dfs.values():
+        index = df.index if index is None else index.intersection(df.index)
+    trials = {
+        name: np.stack(df.loc[index, "embedding"].to_numpy()) for name, df in dfs.items()
+    }
+    labels = next(iter(dfs.values())).loc[index, "label"].to_numpy()
+    return trials, labels
+
+
+def umap_plot(df, path, hue="Class", width=3.45, height=3.45 / 1.618, seed=42):
+    """
+    Semi-supervised UMAP of the rows of `df`, coloured by the `hue` column, saved to `path`.
+    30% of the labels are hidden from UMAP so the layout is not just the classes.
+    """
+    import matplotlib.pyplot as plt
+    from umap import UMAP
+
+    labels = df[hue].astype("category")
+    features = df.drop(columns=hue)
+    rng = np.random.default_rng(seed)
+    semi_labels = np.where(rng.random(len(df)) < 0.7, labels.cat.codes, -1)
+    embedding = UMAP(
+        n_neighbors=15, min_dist=0.1, n_components=2, random_state=seed
+    ).fit_transform(features, y=semi_labels)
+
+    fig, ax = plt.subplots(figsize=(width, height))
+    for code, label in enumerate(labels.cat.categories):
+        points = embedding[labels.cat.codes == code]
+        ax.scatter(*points.T, s=5, alpha=0.5, edgecolors="none", label=label)
+    ax.legend(loc="upper center", bbox_to_anchor=(0.5, 1.15), ncol=4, frameon=False)
+    ax.set_axis_off()
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+    return embedding
@@ -0,0 +1,260 @@
+"""
+Streaming inference: embeddings are computed batch by batch and written to
+fixed-size Parquet shards (shard-00000.parquet, ...) so memory is bounded by one
+shard rather than the whole dataset. Shards are written atomically, so a rerun
+skips the shards already on disk and resumes where the last run stopped,
+provided the dataset length and shard size recorded in _meta.json still match.
+Unless reconstructions are asked for only the encoder is run,
+so the decoder and loss are skipped entirely.
+
+The shard directory reads back as one table (`read_embeddings` or
+`pandas.read_parquet`) with columns index, label (-1 for image-only datasets), path,
+embedding and optionally reconstruction.
+"""
+
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import torch
+from torch.utils.data import DataLoader, Dataset, Subset
+
+logger = logging.getLogger(__name__)
+
+
+def sample_path(dataset: Dataset, index: int) -> Optional[str]:
+    """
+    Source file of a sample, looking through Subsets to ImageFolder.samples or DatasetGlob.image_paths.
+    """
+    while isinstance(dataset, Subset):
+        index = dataset.indices[index]
+        dataset = dataset.dataset
+    # DatasetGlob also has a `samples` attribute, but it is a count
+    if isinstance(getattr(dataset, "samples", None), list):
+        return str(dataset.samples[index][0])
+    if hasattr(dataset, "image_paths"):
+        return str(dataset.image_paths[index % len(dataset.image_paths)])
+    return None
+
+
+class EmbeddingWriter:
+    """
+    Writes embeddings of `num_samples` samples to Parquet shards of `shard_size` rows.
+    Both are recorded in _meta.json under `root`, resuming a job with a different dataset
+    length or shard size raises ValueError rather than mixing shards of the two.
+    """
+
+    def __init__(self, root, num_samples: int, shard_size: int = 4096):
+        self.root = Path(root)
+        self.num_samples = num_samples
+        self.shard_size = shard_size
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.check_meta()
+
+    @property
+    def meta_path(self) -> Path:
+        # pyarrow skips files starting with "_" when reading the directory as a table
+        return self.root / "_meta.json"
+
+    def check_meta(self):
+        meta = {"num_samples": self.num_samples, "shard_size": self.shard_size}
+        if self.meta_path.is_file():
+            with open(self.meta_path) as f:
+                written = json.load(f)
+            if written != meta:
+                raise ValueError(
+                    f"{self.root} holds shards of {written}, not {meta}; "
+                    "write to another directory or remove the shards"
+                )
+            return
+        if any(self.root.glob("shard-*.parquet")):
+            raise ValueError(
+                f"{self.root} holds shards without {self.meta_path.name}, "
+                "their dataset length and shard size cannot be checked"
+            )
+        tmp_path = self.meta_path.with_suffix(f".json.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.meta_path)
+
+    @property
+    def num_shards(self) -> int:
+        return -(-self.num_samples // self.shard_size)
+
+    def shard_path(self, shard: int) -> Path:
+        return self.root / f"shard-{shard:05d}.parquet"
+
+    def shard_indices(self, shard: int) -> range:
+        start = shard * self.shard_size
+        return range(start, min(start + self.shard_size, self.num_samples))
+
+    def is_complete(self, shard: int) -> bool:
+        return self.shard_path(shard).is_file()
+
+    def pending_shards(self) -> List[int]:
+        return [shard for shard in range(self.num_shards) if not self.is_complete(shard)]
+
+    def write(
+        self,
+        shard: int,
+        index: np.ndarray,
+        embedding: np.ndarray,
+        label: np.ndarray,
+        path: List[Optional[str]],
+        reconstruction: Optional[np.ndarray] = None,
+    ):
+        embedding = embedding.astype(np.float32, copy=False)
+        columns = {
+            "index": pa.array(index, type=pa.int64()),
+            "label": pa.array(label),
+            "path": pa.array(path, type=pa.string()),
+            "embedding": pa.FixedSizeListArray.from_arrays(
+                embedding.reshape(-1), embedding.shape[1]
+            ),
+        }
+        metadata = {}
+        if reconstruction is not None:
+            flat = reconstruction.astype(np.float32, copy=False).reshape(
+                len(reconstruction), -1
+            )
+            columns["reconstruction"] = pa.FixedSizeListArray.from_arrays(
+                flat.reshape(-1), flat.shape[1]
+            )
+            metadata[b"reconstruction_shape"] = str(
+                list(reconstruction.shape[1:])
+            ).encode()
+        table = pa.table(columns).replace_schema_metadata(metadata)
+        shard_path = self.shard_path(shard)
+        # Write then rename so an interrupted run never leaves a partial shard behind,
+        # the leading "." keeps a leftover temp file out of pyarrow's directory reads
+        tmp_path = shard_path.with_name(f".{shard_path.name}.{os.getpid()}.tmp")
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, shard_path)
+
+
+def shard_batches(writer: EmbeddingWriter, shards: List[int], batch_size: int):
+    """
+    (shard, indices) for every batch of the given shards.
+    Batches never straddle a shard, so a shard is complete as soon as its last batch is done.
+    """
+    plan = []
+    for shard in shards:
+        indices = writer.shard_indices(shard)
+        for start in range(0, len(indices), batch_size):
+            plan.append((shard, list(indices[start : start + batch_size])))
+    return plan
+
+
+def read_embeddings(root) -> pd.DataFrame:
+    """
+    Loads every shard under `root` into one DataFrame indexed by sample index.
+    """
+    df = pd.read_parquet(root).set_index("index").sort_index()
+    df["embedding"] = df["embedding"].map(np.asarray)
+    return df
+
+
+def stream_embeddings(
+    lit_model,
+    dataset: Dataset,
+    root,
+    batch_size: int = 256,
+    num_workers: int = 4,
+    shard_size: int = 4096,
+    reconstructions: bool = False,
+    channels_last: bool = False,
+    bf16: bool = False,
+    device=None,
+) -> EmbeddingWriter:
+    """
+    Embeds `dataset` with `lit_model` and writes the results shard by shard under `root`.
+    Shards that already exist are skipped, so rerunning after an interruption resumes the job.
+
+    Args:
+        reconstructions: Run the full model and store recon_x as well, otherwise only the encoder runs.
+        channels_last: Use the channels-last memory format, faster for convolutions on most hardware.
+        bf16: Autocast to bfloat16, on CPU as well as GPU.
+
+    Returns:
+        The EmbeddingWriter, with the throughput of this run in `writer.stats`.
+    """
+    writer = EmbeddingWriter(root, len(dataset), shard_size)
+    pending = writer.pending_shards()
+    if len(pending) < writer.num_shards:
+        logger.info(
+            f"Resuming: {writer.num_shards - len(pending)}/{writer.num_shards} shards already written"
+        )
+    plan = shard_batches(writer, pending, batch_size)
+    writer.stats = {"images": 0, "seconds": 0.0, "images_per_sec": 0.0}
+    if not plan:
+        return writer
+
+    device = torch.device(
+        device or ("cuda" if torch.cuda.is_available() else "cpu")
+    )
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+    lit_model = lit_model.to(device, memory_format=memory_format).eval()
+    dataloader = DataLoader(
+        dataset,
+        batch_sampler=[indices for _, indices in plan],
+        num_workers=num_workers,
+        pin_memory=device.type == "cuda",
+    )
+
+    buffer = {"index": [], "embedding": [], "label": [], "reconstruction": []}
+    start = time.perf_counter()
+    with torch.inference_mode(), torch.autocast(
+        device.type, dtype=torch.bfloat16, enabled=bf16
+    ):
+        for i, ((shard, indices), batch) in enumerate(zip(plan, dataloader)):
+            if isinstance(batch, torch.Tensor):
+                # Image-only datasets (DatasetGlob, unlabelled packs) are labelled -1, as in pack
+                x, y = batch, torch.full((len(batch),), -1, dtype=torch.int64)
+            else:
+                x, y = lit_model.batch_to_xy(batch)
+            x = x.to(device, non_blocking=True)
+            if channels_last and x.dim() == 4:
+                x = x.contiguous(memory_format=torch.channels_last)
+            if reconstructions:
+                model_output = lit_model.predict_step((x, y), i)
+                z = lit_model.embedding(model_output)
+                buffer["reconstruction"].append(
+                    model_output.recon_x.float().cpu().numpy()
+                )
+            else:
+                z = lit_model.encode(x)
+            buffer["index"].append(np.asarray(indices))
+            buffer["embedding"].append(z.float().cpu().numpy())
+            buffer["label"].append(np.asarray(y))
+
+            if i + 1 < len(plan) and plan[i + 1][0] == shard:
+                continue
+            index = np.concatenate(buffer["index"])
+            writer.write(
+                shard,
+                index=index,
+                embedding=np.concatenate(buffer["embedding"]),
+                label=np.concatenate(buffer["label"]),
+                path=[sample_path(dataset, idx) for idx in index],
+                reconstruction=np.concatenate(buffer["reconstruction"])
+                if reconstructions
+                else None,
+            )
+            writer.stats["images"] += len(index)
+            logger.info(f"Wrote {writer.shard_path(shard)}")
+            buffer = {key: [] for key in buffer}
+
+    writer.stats["seconds"] = time.perf_counter() - start
+    writer.stats["images_per_sec"] = writer.stats["images"] / writer.stats["seconds"]
+    logger.info(
+        f"Embedded {writer.stats['images']} images in {writer.stats['seconds']:.1f}s "
+        f"({writer.stats['images_per_sec']:.1f} images/sec)"
+    )
+    return writer
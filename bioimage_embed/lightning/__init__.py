@@ -1,5 +1,27 @@
-from .pyro import LitAutoEncoderPyro
-from .torch import AESupervised, AEUnsupervised, AutoEncoder, AE, AutoEncoderSupervised, AutoEncoderUnsupervised
-from .dataloader import DataModule
+# Imported on first access (PEP 562), as pytorch_lightning alone takes seconds to import
+import importlib
+
+_attributes = {
+    "LitAutoEncoderPyro": ".pyro",
+    "AESupervised": ".torch",
+    "AEUnsupervised": ".torch",
+    "AutoEncoder": ".torch",
+    "AE": ".torch",
+    "AutoEncoderSupervised": ".torch",
+    "AutoEncoderUnsupervised": ".torch",
+    "DataModule": ".dataloader",
+}
 
 __all__ = ["LitAutoEncoderPyro", "AESupervised", "AEUnsupervised", "DataModule", "AutoEncoder","AE","AutoEncoderUnsupervised","AutoEncoderSupervised"]
+
+
+def __getattr__(name):
+    if name in _attributes:
+        value = getattr(importlib.import_module(_attributes[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted({*globals(), *_attributes})
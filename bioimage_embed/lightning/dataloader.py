@@ -1,16 +1,60 @@
 from torch.utils.data import DataLoader, WeightedRandomSampler
 import pytorch_lightning as pl
 import torch
-from torch.utils.data import Dataset, random_split
+from torch.utils.data import Dataset, Subset, TensorDataset, random_split
 from typing import Tuple
 from functools import partial
+from multiprocessing.context import get_spawning_popen
+from pathlib import Path
+import json
+import logging
+import multiprocessing
+import os
+import random
+import re
 import numpy as np
 
+from ..utils import is_invalid, stacked_batch
+
+logger = logging.getLogger(__name__)
+
+
+def metadata_targets(dataset):
+    """
+    Labels read from dataset metadata without loading any samples:
+    ImageFolder-style `targets`, TensorDataset label tensors, mapped through Subset.indices.
+    Returns None when the dataset has no such metadata.
+    """
+    if isinstance(dataset, Subset):
+        targets = metadata_targets(dataset.dataset)
+        if targets is None:
+            return None
+        return targets[np.asarray(dataset.indices, dtype=np.int64)]
+    if isinstance(dataset, TensorDataset):
+        return np.asarray(dataset.tensors[1]) if len(dataset.tensors) > 1 else None
+    targets = getattr(dataset, "targets", None)
+    if targets is None:
+        return None
+    return np.asarray(targets)
+
+
+def dataset_targets(dataset):
+    """
+    Labels of every sample in the dataset.
+    Falls back to dataset[i][1], which decodes and transforms every sample, only without metadata.
+    """
+    targets = metadata_targets(dataset)
+    if targets is None:
+        targets = np.array([dataset[i][1] for i in range(len(dataset))])
+    return targets
+
 
 class StratifiedSampler(WeightedRandomSampler):
-    def __init__(self, dataset, replacement=True):
+    def __init__(self, dataset, replacement=True, targets=None):
         # Get the labels (targets) from the dataset
-        self.targets = np.array([dataset[i][1] for i in range(len(dataset))])
+        self.targets = np.asarray(
+            dataset_targets(dataset) if targets is None else targets
+        )
 
         # Count the occurrences of each class
         class_counts = np.bincount(self.targets)
@@ -29,20 +73,108 @@ class StratifiedSampler(WeightedRandomSampler):
         )
 
 
+def find_batch_transform(dataset):
+    """
+    batch_transform of the transform of `dataset`, looking through Subsets and wrappers.
+    """
+    while dataset is not None:
+        batch_transform = getattr(
+            getattr(dataset, "transform", None), "batch_transform", None
+        )
+        if batch_transform is not None:
+            return batch_transform
+        dataset = getattr(dataset, "dataset", None)
+    return None
+
+
 # https://stackoverflow.com/questions/74931838/cant-pickle-local-object-evaluationloop-advance-locals-batch-to-device-pyto
 class Collator:
+    """
+    Collate function that drops invalid samples (INVALID or None, see utils.is_invalid).
+
+    With refill=True short batches are topped up with samples drawn from a reservoir,
+    a uniform sample of up to `reservoir_size` valid samples seen so far, so every batch
+    keeps its size. Each DataLoader worker keeps its own reservoir.
+    Dropped and refilled counts live in shared memory, so they add up over all workers;
+    `reset()` returns them and starts counting again, e.g. once per epoch.
+    """
+
+    def __init__(self, refill=False, reservoir_size=256, seed=42):
+        self.refill = refill
+        self.reservoir_size = reservoir_size
+        self.reservoir = []
+        self.seen = 0
+        self.rng = random.Random(seed)
+        self.counters = {
+            "dropped": multiprocessing.Value("l", 0),
+            "refilled": multiprocessing.Value("l", 0),
+        }
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Shared counters can only be pickled when starting a worker, copies elsewhere count on their own
+        if get_spawning_popen() is None:
+            state["counters"] = {
+                name: multiprocessing.Value("l", counter.value)
+                for name, counter in self.counters.items()
+            }
+        return state
+
+    def add_to_reservoir(self, sample):
+        # Reservoir sampling (algorithm R), every valid sample is kept with equal probability
+        self.seen += 1
+        if len(self.reservoir) < self.reservoir_size:
+            self.reservoir.append(sample)
+            return
+        i = self.rng.randrange(self.seen)
+        if i < self.reservoir_size:
+            self.reservoir[i] = sample
+
+    def count(self, name, n):
+        if n:
+            with self.counters[name].get_lock():
+                self.counters[name].value += n
+
+    def stats(self):
+        return {name: counter.value for name, counter in self.counters.items()}
+
+    def reset(self):
+        stats = self.stats()
+        for counter in self.counters.values():
+            with counter.get_lock():
+                counter.value = 0
+        return stats
+
     def collate_filter_for_none(self, batch):
         """
-        Collate function that filters out None values from the batch.
+        Collate function that filters out invalid samples from the batch.
 
         Args:
             batch: The batch to be filtered.
 
         Returns:
-            The filtered batch.
+            The filtered batch, or None when no valid sample is left.
+            Batches the dataset already stacked have no invalid samples and are
+            returned as a tensor without another copy.
         """
-        batch = list(filter(lambda x: x is not None, batch))
-        return torch.utils.data.dataloader.default_collate(batch)
+        stacked = stacked_batch(batch)
+        if stacked is not None:
+            if self.refill:
+                for sample in batch:
+                    self.add_to_reservoir(sample)
+            return stacked
+        valid = [sample for sample in batch if not is_invalid(sample)]
+        self.count("dropped", len(batch) - len(valid))
+        if self.refill:
+            for sample in valid:
+                self.add_to_reservoir(sample)
+            missing = len(batch) - len(valid)
+            if missing and self.reservoir:
+                valid += self.rng.choices(self.reservoir, k=missing)
+                self.count("refilled", missing)
+        if not valid:
+            return None
+        return torch.utils.data.dataloader.default_collate(valid)
 
     def __call__(self, incoming):
         # do stuff with incoming
@@ -71,6 +203,8 @@ class DataModule(pl.LightningDataModule):
         drop_last: bool = False,
         # sampler=None,
         sampler=StratifiedSampler,
+        refill: bool = False,
+        batch_transform=None,
     ):
         """
         Initializes the DataModule with the given dataset and parameters.
@@ -82,10 +216,21 @@ class DataModule(pl.LightningDataModule):
             pin_memory: Whether to use pinned memory for data loading. Default is False.
             drop_last: Whether to drop the last incomplete batch. Default is False.
             collate_fn: The function to use for collating data into batches. Default is None.
+            refill: Top up batches with invalid samples from a reservoir of valid ones. Default is False.
+            batch_transform: Augmentation of whole training batches once on the device,
+                by default the batch_transform of a VisionWrapper(batch=True) dataset transform.
         """
         super().__init__()
         self.dataset = dataset
-        self.collator = Collator()
+        if batch_transform is None:
+            batch_transform = find_batch_transform(dataset)
+        self.batch_transform = batch_transform
+        # One collator per stage, so dropped samples are counted separately
+        self.collators = {
+            stage: Collator(refill=refill and stage == "train")
+            for stage in ("train", "val", "test", "predict")
+        }
+        self.collator = self.collators["train"]
         self.sampler = sampler
         self.dataloader = partial(
             DataLoader,
@@ -93,12 +238,12 @@ class DataModule(pl.LightningDataModule):
             num_workers=num_workers,
             pin_memory=pin_memory,
             drop_last=drop_last,
-            collate_fn=self.collator,
         )
 
         self.train_dataset = None
         self.val_dataset = None
         self.test_dataset = None
+        self._targets = None
         self.setup()
 
     def setup(self, stage=None):
@@ -145,38 +290,87 @@ class DataModule(pl.LightningDataModule):
             indices, [train_size, val_size, test_size]
         )
 
-        train_dataset = torch.utils.data.Subset(dataset, train_indices)
-        val_dataset = torch.utils.data.Subset(dataset, val_indices)
-        test_dataset = torch.utils.data.Subset(dataset, test_indices)
+        # Plain index lists so the splits can be mapped onto cached targets
+        train_dataset = torch.utils.data.Subset(dataset, train_indices.indices)
+        val_dataset = torch.utils.data.Subset(dataset, val_indices.indices)
+        test_dataset = torch.utils.data.Subset(dataset, test_indices.indices)
 
         return train_dataset, val_dataset, test_dataset
 
     def get_dataset(self):
         return self.dataset
 
+    @property
+    def targets(self):
+        """
+        Labels of the whole dataset, computed once and reused by every split and epoch.
+        """
+        if self._targets is None:
+            self._targets = dataset_targets(self.dataset)
+        return self._targets
+
+    def train_sampler(self):
+        if isinstance(self.sampler, type) and issubclass(
+            self.sampler, StratifiedSampler
+        ):
+            return self.sampler(
+                self.train_dataset,
+                targets=self.targets[np.asarray(self.train_dataset.indices)],
+            )
+        return self.sampler(self.train_dataset)
+
     def train_dataloader(self):
         return self.init_dataloader(
             self.train_dataset,
             shuffle=False,
-            sampler=self.sampler(self.train_dataset),
+            sampler=self.train_sampler(),
+            stage="train",
         )
 
     def val_dataloader(self):
-        return self.init_dataloader(self.val_dataset, shuffle=False)
+        return self.init_dataloader(self.val_dataset, shuffle=False, stage="val")
 
     def test_dataloader(self):
-        return self.init_dataloader(self.test_dataset, shuffle=False)
+        return self.init_dataloader(self.test_dataset, shuffle=False, stage="test")
 
     def predict_dataloader(self):
-        return self.init_dataloader(self.dataset, shuffle=False)
+        return self.init_dataloader(self.dataset, shuffle=False, stage="predict")
+
+    def on_after_batch_transfer(self, batch, dataloader_idx):
+        # Only training batches are augmented, and batches left empty by the collator are None
+        if batch is None or self.batch_transform is None:
+            return batch
+        if self.trainer is None or not self.trainer.training:
+            return batch
+        if isinstance(batch, torch.Tensor):
+            # Images only, e.g. DatasetGlob
+            return self.augment(batch)
+        if isinstance(batch, dict):
+            return {**batch, "image": self.augment(batch["image"])}
+        x, *rest = batch
+        return [self.augment(x), *rest]
+
+    def augment(self, x: torch.Tensor) -> torch.Tensor:
+        self.batch_transform.to(x.device)
+        return self.batch_transform(x)
+
+    def invalid_samples(self, reset=True):
+        """
+        Dropped and refilled sample counts of every stage since the last reset.
+        """
+        return {
+            stage: collator.reset() if reset else collator.stats()
+            for stage, collator in self.collators.items()
+        }
 
-    def init_dataloader(self, dataset, shuffle=False, sampler=None):
+    def init_dataloader(self, dataset, shuffle=False, sampler=None, stage="train"):
         """
         Initializes a dataloader for the given dataset.
 
         Args:
             dataset: The dataset to be loaded.
             shuffle: Whether to shuffle the dataset. Default is False.
+            stage: Which collator, and so which invalid sample counters, to use. Default is "train".
 
         Returns:
             The dataloader for the dataset.
@@ -186,24 +380,132 @@ class DataModule(pl.LightningDataModule):
                 dataset,
                 shuffle=shuffle,
                 sampler=sampler,
+                collate_fn=self.collators[stage],
             )
             if dataset
             else None
         )
 
 
-def valid_indices(dataset):
-    valid_indices = []
-    # Iterate through the dataset and apply the transform to each image
-    for idx in range(len(dataset)):
+class _SampleCheck(Dataset):
+    """
+    (index, error) of each sample, the error is None when the sample loads and transforms.
+    Transforms that return INVALID rather than raise fail the check too.
+    """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, idx):
         try:
-            image, label = dataset[idx]
-            # If the transform works without errors, add the index to the list of valid indices
-            valid_indices.append(idx)
+            sample = self.dataset[idx]
         except Exception as e:
-            # A better way to do with would be with batch collation
-            print(f"Error occurred for image {idx}: {e}")
+            return idx, f"{type(e).__name__}: {e}"
+        if is_invalid(sample):
+            return idx, "Invalid sample"
+        return idx, None
+
+
+def _collate_checks(batch):
+    return batch
 
-    # Create a Subset using the valid indices
-    subset = torch.utils.data.Subset(dataset, valid_indices)
-    return subset
+
+def sample_key(dataset, idx):
+    """
+    Manifest key and mtime of a sample, its file path when known and its index otherwise.
+    """
+    from ..inference import sample_path
+
+    path = sample_path(dataset, idx)
+    if path is None:
+        return f"#{idx}", None
+    try:
+        return path, os.path.getmtime(path)
+    except OSError:
+        return path, None
+
+
+def load_manifest(path, transform):
+    """
+    Samples recorded in the manifest at `path`, empty when there is none or it was made with another transform.
+    """
+    if path is None or not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get("transform") != transform:
+        logger.info(f"Transform changed since {path} was written, revalidating")
+        return {}
+    return manifest["samples"]
+
+
+def save_manifest(path, transform, samples):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Write then rename so an interrupted run never leaves a truncated manifest
+    tmp_path = path.with_suffix(f"{path.suffix}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({"transform": transform, "samples": samples}, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def validate_dataset(dataset, manifest=None, num_workers=4, chunksize=64) -> Subset:
+    """
+    Subset of the samples that load and transform without raising.
+
+    Samples are checked in parallel by DataLoader workers. With `manifest`, a JSON file,
+    the outcome for each sample is recorded with the error message of failures,
+    keyed by file path and mtime (or by index when the dataset has no paths),
+    so later runs only check new or modified files. The manifest is discarded
+    when the repr of the dataset's transform changes.
+
+    Args:
+        manifest: Path of the JSON manifest, None to always check every sample.
+        num_workers: DataLoader workers, 0 checks in this process.
+        chunksize: Samples checked per worker task.
+    """
+    # Object addresses in default reprs change every run
+    transform = re.sub(
+        r" at 0x[0-9a-f]+", "", repr(getattr(dataset, "transform", None))
+    )
+    samples = load_manifest(manifest, transform)
+    keys = [sample_key(dataset, idx) for idx in range(len(dataset))]
+    pending = [
+        idx
+        for idx, (key, mtime) in enumerate(keys)
+        if key not in samples or samples[key]["mtime"] != mtime
+    ]
+    if len(pending) < len(dataset):
+        logger.info(
+            f"{len(dataset) - len(pending)}/{len(dataset)} samples already validated in {manifest}"
+        )
+
+    checks = DataLoader(
+        Subset(_SampleCheck(dataset), pending),
+        batch_size=chunksize,
+        num_workers=num_workers,
+        collate_fn=_collate_checks,
+    )
+    for batch in checks if pending else []:
+        for idx, error in batch:
+            key, mtime = keys[idx]
+            samples[key] = {"mtime": mtime, "error": error}
+            if error is not None:
+                logger.warning(f"Invalid sample {idx} ({key}): {error}")
+
+    if manifest is not None:
+        save_manifest(manifest, transform, samples)
+    valid = [
+        idx for idx, (key, _) in enumerate(keys) if samples[key]["error"] is None
+    ]
+    return Subset(dataset, valid)
+
+
+def valid_indices(dataset, manifest=None, num_workers=4):
+    """
+    Subset of the valid samples, see validate_dataset.
+    """
+    return validate_dataset(dataset, manifest=manifest, num_workers=num_workers)
@@ -1,6 +1,15 @@
 import torch
 import pytest
-from ..torch import create_label_based_pairs, compute_contrastive_loss
+import torch.nn.functional as F
+from types import SimpleNamespace
+from ..torch import (
+    AESupervised,
+    create_label_based_pairs,
+    compute_contrastive_loss,
+    positive_mask,
+    supervised_contrastive_loss,
+)
+from ...models import create_model
 
 torch.manual_seed(42)
 
@@ -83,3 +92,57 @@ def test_compute_contrastive_loss_valid_pairs(features, labels):
     if torch.unique(labels).size(0) < labels.size(0):  # There are valid pairs
         loss = compute_contrastive_loss(features, labels)
         assert loss.item() > 0.0, "Loss should be non-zero when valid pairs exist"
+
+
+def supcon_reference(features, labels, temperature=0.1):
+    # Per-anchor loop straight from the SupCon definition
+    z = F.normalize(features, dim=1)
+    labels = labels.view(-1)
+    losses = []
+    for i in range(len(z)):
+        others = [j for j in range(len(z)) if j != i]
+        positives = [j for j in others if labels[j] == labels[i]]
+        if not positives:
+            continue
+        denominator = torch.logsumexp(z[others] @ z[i] / temperature, dim=0)
+        losses.append(
+            -torch.stack([z[j] @ z[i] / temperature - denominator for j in positives]).mean()
+        )
+    if not losses:
+        return torch.tensor(0.0)
+    return torch.stack(losses).mean()
+
+
+def test_supervised_contrastive_loss_matches_reference(features, labels):
+    loss = supervised_contrastive_loss(features, labels)
+    assert torch.allclose(loss, supcon_reference(features, labels), atol=1e-5)
+
+
+def test_supervised_contrastive_loss_no_positives(features, batch_size):
+    labels = torch.arange(batch_size).view(-1, 1)
+    assert supervised_contrastive_loss(features, labels).item() == 0.0
+
+
+@pytest.mark.parametrize("max_positives", [1, 3])
+def test_positive_mask_cap(labels, max_positives):
+    full = positive_mask(labels)
+    capped = positive_mask(labels, max_positives)
+    assert not capped.diagonal().any()
+    assert (capped & ~full).sum() == 0
+    assert torch.equal(capped.sum(1), full.sum(1).clamp(max=max_positives))
+
+
+def test_supervised_contrastive_loss_large_batch(latent_dim):
+    features = torch.rand(512, latent_dim, requires_grad=True)
+    labels = torch.randint(0, 4, (512, 1))
+    loss = supervised_contrastive_loss(features, labels, max_positives=16)
+    loss.backward()
+    assert torch.isfinite(loss)
+    assert torch.isfinite(features.grad).all()
+
+
+def test_aesupervised_supcon(features, labels):
+    model = create_model("dummy_model", (1, 8, 8), features.size(1))
+    lit_model = AESupervised(model, SimpleNamespace(contrastive="supcon"))
+    loss = lit_model.contrastive_loss(features, labels)
+    assert torch.allclose(loss, supcon_reference(features, labels), atol=1e-5)
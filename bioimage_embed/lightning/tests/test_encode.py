@@ -0,0 +1,89 @@
+import pytest
+import torch
+from pythae.models import VQVAE, VQVAEConfig
+from pythae.models.nn import BaseDecoder, BaseEncoder
+from transformers.utils import ModelOutput
+
+from bioimage_embed.lightning import AEUnsupervised
+from bioimage_embed.models import create_model
+from bioimage_embed.models.factory import __all_small_models__
+
+
+@pytest.fixture(params=__all_small_models__)
+def model_name(request):
+    return request.param
+
+
+@pytest.fixture()
+def input_dim():
+    return (3, 64, 64)
+
+
+@pytest.fixture()
+def latent_dim():
+    return 16
+
+
+@pytest.fixture()
+def lit_model(model_name, input_dim, latent_dim):
+    torch.manual_seed(42)
+    model = create_model(model_name, input_dim, latent_dim, pretrained=False)
+    return AEUnsupervised(model).eval()
+
+
+@pytest.fixture()
+def batch(input_dim):
+    return torch.rand(4, *input_dim), torch.zeros(4)
+
+
+def test_encode_shape(lit_model, batch, latent_dim):
+    z = lit_model.embed(batch)
+    assert z.shape == (4, latent_dim)
+    assert not z.requires_grad
+
+
+def test_embed_tensor(lit_model, batch):
+    x, _ = batch
+    assert torch.equal(lit_model.embed(x), lit_model.embed(batch))
+
+
+def test_encode_is_deterministic_mean(lit_model, batch):
+    x, _ = batch
+    with torch.no_grad():
+        model_output = lit_model.predict_step(batch, 0)
+        if hasattr(lit_model.model, "quantizer"):
+            expected = lit_model.embedding(model_output)
+        else:
+            expected = lit_model.encoder(x).embedding
+    assert torch.allclose(lit_model.embed(batch), expected)
+
+
+class SpatialEncoder(BaseEncoder):
+    # (B, C, H, W) latents with C != H, W so a channels last flatten would differ
+    def __init__(self, channels):
+        super().__init__()
+        self.conv = torch.nn.Conv2d(3, channels, 4, stride=4)
+
+    def forward(self, x):
+        return ModelOutput(embedding=self.conv(x))
+
+
+class SpatialDecoder(BaseDecoder):
+    def __init__(self, channels):
+        super().__init__()
+        self.conv = torch.nn.ConvTranspose2d(channels, 3, 4, stride=4)
+
+    def forward(self, z):
+        return ModelOutput(reconstruction=self.conv(z))
+
+
+def test_encode_spatial_vq_matches_predict():
+    torch.manual_seed(42)
+    config = VQVAEConfig(input_dim=(3, 32, 32), latent_dim=4, num_embeddings=16)
+    model = VQVAE(config, encoder=SpatialEncoder(4), decoder=SpatialDecoder(4))
+    lit_model = AEUnsupervised(model).eval()
+    batch = torch.rand(2, 3, 32, 32), torch.zeros(2)
+    with torch.no_grad():
+        expected = lit_model.embedding(lit_model.predict_step(batch, 0))
+    assert expected.shape == (2, 4 * 8 * 8)
+    assert torch.equal(lit_model.embed(batch), expected)
@@ -1,12 +1,20 @@
 import torchvision
 import torch
 import pytorch_lightning as pl
-from timm import optim, scheduler
 from types import SimpleNamespace
 import argparse
-from transformers.utils import ModelOutput
 import torch.nn.functional as F
-from monai import losses
+from typing import TYPE_CHECKING
+from ..utils import lazy_import
+
+if TYPE_CHECKING:
+    from transformers.utils import ModelOutput
+
+# Only needed once a model runs or trains, and each takes seconds to import
+optim = lazy_import("timm.optim")
+scheduler = lazy_import("timm.scheduler")
+losses = lazy_import("monai.losses")
+transformers_utils = lazy_import("transformers.utils")
 
 """
 x_recon -> output of the model
@@ -59,19 +67,19 @@ class AutoEncoder(pl.LightningModule):
         # self.example_input_array = torch.randn(1, *self.model.input_dim)
         # self.model.train()
 
-    def forward(self, x: torch.Tensor) -> ModelOutput:
+    def forward(self, x: torch.Tensor) -> "ModelOutput":
         """
         Forward pass of the model
         Pythae models take in ModelOutput objects, and return ModelOutput objects so that we can pass in and return multiple tensors
         """
-        return self.model(ModelOutput(data=x.float()))
+        return self.model(transformers_utils.ModelOutput(data=x.float()))
 
     def predict_step(
         self, batch: tuple, batch_idx: int, dataloader_idx=0
-    ) -> ModelOutput:
+    ) -> "ModelOutput":
         return self.batch_to_tensor(batch)
 
-    def batch_to_tensor(self, batch) -> ModelOutput:
+    def batch_to_tensor(self, batch) -> "ModelOutput":
         """
         This takes in a batch and returns a ModelOutput object.
         Lightning batches are x,y pairs of tensors, but we only need the x tensor for the model.
@@ -83,10 +91,42 @@ class AutoEncoder(pl.LightningModule):
         model_output.target = y
         return model_output
 
-    def embedding(self, model_output: ModelOutput) -> torch.Tensor:
+    def embedding(self, model_output: "ModelOutput") -> torch.Tensor:
         return model_output.z.view(model_output.z.shape[0], -1)
 
+    def encode(self, x: torch.Tensor) -> torch.Tensor:
+        """
+        Encoder-only forward pass, skipping the decoder, reparameterisation and loss.
+        Returns the posterior mean for VAEs and the quantised code for VQ-VAEs, flattened to (batch, latent).
+        """
+        embedding = self.encoder(x.float()).embedding
+        quantizer = getattr(self.model, "quantizer", None)
+        if quantizer is not None:
+            # Same layout juggling as pythae's VQVAE.forward
+            if embedding.dim() == 2:
+                embedding = embedding.reshape(embedding.shape[0], 1, 1, -1)
+            channels_last = embedding.permute(0, 2, 3, 1)
+            quantized = quantizer(channels_last).quantized_vector
+            # Flattened in the (B, C, H, W) order of model_output.z, which pythae's
+            # Quantizer returns, other quantizers hand back the (B, H, W, C) they were given
+            if quantized.shape != embedding.shape and quantized.shape == channels_last.shape:
+                quantized = quantized.permute(0, 3, 1, 2)
+            embedding = quantized
+        return embedding.reshape(embedding.shape[0], -1)
+
+    @torch.inference_mode()
+    def embed(self, batch) -> torch.Tensor:
+        """
+        Embeddings of an (x, y) batch or a bare tensor, without building a graph.
+        Call .eval() first, as in training mode batchnorm uses batch statistics.
+        """
+        x = batch if isinstance(batch, torch.Tensor) else self.batch_to_xy(batch)[0]
+        return self.encode(x)
+
     def training_step(self, batch: tuple, batch_idx: int) -> torch.Tensor:
+        # The Collator returns None when every sample of the batch was invalid, Lightning skips the step
+        if batch is None:
+            return None
         self.model.train()
         model_output = self.eval_step(batch, batch_idx)
         self.log_dict(
@@ -106,6 +146,8 @@ class AutoEncoder(pl.LightningModule):
         return model_output.loss
 
     def validation_step(self, batch, batch_idx):
+        if batch is None:
+            return None
         model_output = self.eval_step(batch, batch_idx)
         self.log_dict(
             {
@@ -119,6 +161,8 @@ class AutoEncoder(pl.LightningModule):
 
     def test_step(self, batch, batch_idx):
         # x, y = batch
+        if batch is None:
+            return None
         model_output = self.eval_step(batch, batch_idx)
         self.log_dict(
             {
@@ -130,6 +174,22 @@ class AutoEncoder(pl.LightningModule):
         )
         return model_output.loss
 
+    def on_train_epoch_start(self):
+        # Start counting invalid samples afresh, e.g. without the sanity check batches
+        datamodule = getattr(self.trainer, "datamodule", None)
+        if hasattr(datamodule, "invalid_samples"):
+            datamodule.invalid_samples()
+
+    def on_train_epoch_end(self):
+        # Invalid samples dropped (and refilled) by the DataModule's collators this epoch
+        datamodule = getattr(self.trainer, "datamodule", None)
+        if not hasattr(datamodule, "invalid_samples"):
+            return
+        for stage, stats in datamodule.invalid_samples().items():
+            if stage in ("train", "val"):
+                for name, value in stats.items():
+                    self.log(f"{name}/{stage}", float(value), logger=True)
+
     def batch_to_xy(self, batch):
         """
         Fangless function to be overloaded later
@@ -307,7 +367,7 @@ def create_label_based_pairs(
 
 
 def compute_contrastive_loss(
-    X: torch.Tensor, y: torch.Tensor, criterion=losses.ContrastiveLoss()
+    X: torch.Tensor, y: torch.Tensor, criterion=None
 ):
     """
     Wrapper function that computes contrastive loss using the MONAI ContrastiveLoss function.
@@ -329,13 +389,85 @@ def compute_contrastive_loss(
         return torch.tensor(0.0, device=X.device)
 
     # Compute the contrastive loss
+    if criterion is None:
+        criterion = losses.ContrastiveLoss()
     contrastive_loss = criterion(input_pairs, target_pairs)
 
     return contrastive_loss
 
 
+def positive_mask(labels: torch.Tensor, max_positives=None) -> torch.Tensor:
+    """
+    Boolean (b, b) mask of same-label pairs, excluding each sample with itself.
+    With `max_positives` each row keeps at most that many positives, chosen at random.
+    """
+    labels = labels.view(-1)
+    mask = labels.unsqueeze(0) == labels.unsqueeze(1)
+    mask.fill_diagonal_(False)
+    if max_positives is not None:
+        # Rank random scores among the positives of each row and keep the top max_positives
+        scores = torch.rand(mask.shape, device=mask.device).masked_fill(~mask, -1)
+        rank = scores.argsort(dim=1, descending=True).argsort(dim=1)
+        mask &= rank < max_positives
+    return mask
+
+
+def supervised_contrastive_loss(
+    features: torch.Tensor,
+    labels: torch.Tensor,
+    temperature: float = 0.1,
+    max_positives=None,
+):
+    """
+    Supervised contrastive (SupCon) loss over the full similarity matrix of the batch,
+    https://arxiv.org/abs/2004.11362.
+    Every same-label sample is a positive and every other sample a negative, so no pairs are materialised.
+
+    Args:
+    - features (torch.Tensor): The feature tensor of shape (batch_size, latent_dim).
+    - labels (torch.Tensor): The label tensor of shape (batch_size, 1).
+    - temperature: Softmax temperature of the cosine similarities.
+    - max_positives: Cap on the positives used per anchor, None to use them all.
+
+    Returns:
+    - loss (torch.Tensor): The mean loss over the anchors with at least one positive, zero if there are none.
+    """
+    z = F.normalize(features, dim=1)
+    logits = (z @ z.T) / temperature
+    self_mask = torch.eye(len(z), dtype=torch.bool, device=z.device)
+    logits = logits.masked_fill(self_mask, float("-inf"))
+    log_prob = logits - torch.logsumexp(logits, dim=1, keepdim=True)
+
+    positives = positive_mask(labels.to(z.device), max_positives)
+    num_positives = positives.sum(dim=1)
+    anchors = num_positives > 0
+    if not anchors.any():
+        return torch.tensor(0.0, device=z.device)
+    # where() rather than a product, as the diagonal of log_prob is -inf
+    positive_log_prob = torch.where(positives, log_prob, 0.0).sum(dim=1)
+    return -(positive_log_prob[anchors] / num_positives[anchors]).mean()
+
+
 class AutoEncoderSupervised(AutoEncoder):
-    criterion = losses.ContrastiveLoss()
+    """
+    Adds a label-based contrastive term to the autoencoder loss.
+    args.contrastive selects "pairs" (default, MONAI ContrastiveLoss on explicit positive pairs)
+    or "supcon" (supervised_contrastive_loss, with args.temperature and args.max_positives),
+    which scales to large batches.
+    """
+
+    # None defaults to monai.losses.ContrastiveLoss
+    criterion = None
+
+    def contrastive_loss(self, features, labels):
+        if getattr(self.args, "contrastive", "pairs") == "supcon":
+            return supervised_contrastive_loss(
+                features,
+                labels,
+                temperature=getattr(self.args, "temperature", 0.1),
+                max_positives=getattr(self.args, "max_positives", None),
+            )
+        return compute_contrastive_loss(features, labels, criterion=self.criterion)
 
     def eval_step(self, batch, batch_idx):
         # x, y = batch
@@ -345,11 +477,10 @@ class AutoEncoderSupervised(AutoEncoder):
         scale = torch.prod(torch.tensor(model_output.z.shape[1:]))
         if model_output.target.unique().size(0) == 1:
             return model_output
-        contrastive_loss = compute_contrastive_loss(
+        contrastive_loss = self.contrastive_loss(
             # Belt and braces on this view
             model_output.z.view(-1, self.model.latent_dim),
             model_output.target,
-            criterion=self.criterion,
         )
         model_output.contrastive_loss = scale * contrastive_loss
         model_output.loss += model_output.contrastive_loss
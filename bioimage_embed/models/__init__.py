@@ -1,8 +1,5 @@
-import torch
-import torch.nn.functional as F
-
-# Note - you must have torchvision installed for this example
-from torch.utils.data import DataLoader
+# Submodules pull in pythae, pl_bolts and timm, so they are imported on first access (PEP 562)
+import importlib
 
 # from .ae import AutoEncoder
 
@@ -11,8 +8,26 @@ from torch.utils.data import DataLoader
 # from .legacy.vae import VAE
 # from .vq_vae import VQ_VAE
 
-from .bolts import ResNet18VAEEncoder, ResNet18VAEDecoder
+_attributes = {
+    "ResNet18VAEEncoder": ".bolts",
+    "ResNet18VAEDecoder": ".bolts",
+    "ModelFactory": ".factory",
+    "create_model": ".factory",
+    "__all_models__": ".factory",
+    "__all_small_models__": ".factory",
+}
+_submodules = {"bolts", "pythae", "factory"}
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module(f".{name}", __name__)
+    if name in _attributes:
+        value = getattr(importlib.import_module(_attributes[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
-from . import bolts
-from . import pythae
-from .factory import ModelFactory, create_model, __all_models__
\ No newline at end of file
+def __dir__():
+    return sorted({*globals(), *_attributes, *_submodules})
@@ -13,10 +13,14 @@
 # from .bolts import ResNet18VAEEncoder, ResNet18VAEDecoder
 
 from typing import Tuple
-import pythae
-from .pythae import legacy
-from . import bolts
 from functools import partial
+from ..utils import lazy_import
+
+# pythae, pl_bolts and the legacy models take seconds to import,
+# so they are only loaded when the first model is built
+pythae_models = lazy_import("pythae.models")
+legacy = lazy_import(f"{__package__}.pythae.legacy")
+bolts = lazy_import(f"{__package__}.bolts")
 
 
 class ModelFactory:
@@ -47,8 +51,8 @@ class ModelFactory:
 
     def dummy_model(self):
         return self.create_model(
-            pythae.models.VAEConfig,
-            pythae.models.VAE,
+            pythae_models.VAEConfig,
+            pythae_models.VAE,
             lambda x: None,
             lambda x: None,
         )
@@ -62,7 +66,7 @@ class ModelFactory:
         kl_coeff=1.0,
     ):
         return self.create_model(
-            pythae.models.VAEConfig,
+            pythae_models.VAEConfig,
             partial(
                 bolts.vae.VAEPythaeWrapper,
                 input_height=self.input_dim[1],
@@ -95,12 +99,12 @@ class ModelFactory:
     def resnet18_vae(self):
         return self.create_model(
             partial(
-                pythae.models.VAEConfig,
+                pythae_models.VAEConfig,
                 use_default_encoder=False,
                 use_default_decoder=False,
                 **self.kwargs,
             ),
-            pythae.models.VAE,
+            pythae_models.VAE,
             bolts.ResNet18VAEEncoder,
             bolts.ResNet18VAEDecoder,
         )
@@ -108,12 +112,12 @@ class ModelFactory:
     def resnet50_vae(self):
         return self.create_model(
             partial(
-                pythae.models.VAEConfig,
+                pythae_models.VAEConfig,
                 use_default_encoder=False,
                 use_default_decoder=False,
                 **self.kwargs,
             ),
-            pythae.models.VAE,
+            pythae_models.VAE,
             bolts.ResNet50VAEEncoder,
             bolts.ResNet50VAEDecoder,
         )
@@ -121,12 +125,12 @@ class ModelFactory:
     def resnet18_vqvae(self):
         return self.create_model(
             partial(
-                pythae.models.VQVAEConfig,
+                pythae_models.VQVAEConfig,
                 use_default_encoder=False,
                 use_default_decoder=False,
                 **self.kwargs,
             ),
-            pythae.models.VQVAE,
+            pythae_models.VQVAE,
             bolts.ResNet18VQVAEEncoder,
             bolts.ResNet18VQVAEDecoder,
         )
@@ -134,12 +138,12 @@ class ModelFactory:
     def resnet18_beta_vae(self):
         return self.create_model(
             partial(
-                pythae.models.BetaVAEConfig,
+                pythae_models.BetaVAEConfig,
                 use_default_encoder=False,
                 use_default_decoder=False,
                 **self.kwargs,
             ),
-            pythae.models.BetaVAE,
+            pythae_models.BetaVAE,
             bolts.ResNet18VAEEncoder,
             bolts.ResNet18VAEDecoder,
         )
@@ -147,12 +151,12 @@ class ModelFactory:
     def resnet50_vqvae(self):
         return self.create_model(
             partial(
-                pythae.models.VQVAEConfig,
+                pythae_models.VQVAEConfig,
                 use_default_encoder=False,
                 use_default_decoder=False,
                 **self.kwargs,
             ),
-            pythae.models.VQVAE,
+            pythae_models.VQVAE,
             bolts.ResNet50VQVAEEncoder,
             bolts.ResNet50VQVAEDecoder,
         )
@@ -160,19 +164,19 @@ class ModelFactory:
     def resnet50_beta_vae(self):
         return self.create_model(
             partial(
-                pythae.models.BetaVAEConfig,
+                pythae_models.BetaVAEConfig,
                 use_default_encoder=False,
                 use_default_decoder=False,
                 **self.kwargs,
             ),
-            pythae.models.BetaVAE,
+            pythae_models.BetaVAE,
             bolts.ResNet50VAEEncoder,
             bolts.ResNet50VAEDecoder,
         )
 
     def resnet_vae_legacy(self, depth):
         return self.create_model(
-            pythae.models.VAEConfig,
+            pythae_models.VAEConfig,
             partial(legacy.VAE, num_residual_hiddens=depth),
             encoder_class=lambda x: None,
             decoder_class=lambda x: None,
@@ -186,7 +190,7 @@ class ModelFactory:
 
     def resnet_vqvae_legacy(self, depth):
         return self.create_model(
-            pythae.models.VQVAEConfig,
+            pythae_models.VQVAEConfig,
             # partial(legacy.vq_vae.VQVAE,**self.kwargs,num_hidden_residuals=depth),
             partial(legacy.vq_vae.VQVAE, depth=depth),
             encoder_class=lambda x: None,
@@ -1,8 +1,23 @@
-from .lightning import MaskEmbed, MaskEmbedLatentAugment
+import importlib
 import torch
 import torch.nn.functional as F
 from .transforms import DistogramToMaskPipeline
 
+# The Lightning modules are imported on first access (PEP 562)
+_attributes = {
+    "MaskEmbed": ".lightning",
+    "MaskEmbedLatentAugment": ".lightning",
+}
+
+
+def __getattr__(name):
+    if name in _attributes:
+        value = getattr(importlib.import_module(_attributes[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 def mask_from_latent(self, z, window_size):
     # This should be class-method based
     # I.e. self.decoder(z)
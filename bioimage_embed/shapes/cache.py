@@ -0,0 +1,150 @@
+import hashlib
+import os
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+
+KEY_PARAMS = ("window_size", "interp_size", "size", "matrix_normalised")
+
+
+def content_hash(x) -> str:
+    """
+    Hash of the decoded content of a mask, a PIL image, numpy array or tensor.
+    Shape, dtype and image mode are part of the hash so equal bytes with a different layout do not collide.
+    """
+    if isinstance(x, torch.Tensor):
+        x = x.detach().cpu().numpy()
+    hasher = hashlib.sha256()
+    if isinstance(x, Image.Image):
+        hasher.update(f"{x.mode}{x.size}".encode())
+        hasher.update(x.tobytes())
+        return hasher.hexdigest()
+    x = np.ascontiguousarray(x)
+    hasher.update(f"{x.dtype}{x.shape}".encode())
+    hasher.update(x.tobytes())
+    return hasher.hexdigest()
+
+
+def transform_params(transform) -> dict:
+    return {
+        param: getattr(transform, param)
+        for param in KEY_PARAMS
+        if hasattr(transform, param)
+    }
+
+
+class TransformCache(torch.nn.Module):
+    """
+    Content-addressed on-disk cache around a deterministic transform,
+    e.g. MaskToDistogramPipeline or the crop -> coords -> distogram prefix of a Compose.
+    Results are stored as one .npy shard per key and loaded memory-mapped,
+    so only the random transforms after the cache (RotateIndexingClockwise etc.) run every epoch.
+
+    The key is the hash of the input content plus the transform parameters,
+    taken from `params` or from the window_size/interp_size/size/matrix_normalised attributes of the transform.
+    When the shards exceed `max_bytes` the least recently used ones are evicted.
+    Shard names start with a prefix of the transform and parameters, caches sharing a
+    `cache_dir` only count and evict their own shards.
+
+    The byte count, budget and hit/miss counters are per process: each DataLoader worker
+    keeps its own index of the shards it found or wrote, so with n workers the directory can
+    grow to about n * max_bytes. Divide the budget by the number of workers to bound it.
+    """
+
+    def __init__(self, transform, cache_dir, max_bytes=2**30, params=None):
+        super().__init__()
+        self.transform = transform
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.params = transform_params(transform) if params is None else params
+        self.prefix = hashlib.sha256(
+            f"{transform.__class__.__name__}{sorted(self.params.items())}".encode()
+        ).hexdigest()[:16]
+        self.hits = 0
+        self.misses = 0
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.index = self.scan()
+        self.nbytes = sum(self.index.values())
+
+    def __repr__(self):
+        return (
+            self.__class__.__name__
+            + f"({self.transform!r}, cache_dir={str(self.cache_dir)!r})"
+        )
+
+    def scan(self) -> OrderedDict:
+        """
+        Rebuild the LRU index from the shards of this cache on disk, oldest first
+        """
+        shards = sorted(
+            (entry.stat().st_mtime, entry.name, entry.stat().st_size)
+            for entry in os.scandir(self.cache_dir)
+            if entry.name.startswith(f"{self.prefix}-") and entry.name.endswith(".npy")
+        )
+        return OrderedDict((name, size) for _, name, size in shards)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.index),
+            "nbytes": self.nbytes,
+        }
+
+    def key(self, x) -> str:
+        return f"{self.prefix}-{content_hash(x)}.npy"
+
+    def forward(self, x):
+        name = self.key(x)
+        path = self.cache_dir / name
+        try:
+            # Copy-on-write keeps the array writable for ToTensor without touching the shard
+            output = np.load(path, mmap_mode="c")
+        except (FileNotFoundError, ValueError, OSError):
+            self.misses += 1
+            return self.store(name, np.asarray(self.transform(x)))
+        self.hits += 1
+        os.utime(path)
+        size = self.index.pop(name, None)
+        if size is None:
+            # Written by another worker since this index was built
+            size = path.stat().st_size
+            self.nbytes += size
+        self.index[name] = size
+        return output
+
+    def store(self, name, output):
+        path = self.cache_dir / name
+        # Write then rename so other workers never read a partial shard
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, output)
+        os.replace(tmp_path, path)
+        self.nbytes -= self.index.pop(name, 0)
+        self.index[name] = path.stat().st_size
+        self.nbytes += self.index[name]
+        self.evict()
+        return output
+
+    def evict(self):
+        while self.max_bytes is not None and self.nbytes > self.max_bytes:
+            name, size = self.index.popitem(last=False)
+            self.nbytes -= size
+            try:
+                os.remove(self.cache_dir / name)
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        for name in list(self.index):
+            try:
+                os.remove(self.cache_dir / name)
+            except FileNotFoundError:
+                pass
+        self.index.clear()
+        self.nbytes = 0
@@ -1,5 +1,7 @@
 import numpy as np
+import torch
 from scipy.interpolate import interp1d, splprep, splev
+from typing import List
 
 
 def cart2pol(x, y):
@@ -20,7 +22,7 @@ def cubic_polar_resample_contour(contour: np.array, size: int) -> np.array:
     Returns:
         np.Array: new contour
     """
-    contour_y, contour_x = contour[0][:, 0], contour[0][:, 1]
+    contour_y, contour_x = contour_to_xy(contour)
     rho, phi = cart2pol(contour_x, contour_y)
 
     rho_interp = interp1d(np.linspace(0, 1, len(rho)), rho, kind="cubic")(
@@ -89,3 +91,81 @@ def uniform_spline_resample_contour(contour: np.array, size: int) -> np.array:
     tck, u = splprep([contour_x, contour_y], s=0)
     u_new = np.linspace(u.min(), u.max(), size)
     return np.array(splev(u_new, tck))
+
+
+def pad_contours(contour_list: List[np.array]) -> tuple[torch.Tensor, torch.Tensor]:
+    """Stack contours of different lengths into one padded tensor
+    The padding repeats the last point of each contour, so padded segments have zero length.
+
+    Args:
+        contour_list (List[np.array]): scikit image contours, each of shape (L, 2)
+
+    Returns:
+        tuple[torch.Tensor, torch.Tensor]: padded (N, L_max, 2) xy points and (N,) lengths
+    """
+    lengths = torch.tensor([len(contour) for contour in contour_list])
+    points = torch.empty(len(contour_list), int(lengths.max()), 2, dtype=torch.float64)
+    for i, contour in enumerate(contour_list):
+        # (row, col) -> (x, y) to match contour_to_xy
+        xy = torch.from_numpy(np.ascontiguousarray(contour[:, ::-1], dtype=np.float64))
+        points[i, : len(xy)] = xy
+        points[i, len(xy) :] = xy[-1]
+    return points, lengths
+
+
+def batch_uniform_spline_resample_contours(
+    contour_list: List[np.array], size: int
+) -> torch.Tensor:
+    """Vectorised counterpart of uniform_spline_resample_contour for many contours
+
+    Each contour is parameterised by normalised chord length, as splprep does, and
+    resampled at `size` uniform parameter values with a cubic Hermite spline.
+    Tangents are the chord-weighted finite differences, so the curve stays within
+    a fraction of a pixel of the splprep interpolant while the whole batch is
+    evaluated in a handful of tensor operations.
+
+    Args:
+        contour_list (List[np.array]): scikit image contours, each of shape (L, 2)
+        size (int): Control points to interpolate to
+
+    Returns:
+        torch.Tensor: new contours of shape (N, 2, size)
+    """
+    points, lengths = pad_contours(contour_list)
+    n = points.shape[0]
+    rows = torch.arange(n)
+    last = lengths - 1
+
+    deltas = torch.diff(points, dim=1)
+    chords = torch.linalg.norm(deltas, dim=-1)
+    u = torch.cat([torch.zeros(n, 1, dtype=chords.dtype), chords.cumsum(1)], dim=1)
+    u = u / u[:, -1:]
+    h = torch.diff(u, dim=1)
+    slopes = deltas / h.clamp_min(torch.finfo(h.dtype).eps).unsqueeze(-1)
+
+    # Chord weighted tangents in the interior, one-sided differences at the ends
+    h_left, h_right = h[:, :-1].unsqueeze(-1), h[:, 1:].unsqueeze(-1)
+    tangents = torch.empty_like(points)
+    tangents[:, 1:-1] = (h_right * slopes[:, :-1] + h_left * slopes[:, 1:]) / (
+        h_left + h_right
+    ).clamp_min(torch.finfo(h.dtype).eps)
+    tangents[:, 0] = slopes[:, 0]
+    tangents[rows, last] = slopes[rows, last - 1]
+
+    t = torch.linspace(0, 1, size, dtype=u.dtype).expand(n, size).contiguous()
+    k = torch.searchsorted(u.contiguous(), t, right=True) - 1
+    k = torch.minimum(k.clamp_min(0), (lengths - 2).unsqueeze(1))
+
+    def take(x, idx):
+        return torch.gather(x, 1, idx.unsqueeze(-1).expand(-1, -1, x.shape[-1]))
+
+    h_k = torch.gather(h, 1, k).unsqueeze(-1)
+    s = ((t - torch.gather(u, 1, k)).unsqueeze(-1) / h_k).clamp(0, 1)
+    s2, s3 = s * s, s * s * s
+    resampled = (
+        (2 * s3 - 3 * s2 + 1) * take(points, k)
+        + (s3 - 2 * s2 + s) * h_k * take(tangents, k)
+        + (-2 * s3 + 3 * s2) * take(points, k + 1)
+        + (s3 - s2) * h_k * take(tangents, k + 1)
+    )
+    return resampled.transpose(1, 2)
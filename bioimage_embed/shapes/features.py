@@ -0,0 +1,171 @@
+"""
+Classical shape features used as baselines for the learned embeddings:
+regionprops of the cropped masks and elliptic Fourier descriptors (EFD) of the contours.
+
+`shape_features` computes both for a whole dataset in a process pool. The workers read
+chunks of samples straight from the datasets, so wrapping the crop and coords transforms
+in a TransformCache lets them load the cached arrays rather than recompute them.
+Every chunk is written into preallocated arrays and the result is a single DataFrame.
+"""
+
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+import pyefd
+from skimage import measure
+
+logger = logging.getLogger(__name__)
+
+PROPERTIES = (
+    "area",
+    "perimeter",
+    "centroid",
+    "major_axis_length",
+    "minor_axis_length",
+    "orientation",
+)
+
+# Datasets of the pool workers, set once per process by _init_worker
+_worker_datasets = {}
+
+
+def regionprops_features(mask, properties: Sequence[str] = PROPERTIES) -> pd.Series:
+    """
+    regionprops_table of a single-object mask, NaN when the mask is empty.
+    """
+    table = measure.regionprops_table(
+        np.asarray(mask).astype(int), properties=properties
+    )
+    return pd.Series(
+        {name: column[0] if len(column) else np.nan for name, column in table.items()}
+    )
+
+
+def efd_features(coords, order: int = 10, normalize: bool = False) -> np.ndarray:
+    """
+    Elliptic Fourier descriptors of a contour, flattened to a_1, b_1, c_1, d_1, a_2, ...
+
+    Args:
+        coords: (2, N) contour as returned by ImageToCoords, or (N, 2) points.
+        order: Number of harmonics.
+        normalize: Make the descriptors invariant to rotation, scale and starting point.
+    """
+    coords = np.asarray(coords, dtype=float)
+    if coords.shape[0] == 2 and coords.shape[1] != 2:
+        coords = coords.T
+    return pyefd.elliptic_fourier_descriptors(
+        coords, order=order, normalize=normalize
+    ).reshape(-1)
+
+
+def efd_columns(order: int = 10):
+    return [f"efd_{n}_{c}" for n in range(1, order + 1) for c in "abcd"]
+
+
+def _init_worker(datasets):
+    _worker_datasets.update(datasets)
+
+
+def _features_chunk(start, stop, properties, order, normalize):
+    """
+    (labels, regionprops, efd) arrays for samples [start, stop) of the worker datasets
+    """
+    crops = _worker_datasets.get("crops")
+    coords = _worker_datasets.get("coords")
+    labels, regionprops, efd = [], [], []
+    for i in range(start, stop):
+        if crops is not None:
+            mask, label = crops[i]
+            regionprops.append(regionprops_features(mask, properties).to_numpy(float))
+        if coords is not None:
+            xy, label = coords[i]
+            efd.append(efd_features(xy, order=order, normalize=normalize))
+        labels.append(label)
+    return np.asarray(labels), np.asarray(regionprops), np.asarray(efd)
+
+
+def shape_features(
+    crops=None,
+    coords=None,
+    properties: Sequence[str] = PROPERTIES,
+    order: int = 10,
+    normalize: bool = False,
+    num_workers: Optional[int] = None,
+    chunksize: int = 256,
+) -> pd.DataFrame:
+    """
+    Regionprops and EFD features for every sample of a dataset.
+
+    Args:
+        crops: Dataset of (mask, label), e.g. ImageFolder with CropCentroidPipeline.
+        coords: Dataset of ((2, N) contour, label) aligned with `crops`, e.g. ImageFolder with ImageToCoords.
+        num_workers: Size of the process pool, os.cpu_count() by default and 0 to run in this process.
+        chunksize: Samples per task sent to the pool.
+
+    Returns:
+        One row per sample indexed by class, with ("regionprops", property) and ("efd", coefficient) columns.
+    """
+    datasets = {
+        name: dataset
+        for name, dataset in (("crops", crops), ("coords", coords))
+        if dataset is not None
+    }
+    if not datasets:
+        raise ValueError("shape_features needs crops, coords or both")
+    lengths = {len(dataset) for dataset in datasets.values()}
+    if len(lengths) > 1:
+        raise ValueError(f"crops and coords have different lengths {lengths}")
+    n = lengths.pop()
+
+    # The first sample gives the column names, centroid expands to centroid-0 and centroid-1
+    columns = {}
+    if crops is not None:
+        columns["regionprops"] = list(
+            regionprops_features(crops[0][0], properties).index
+        )
+    if coords is not None:
+        columns["efd"] = efd_columns(order)
+    features = {
+        name: np.full((n, len(names)), np.nan) for name, names in columns.items()
+    }
+    labels = np.empty(n, dtype=object)
+
+    chunks = [(start, min(start + chunksize, n)) for start in range(0, n, chunksize)]
+    args = (properties, order, normalize)
+    num_workers = os.cpu_count() if num_workers is None else num_workers
+    if num_workers == 0:
+        _init_worker(datasets)
+        results = (_features_chunk(start, stop, *args) for start, stop in chunks)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(
+            max_workers=num_workers, initializer=_init_worker, initargs=(datasets,)
+        )
+        results = executor.map(
+            _features_chunk,
+            *zip(*[(start, stop, *args) for start, stop in chunks]),
+        )
+    try:
+        for (start, stop), (chunk_labels, regionprops, efd) in zip(chunks, results):
+            labels[start:stop] = chunk_labels
+            if "regionprops" in features:
+                features["regionprops"][start:stop] = regionprops
+            if "efd" in features:
+                features["efd"][start:stop] = efd
+            logger.debug(f"Shape features {stop}/{n}")
+    finally:
+        _worker_datasets.clear()
+        if executor is not None:
+            executor.shutdown()
+
+    return pd.DataFrame(
+        np.concatenate(list(features.values()), axis=1),
+        index=pd.Index(labels.tolist(), name="class"),
+        columns=pd.MultiIndex.from_tuples(
+            [(name, column) for name, names in columns.items() for column in names]
+        ),
+    )
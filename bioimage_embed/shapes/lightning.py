@@ -36,17 +36,26 @@ class MaskEmbedMixin:
         model_output = super().eval_step(batch, batch_idx)
         loss_ops = lf.DistanceMatrixLoss(model_output.recon_x, norm=False)
 
-        shape_loss = torch.sum(
-            torch.stack(
-                [
-                    loss_ops.diagonal_loss(),
-                    loss_ops.symmetry_loss(),
-                    # loss_ops.triangle_inequality(),
-                    loss_ops.non_negative_loss(),
-                    # loss_ops.clockwise_order_loss(),
-                ]
+        shape_losses = [
+            loss_ops.diagonal_loss(),
+            loss_ops.symmetry_loss(),
+            loss_ops.non_negative_loss(),
+        ]
+        # Declared with their weights in config.Recipe, absent from args built by hand
+        args = self.args
+        if getattr(args, "triangle_inequality", False):
+            shape_losses.append(
+                getattr(args, "triangle_inequality_weight", 1.0)
+                * loss_ops.triangle_inequality(
+                    samples=getattr(args, "triangle_inequality_samples", 1024)
+                )
             )
-        )
+        if getattr(args, "clockwise_order", False):
+            shape_losses.append(
+                getattr(args, "clockwise_order_weight", 1.0)
+                * loss_ops.clockwise_order_loss()
+            )
+        shape_loss = torch.sum(torch.stack(shape_losses))
         model_output.loss += shape_loss
         model_output.shape_loss = shape_loss
 
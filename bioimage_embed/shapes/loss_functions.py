@@ -54,8 +54,8 @@ class DistanceMatrixLoss:
     def non_negative_loss(self):
         return non_negative_loss(self.D)
 
-    def triangle_inequality(self):
-        return triangle_inequality_loss(self.D)
+    def triangle_inequality(self, samples=1024):
+        return triangle_inequality_loss(self.D, samples=samples)
 
     def clockwise_order_loss(self):
         return clockwise_order_loss(self.D)
@@ -69,38 +69,60 @@ def triangle_inequality_loss_2D(distance_matrix):
     row_indices = torch.arange(n)
     combinations = torch.combinations(row_indices, 3)
     i, j, k = combinations.unbind(1)
-    violation = distance_matrix[i, j] + distance_matrix[j, k] - distance_matrix[i, k]
+    violation = distance_matrix[i, k] - distance_matrix[i, j] - distance_matrix[j, k]
     return torch.relu(violation).nanmean()
 
 
-def triangle_inequality_loss(distance_matrix, n=1000):
-    # Get the shape of the last two dimensions
-    n, m = distance_matrix.shape[-2:]
-
-    # Create a 2D grid of indices for each dimension
-    i, j = torch.meshgrid(torch.arange(n), torch.arange(m))
-
-    # Create a 1D array of indices for the last two dimensions
-    indices = torch.arange(n * m)
-    indices = indices[torch.randperm(indices.size()[0])]
-    indices = indices[:n]
-    # Get all combinations of three indices
-    combinations = torch.combinations(indices, 3)
-
-    # Convert 1D indices back to 2D
-    i, j, k = combinations.unbind(1)
-    i1, i2 = i // m, i % m
-    j1, j2 = j // m, j % m
-    k1, k2 = k // m, k % m
+def triangle_inequality_loss(distance_matrix, samples=1024):
+    """
+    Penalises D[i, k] > D[i, j] + D[j, k] on a random subset of triples.
+    `samples` triples are drawn per matrix on the matrix's device at every call,
+    so memory is O(batch * samples) instead of the O(n^3) of enumerating every triple.
 
-    # Calculate the violation of the triangle inequality
+    :param distance_matrix: Tensor of shape (..., n, n)
+    :param samples: Number of triples drawn per matrix
+    :return: Mean rectified violation
+    """
+    n = distance_matrix.shape[-1]
+    flat_D = distance_matrix.reshape(-1, n * n)
+    i, j, k = torch.randint(
+        0, n, (3, flat_D.shape[0], samples), device=distance_matrix.device
+    )
     violation = (
-        distance_matrix[..., i1, i2]
-        + distance_matrix[..., j1, j2]
-        - distance_matrix[..., k1, k2]
+        flat_D.gather(1, i * n + k)
+        - flat_D.gather(1, i * n + j)
+        - flat_D.gather(1, j * n + k)
     )
+    return torch.relu(violation).nanmean()
 
-    # Return the mean of the rectified violation
+
+def triangle_inequality_loss_minplus(distance_matrix, block_size=8):
+    """
+    Exact worst-case triangle inequality penalty per pair,
+    D[i, k] - min_j (D[i, j] + D[j, k]), from a blocked min-plus product.
+    The search over j runs without gradients, one block of j at a time,
+    so peak memory is O(batch * n^2 * block_size) and the backward pass only sees the chosen triples.
+
+    :param distance_matrix: Tensor of shape (..., n, n)
+    :param block_size: Number of intermediate points j compared at once
+    :return: Mean rectified violation
+    """
+    n = distance_matrix.shape[-1]
+    D = distance_matrix.reshape(-1, n, n)
+    with torch.no_grad():
+        shortest = torch.full_like(D, float("inf"))
+        via = torch.zeros(D.shape, dtype=torch.long, device=D.device)
+        for start in range(0, n, block_size):
+            stop = min(start + block_size, n)
+            # (b, n, block, 1) + (b, 1, block, n) -> (b, n, block, n)
+            two_hop = D[:, :, start:stop, None] + D[:, None, start:stop, :]
+            block_shortest, block_via = two_hop.min(dim=2)
+            closer = block_shortest < shortest
+            shortest = torch.where(closer, block_shortest, shortest)
+            via = torch.where(closer, block_via + start, via)
+    # D[i, via[i, k]] + D[via[i, k], k]
+    two_hop = D.gather(2, via) + D.gather(1, via)
+    violation = D - two_hop
     return torch.relu(violation).nanmean()
 
 
@@ -120,31 +142,25 @@ def clockwise_order_loss_2D(distance_matrix):
 
 
 def clockwise_order_loss(distance_matrix):
-    # Get the size of the last two dimensions
-    n, m = distance_matrix.shape[-2:]
-
-    # Create expected order tensor
-    expected_order = torch.arange(n * m).reshape(1, 1, n, m).to(distance_matrix.device)
-
-    # Create expected difference tensor
-    expected_diff = (
-        expected_order.unsqueeze(-1).unsqueeze(-1)
-        - expected_order.unsqueeze(-3).unsqueeze(-3)
-    ) % (n * m)
-
-    # Expand dimensions for broadcasting
-    distance_matrix_exp = distance_matrix.unsqueeze(-2).unsqueeze(-2)
-
-    # Create observed difference tensor
-    observed_diff = (distance_matrix_exp > distance_matrix_exp.transpose(-1, -2)).long()
-
-    # Ensure expected_diff and observed_diff have the same shape
-    expected_diff = expected_diff.expand_as(observed_diff)
+    """
+    Clockwise order loss in memory linear in the number of matrix entries.
 
-    # Calculate loss
-    loss = (observed_diff != expected_diff).float().mean()
+    Flattening each (n, m) matrix to N = n * m entries, the pairwise definition compares
+    the observed order D[a] > D[b] with the expected cyclic offset (a - b) % N over all N^2 pairs,
+    which needs an (N, N) tensor per matrix.
+    A boolean only ever equals an offset of 0 or 1, so the agreeing pairs are the N pairs (a, a)
+    plus the cyclically adjacent pairs (a, a - 1) with D[a] > D[a - 1].
+    Counting those takes one comparison per entry and gives the same value.
 
-    return loss
+    :param distance_matrix: Tensor of shape (..., n, m)
+    :return: Fraction of entry pairs whose order disagrees with their offset
+    """
+    n, m = distance_matrix.shape[-2:]
+    N = n * m
+    flat_D = distance_matrix.reshape(-1, N)
+    ascending = (flat_D > flat_D.roll(1, dims=-1)).sum(-1)
+    agreeing = N + ascending
+    return (1 - agreeing / N**2).mean()
 
 
 # def clockwise_order_loss(distance_matrix):
@@ -1,25 +1,29 @@
 import torch
 
 
-def mds(d):
+def mds(d, n_components=2):
     """
-    Multidimensional Scaling (MDS) in PyTorch.
+    Classical Multidimensional Scaling (MDS) in PyTorch.
+    Works on a single distance matrix or a batch of them, e.g. (B, C, N, N).
 
-    :param d: Distance matrix.
-    :return: A matrix of x, y coordinates.
+    :param d: Squared distance matrix of shape (..., N, N), square a distogram first.
+    :param n_components: Number of output dimensions.
+    :return: A matrix of x, y coordinates of shape (..., N, n_components).
     """
-    n = d.size(0)
-    I = torch.eye(n)
-    H = I - torch.ones((n, n)) / n
+    d = torch.as_tensor(d)
+    if not d.is_floating_point():
+        d = d.float()
+    n = d.size(-1)
+    H = torch.eye(n, dtype=d.dtype, device=d.device) - 1 / n
 
+    # Double centring of the squared distances gives the Gram matrix
     S = -0.5 * H @ d @ H
-    eigvals, eigvecs = S.symeig(eigenvectors=True)
+    # Symmetrise against numerical noise as eigh only reads one triangle
+    S = 0.5 * (S + S.transpose(-2, -1))
+    eigvals, eigvecs = torch.linalg.eigh(S)
 
-    # Sort the eigenvalues and eigenvectors in decreasing order
-    idx = eigvals.argsort(descending=True)
-    eigvals, eigvecs = eigvals[idx], eigvecs[:, idx]
+    # eigh returns ascending eigenvalues, take the largest n_components
+    eigvals = eigvals[..., -n_components:].flip(-1)
+    eigvecs = eigvecs[..., -n_components:].flip(-1)
 
-    # Take the square root of the two largest eigenvalues
-    diag_lambdas = torch.diag(torch.sqrt(eigvals[:2]))
-
-    return eigvecs[:, :2] @ diag_lambdas
+    return eigvecs * torch.sqrt(eigvals.clamp_min(0)).unsqueeze(-2)
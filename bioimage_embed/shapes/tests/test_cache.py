@@ -0,0 +1,137 @@
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+from torchvision import transforms
+
+from bioimage_embed.shapes.cache import (
+    TransformCache,
+    content_hash,
+    transform_params,
+)
+from bioimage_embed.shapes.transforms import (
+    MaskToDistogramPipeline,
+    RotateIndexingClockwise,
+)
+from bioimage_embed.shapes.tests.utils import random_ellipse_masks
+
+
+class CountingTransform(torch.nn.Module):
+    def __init__(self, transform):
+        super().__init__()
+        self.transform = transform
+        self.calls = 0
+
+    def forward(self, x):
+        self.calls += 1
+        return self.transform(x)
+
+
+@pytest.fixture
+def window_size():
+    return 64
+
+
+@pytest.fixture
+def interp_size():
+    return 32
+
+
+@pytest.fixture
+def masks():
+    return [Image.fromarray(mask) for mask in random_ellipse_masks(3, 96)]
+
+
+@pytest.fixture
+def pipeline(window_size, interp_size):
+    return MaskToDistogramPipeline(window_size, interp_size)
+
+
+@pytest.fixture
+def cache(pipeline, tmp_path):
+    return TransformCache(pipeline, tmp_path, max_bytes=None)
+
+
+def test_cache_hit(cache, masks):
+    first = cache(masks[0])
+    second = cache(masks[0])
+    assert np.array_equal(first, second)
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_cache_matches_transform(cache, pipeline, masks):
+    for mask in masks:
+        cache(mask)
+    for mask in masks:
+        assert np.array_equal(cache(mask), pipeline(mask))
+    assert cache.stats()["hit_rate"] == 0.5
+
+
+def test_cache_persists(pipeline, masks, tmp_path):
+    TransformCache(pipeline, tmp_path)(masks[0])
+    cache = TransformCache(pipeline, tmp_path)
+    assert len(cache.index) == 1
+    cache(masks[0])
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 0
+
+
+def test_cache_explicit_params(pipeline, masks, tmp_path):
+    counting = CountingTransform(pipeline)
+    cache = TransformCache(counting, tmp_path, params=transform_params(pipeline))
+    cache(masks[0])
+    cache(masks[0])
+    assert counting.calls == 1
+
+
+def test_cache_key_params(window_size, masks, tmp_path):
+    small = TransformCache(MaskToDistogramPipeline(window_size, 32), tmp_path)
+    large = TransformCache(MaskToDistogramPipeline(window_size, 48), tmp_path)
+    assert small.key(masks[0]) != large.key(masks[0])
+    assert large(masks[0]).shape == (48, 48)
+    assert large.misses == 1
+
+
+def test_cache_lru_eviction(pipeline, masks, tmp_path):
+    cache = TransformCache(pipeline, tmp_path, max_bytes=None)
+    cache(masks[0])
+    max_bytes = 2 * cache.nbytes
+    cache = TransformCache(pipeline, tmp_path, max_bytes=max_bytes)
+    cache(masks[1])
+    # Touch the oldest entry so masks[1] becomes least recently used
+    cache(masks[0])
+    cache(masks[2])
+    assert cache.nbytes <= max_bytes
+    assert len(cache.index) == 2
+    assert cache.key(masks[1]) not in cache.index
+    assert not (tmp_path / cache.key(masks[1])).exists()
+
+
+def test_caches_sharing_a_directory(window_size, masks, tmp_path):
+    small = TransformCache(MaskToDistogramPipeline(window_size, 32), tmp_path)
+    small(masks[0])
+    large = TransformCache(MaskToDistogramPipeline(window_size, 48), tmp_path)
+    # The shards of the other cache are neither counted nor evicted
+    assert len(large.index) == 0 and large.nbytes == 0
+    large(masks[0])
+    large.max_bytes = large.nbytes * 3 // 2
+    large(masks[1])
+    assert len(large.index) == 1
+    assert (tmp_path / small.key(masks[0])).exists()
+
+
+def test_cache_random_suffix(cache, masks):
+    transform = transforms.Compose(
+        [cache, transforms.ToTensor(), RotateIndexingClockwise(p=1)]
+    )
+    for _ in range(2):
+        assert transform(masks[0]).shape == (1, 32, 32)
+    assert cache.hits == 1
+
+
+def test_content_hash():
+    x = np.zeros((4, 4), dtype=np.uint8)
+    assert content_hash(x) == content_hash(x.copy())
+    assert content_hash(x) != content_hash(x.astype(np.float32))
+    assert content_hash(x) != content_hash(x.reshape(2, 8))
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pyefd
+import pytest
+from PIL import Image
+from skimage import measure
+
+from bioimage_embed.shapes.features import PROPERTIES, shape_features
+from bioimage_embed.shapes.transforms import CropCentroidPipeline, ImageToCoords
+
+from bioimage_embed.shapes.tests.utils import random_ellipse_masks
+
+
+@pytest.fixture
+def crops():
+    crop = CropCentroidPipeline(64)
+    masks = random_ellipse_masks(10, 96)
+    return [(np.array(crop(Image.fromarray(mask))), i % 2) for i, mask in enumerate(masks)]
+
+
+@pytest.fixture
+def coords(crops):
+    to_coords = ImageToCoords(64)
+    return [(to_coords(mask), label) for mask, label in crops]
+
+
+def test_shape_features(crops, coords):
+    df = shape_features(crops, coords, num_workers=0, chunksize=3)
+    assert len(df) == len(crops)
+    assert list(df.index) == [label for _, label in crops]
+    assert list(df.columns.levels[0]) == ["efd", "regionprops"]
+
+    expected = pd.DataFrame(
+        measure.regionprops_table(crops[4][0].astype(int), properties=PROPERTIES)
+    )
+    regionprops = df["regionprops"]
+    assert np.allclose(regionprops.iloc[4], expected.iloc[0][regionprops.columns])
+    efd = pyefd.elliptic_fourier_descriptors(coords[4][0].T, order=10)
+    assert np.allclose(df["efd"].iloc[4], efd.reshape(-1))
+
+
+def test_shape_features_process_pool(crops, coords):
+    expected = shape_features(crops, coords, num_workers=0)
+    df = shape_features(crops, coords, num_workers=2, chunksize=3)
+    pd.testing.assert_frame_equal(df, expected)
+
+
+def test_shape_features_coords_only(coords):
+    df = shape_features(coords=coords, order=4, normalize=True, num_workers=0)
+    assert df.shape == (len(coords), 16)
@@ -0,0 +1,75 @@
+import pytest
+import torch
+
+from bioimage_embed.shapes import loss_functions as lf
+
+
+@pytest.fixture(params=[8, 13])
+def n(request):
+    return request.param
+
+
+@pytest.fixture
+def distance_matrix(n):
+    torch.manual_seed(42)
+    # Random non-metric matrices so there are violations to find
+    D = torch.rand(2, 3, n, n)
+    return (D + D.transpose(-2, -1)) / 2
+
+
+def exact_violations(D):
+    # (..., i, j, k): D[i, k] - D[i, j] - D[j, k]
+    return D.unsqueeze(-2) - D.unsqueeze(-1) - D.unsqueeze(-3)
+
+
+def test_triangle_inequality_sampled(distance_matrix):
+    expected = torch.relu(exact_violations(distance_matrix)).mean()
+    loss = lf.triangle_inequality_loss(distance_matrix, samples=2**16)
+    assert torch.isclose(loss, expected, rtol=0.05)
+
+
+def test_triangle_inequality_minplus(distance_matrix):
+    expected = torch.relu(exact_violations(distance_matrix).amax(-2)).mean()
+    loss = lf.triangle_inequality_loss_minplus(distance_matrix, block_size=3)
+    assert torch.isclose(loss, expected)
+
+
+def test_triangle_inequality_metric():
+    x = torch.rand(4, 1, 32, 2)
+    D = torch.cdist(x, x)
+    assert lf.triangle_inequality_loss(D) < 1e-6
+    assert lf.triangle_inequality_loss_minplus(D) < 1e-6
+
+
+@pytest.mark.parametrize(
+    "loss_fn", [lf.triangle_inequality_loss, lf.triangle_inequality_loss_minplus]
+)
+def test_triangle_inequality_backward(distance_matrix, loss_fn):
+    D = distance_matrix.clone().requires_grad_()
+    loss_fn(D).backward()
+    assert D.grad is not None
+    assert D.grad.abs().sum() > 0
+
+
+def pairwise_clockwise_order_loss(distance_matrix):
+    # The (n * m) x (n * m) broadcast the linear form replaces
+    n, m = distance_matrix.shape[-2:]
+    flat_D = distance_matrix.reshape(-1, n * m)
+    order = torch.arange(n * m)
+    expected_diff = (order.unsqueeze(-1) - order.unsqueeze(0)) % (n * m)
+    observed_diff = (flat_D.unsqueeze(-1) > flat_D.unsqueeze(-2)).long()
+    return (observed_diff != expected_diff).float().mean()
+
+
+@pytest.mark.parametrize("shape", [(1, 1), (2, 2), (4, 4), (3, 5), (2, 3, 8, 8)])
+def test_clockwise_order_loss(shape):
+    torch.manual_seed(42)
+    D = torch.rand(*shape)
+    expected = pairwise_clockwise_order_loss(D)
+    assert torch.isclose(lf.clockwise_order_loss(D), expected)
+
+
+def test_clockwise_order_loss_ties(distance_matrix):
+    D = distance_matrix.round(decimals=1)
+    expected = pairwise_clockwise_order_loss(D)
+    assert torch.isclose(lf.clockwise_order_loss(D), expected)
@@ -0,0 +1,41 @@
+import pytest
+import torch
+
+from bioimage_embed.shapes import mds
+from bioimage_embed.shapes.loss_functions import smoothness_loss
+
+
+@pytest.fixture(params=[(16,), (2, 3, 16), (2, 1, 128)])
+def coords(request):
+    torch.manual_seed(42)
+    *batch, n = request.param
+    theta = torch.linspace(0, 2 * torch.pi, n + 1)[:-1]
+    radius = 1 + 0.2 * torch.rand(*batch, n, dtype=torch.float64)
+    return torch.stack([radius * torch.cos(theta), radius * torch.sin(theta)], -1)
+
+
+def test_mds_shape(coords):
+    d = torch.cdist(coords, coords)
+    assert mds.mds(d**2).shape == coords.shape
+
+
+def test_mds_recovers_distances(coords):
+    d = torch.cdist(coords, coords)
+    xy = mds.mds(d**2)
+    assert torch.allclose(torch.cdist(xy, xy), d, atol=1e-6)
+
+
+def test_mds_centred(coords):
+    d = torch.cdist(coords, coords)
+    xy = mds.mds(d**2)
+    assert torch.allclose(xy.mean(-2), torch.zeros(2, dtype=xy.dtype), atol=1e-6)
+
+
+@pytest.mark.parametrize("n", [8, 64])
+def test_smoothness_loss(n):
+    # mds reads squared distances, for a regular polygon it recovers the polygon
+    theta = torch.linspace(0, 2 * torch.pi, n + 1, dtype=torch.float64)[:-1]
+    coords = torch.stack([torch.cos(theta), torch.sin(theta)], -1)
+    d = torch.cdist(coords, coords)
+    expected = -torch.cos(torch.tensor(2 * torch.pi / n, dtype=torch.float64))
+    assert torch.allclose(smoothness_loss(d**2), expected, atol=1e-6)
@@ -0,0 +1,178 @@
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+from skimage.draw import polygon2mask
+
+from bioimage_embed.shapes.transforms import (
+    AsymmetricDistogramToCoordsPipeline,
+    BatchImageToDistogram,
+    DistogramToCoords,
+    DistogramToMaskPipeline,
+    ImageToDistogram,
+    MaskToDistogramPipeline,
+    VerticesToMask,
+    fill_polygons,
+)
+from bioimage_embed.shapes.tests.utils import random_ellipse_masks
+from bioimage_embed.utils import INVALID
+
+
+@pytest.fixture
+def image_size():
+    return 96
+
+
+@pytest.fixture(params=[64, 256])
+def interp_size(request):
+    return request.param
+
+
+@pytest.fixture(params=[False, True])
+def matrix_normalised(request):
+    return request.param
+
+
+@pytest.fixture
+def masks(image_size):
+    return random_ellipse_masks(8, image_size)
+
+
+def assert_distograms_close(distograms, expected):
+    # Resampling differs from splprep by a fraction of a pixel,
+    # so compare to within 1% of the largest distance
+    assert np.allclose(distograms, expected, atol=0.01 * np.abs(expected).max())
+
+
+def test_batch_distogram_shape(masks, interp_size):
+    distograms = BatchImageToDistogram(interp_size)(masks)
+    assert isinstance(distograms, torch.Tensor)
+    assert distograms.shape == (len(masks), interp_size, interp_size)
+
+
+def test_batch_distogram_matches_per_image(masks, interp_size, matrix_normalised):
+    expected = np.stack(
+        [
+            ImageToDistogram(interp_size, matrix_normalised=matrix_normalised)(mask)
+            for mask in masks
+        ]
+    )
+    distograms = BatchImageToDistogram(
+        interp_size, matrix_normalised=matrix_normalised
+    )(masks)
+    assert_distograms_close(distograms.numpy(), expected)
+
+
+def test_batch_distogram_single_mask(masks, interp_size):
+    distogram = BatchImageToDistogram(interp_size)(masks[0])
+    assert isinstance(distogram, np.ndarray)
+    assert distogram.shape == (interp_size, interp_size)
+
+
+def test_mask_to_distogram_pipeline_batched(masks, interp_size):
+    image = Image.fromarray(masks[0])
+    expected = MaskToDistogramPipeline(64, interp_size)(image)
+    distogram = MaskToDistogramPipeline(64, interp_size, batched=True)(image)
+    assert_distograms_close(distogram, expected)
+
+
+@pytest.fixture
+def coords():
+    rng = np.random.default_rng(42)
+    theta = np.linspace(0, 2 * np.pi, 33)[:-1]
+    radius = 0.25 + 0.05 * rng.random((2, 1, 32))
+    return np.stack([radius * np.cos(theta), radius * np.sin(theta)], -1)
+
+
+@pytest.fixture
+def distograms(coords):
+    return torch.cdist(torch.tensor(coords), torch.tensor(coords)).numpy()
+
+
+def stress(coords, distograms, size):
+    coords = torch.tensor((coords - size / 2) / size)
+    return np.abs(torch.cdist(coords, coords).numpy() - distograms).max()
+
+
+@pytest.mark.parametrize("method", ["MDS", "classical"])
+def test_distogram_to_coords(distograms, method):
+    size = 64
+    coords = DistogramToCoords(size, method=method)(distograms)
+    assert coords.shape == (*distograms.shape[:-1], 2)
+    assert stress(coords, distograms, size) < 1e-2
+
+
+def test_classical_mds_batched(distograms):
+    size = 64
+    coords = DistogramToCoords(size, method="classical")(torch.tensor(distograms))
+    assert isinstance(coords, torch.Tensor)
+    assert stress(coords.numpy(), distograms, size) < 1e-6
+    assert isinstance(DistogramToCoords(size, method="classical")(distograms), np.ndarray)
+
+
+def test_asymmetric_distogram_to_coords_classical(distograms):
+    coords = AsymmetricDistogramToCoordsPipeline(64, method="classical")(distograms)
+    assert coords.shape == (*distograms.shape[:-1], 2)
+
+
+@pytest.mark.parametrize("integer_vertices", [False, True])
+def test_fill_polygons_matches_polygon2mask(integer_vertices):
+    rng = np.random.default_rng(42)
+    theta = np.sort(rng.uniform(0, 2 * np.pi, (2, 3, 24)), axis=-1)
+    radius = rng.uniform(5, 30, (2, 3, 24))
+    # Off-centre so some polygons are clipped by the mask edges
+    vertices = np.stack(
+        [30 + radius * np.cos(theta), 36 + radius * np.sin(theta)], -1
+    )
+    if integer_vertices:
+        # Pixels exactly on the edges are filled by polygon2mask
+        vertices = np.round(vertices)
+    expected = np.stack(
+        [polygon2mask((64, 64), v) for v in vertices.reshape(-1, 24, 2)]
+    ).reshape(2, 3, 64, 64)
+    masks = fill_polygons(torch.tensor(vertices), (64, 64))
+    assert masks.shape == (2, 3, 64, 64)
+    assert np.array_equal(masks.numpy(), expected)
+
+
+def test_vertices_to_mask_torch(coords):
+    vertices = 32 + 64 * coords
+    masks = VerticesToMask(64, rasteriser="torch")(torch.tensor(vertices))
+    assert masks.dtype == torch.bool
+    assert np.array_equal(masks.numpy(), VerticesToMask(64)(vertices))
+
+
+def test_distogram_to_mask_pipeline_torch(distograms):
+    expected = DistogramToMaskPipeline(64, method="classical")(distograms)
+    masks = DistogramToMaskPipeline(64, method="classical", rasteriser="torch")(
+        distograms
+    )
+    assert np.array_equal(masks.numpy(), expected)
+
+
+@pytest.mark.parametrize(
+    "device",
+    [
+        "cpu",
+        pytest.param(
+            "cuda",
+            marks=pytest.mark.skipif(
+                not torch.cuda.is_available(), reason="needs a GPU"
+            ),
+        ),
+    ],
+)
+def test_distogram_to_mask_pipeline_torch_device(distograms, device):
+    pipeline = DistogramToMaskPipeline(64, method="classical", rasteriser="torch")
+    masks = pipeline(torch.tensor(distograms, device=device))
+    # The coordinates never leave the device of the distograms
+    assert isinstance(masks, torch.Tensor) and masks.device.type == device
+    assert np.array_equal(masks.cpu().numpy(), pipeline(distograms).numpy())
+
+
+def test_pipelines_return_invalid():
+    # An empty mask has no region to crop around
+    empty = Image.fromarray(np.zeros((96, 96), dtype=np.uint8))
+    assert MaskToDistogramPipeline(64)(empty) is INVALID
+    assert MaskToDistogramPipeline(64)(INVALID) is INVALID
+    assert DistogramToMaskPipeline(64)(INVALID) is INVALID
@@ -1,4 +1,5 @@
 import numpy as np
+from skimage.draw import ellipse
 
 
 def create_circle_contour(radius, image_size):
@@ -11,3 +12,22 @@ def create_circle_contour(radius, image_size):
     image[np.abs(distance - radius) < 1] = 255  # Set contour to white
 
     return image, distance
+
+
+def random_ellipse_masks(n, image_size, seed=42):
+    """
+    (n, image_size, image_size) uint8 masks of filled random ellipses near the centre
+    """
+    rng = np.random.default_rng(seed)
+    masks = np.zeros((n, image_size, image_size), dtype=np.uint8)
+    for mask in masks:
+        rr, cc = ellipse(
+            image_size / 2 + rng.uniform(-5, 5),
+            image_size / 2 + rng.uniform(-5, 5),
+            rng.uniform(10, 40),
+            rng.uniform(10, 40),
+            shape=mask.shape,
+            rotation=rng.uniform(0, np.pi),
+        )
+        mask[rr, cc] = 255
+    return masks
@@ -11,7 +11,8 @@ from sklearn.metrics.pairwise import euclidean_distances
 from skimage.measure import find_contours
 from torch import nn
 
-from . import contours
+from . import contours, mds
+from ..utils import INVALID, is_invalid
 
 
 class cropCentroid(torch.nn.Module):
@@ -49,22 +50,36 @@ class cropCentroid(torch.nn.Module):
 
 
 class DistogramToCoords(torch.nn.Module):
-    def __init__(self, size=256 + 128):
+    """
+    Recovers (B, C, N, 2) coordinates from (B, C, N, N) distograms.
+    method="MDS" fits sklearn's SMACOF per matrix, method="Matrix" triangulates from the first rows,
+    method="classical" solves classical MDS for the whole batch at once with torch.linalg.eigh,
+    returning a tensor on the distograms' device when given a tensor.
+    """
+
+    def __init__(self, size=256 + 128, method="MDS"):
         super().__init__()
         self.size = size
+        self.method = method
 
     def forward(self, image):
         # return(self.get_points_from_dist_C(image,self.size))
+        if self.method == "classical":
+            return self.get_points_from_dist_classical_MDS(image, self.size)
         return self.get_points_from_dist_BC(image, self.size)
 
     def __repr__(self):
-        return self.__class__.__name__
+        return self.__class__.__name__ + f"(method={self.method})"
 
-    def get_points_from_dist(self, image, method="MDS"):
+    def get_points_from_dist(self, image, method=None):
+        method = self.method if method is None else method
         if method == "MDS":
             return self.get_points_from_dist_MDS(image)
         if method == "Matrix":
             return self.calculate_positions(image)
+        if method == "classical":
+            return mds.mds(torch.as_tensor(image) ** 2).cpu().numpy()
+        raise ValueError(f"Unknown method {method}")
 
     def get_points_from_dist_MDS(self, image):
         return MDS(
@@ -82,6 +97,13 @@ class DistogramToCoords(torch.nn.Module):
         coords_scaled = (coords * size) + (size / 2)  # TODO Check this scaling
         return coords_scaled
 
+    def get_points_from_dist_classical_MDS(self, image, size):
+        coords = mds.mds(torch.as_tensor(image) ** 2)
+        if not isinstance(image, torch.Tensor):
+            coords = coords.numpy()
+        coords_scaled = (coords * size) + (size / 2)  # TODO Check this scaling
+        return coords_scaled
+
     def x_coord_of_point(self, D, j):
         return (D[0, j] ** 2 + D[0, 1] ** 2 - D[1, j] ** 2) / (2 * D[0, 1])
 
@@ -168,6 +190,47 @@ class CoordsToDistogram(torch.nn.Module):
             return distance_matrix / np.linalg.norm([self.size, self.size])
 
 
+class BatchImageToDistogram(torch.nn.Module):
+    """
+    Batched ImageToDistogram: a stack of masks (N, H, W) becomes (N, S, S) distograms in one call.
+    Contours are still traced per mask, but resampling and the distance matrices are vectorised over the batch.
+    A single (H, W) mask returns a numpy (S, S) array like ImageToDistogram, so it can be dropped into MaskToDistogramPipeline.
+    """
+
+    def __init__(self, size, matrix_normalised=False, contour_level=0.8):
+        super().__init__()
+        self.size = size
+        self.matrix_normalised = matrix_normalised
+        self.contour_level = contour_level
+
+    def forward(self, masks):
+        np_masks = np.asarray(masks)
+        if np_masks.ndim == 2:
+            return self.get_distogram(np_masks[None]).squeeze(0).numpy()
+        return self.get_distogram(np_masks)
+
+    def __repr__(self):
+        return self.__class__.__name__ + f"(size={self.size})"
+
+    def get_coords(self, masks):
+        contour_list = [
+            find_longest_array(find_contours(mask, self.contour_level))
+            for mask in masks
+        ]
+        return contours.batch_uniform_spline_resample_contours(contour_list, self.size)
+
+    def get_distogram(self, masks):
+        coords = self.get_coords(masks).transpose(-2, -1)
+        distance_matrix = torch.cdist(coords, coords) / (np.sqrt(2) * self.size)
+        if self.matrix_normalised:
+            return distance_matrix / frobenius_norm_2D(distance_matrix)
+        return distance_matrix / np.linalg.norm([self.size, self.size])
+
+
+def frobenius_norm_2D(tensor):
+    return torch.linalg.norm(tensor, ord="fro", dim=(-2, -1), keepdim=True)
+
+
 def find_longest_array(arrays):
     lengths = [len(arr.flatten()) for arr in arrays]
     max_length_index = np.argmax(lengths)
@@ -222,14 +285,20 @@ class VerticesToMask(torch.nn.Module):
 
     # Alternative: is to enforce simple polygonality in loss function,
     # Don't know how though
-    def __init__(self, size=256 + 128):
+    def __init__(self, size=256 + 128, rasteriser="skimage"):
         super().__init__()
         self.size = size
+        self.rasteriser = rasteriser
 
     def forward(self, x):
         # return self.vertices_to_mask(x, mask_shape=(self.size, self.size))
+        if self.rasteriser == "torch":
+            return fill_polygons(x, mask_shape=(self.size, self.size))
         return self.vertices_to_mask_BC(x, mask_shape=(self.size, self.size))
 
+    def __repr__(self):
+        return self.__class__.__name__ + f"(size={self.size}, rasteriser={self.rasteriser})"
+
     def vertices_to_mask(self, vertices, mask_shape=(128, 128)):
         mask_list = []
         for channel in vertices:
@@ -238,6 +307,8 @@ class VerticesToMask(torch.nn.Module):
         return torch.tensor(np.array(mask_list))
 
     def vertices_to_mask_BC(self, vertices, mask_shape=(128, 128)):
+        if isinstance(vertices, torch.Tensor):
+            vertices = vertices.cpu().numpy()
         flat = np.reshape(vertices, (-1, vertices.shape[-2], vertices.shape[-1]))
         masks = np.stack([polygon2mask(mask_shape, arr) for arr in flat]).reshape(
             *vertices.shape[-4:-2], *mask_shape
@@ -246,6 +317,52 @@ class VerticesToMask(torch.nn.Module):
         return masks
 
 
+def fill_polygons(vertices, mask_shape=(128, 128)):
+    """
+    Batched torch counterpart of skimage.draw.polygon2mask.
+    Fills (..., N, 2) polygons, in (row, col) pixel coordinates, into (..., H, W) boolean masks
+    on the device of the vertices, using the even-odd rule at the pixel centres.
+    As with polygon2mask, pixels exactly on an edge are filled too.
+
+    Every edge is intersected with every pixel row at once. An edge crossing row r at column x
+    toggles the pixels from ceil(x) onwards, so a cumulative sum along the row
+    counts the crossings left of each pixel, and the same trick marks the pixels an edge covers.
+    """
+    vertices = torch.as_tensor(vertices)
+    if not vertices.is_floating_point():
+        vertices = vertices.float()
+    height, width = mask_shape
+    r0, c0 = vertices[..., 0].unsqueeze(-2), vertices[..., 1].unsqueeze(-2)
+    r1, c1 = r0.roll(-1, dims=-1), c0.roll(-1, dims=-1)
+    # (..., H, N) intersections of the rows with the edges
+    rows = torch.arange(height, device=vertices.device, dtype=vertices.dtype)[:, None]
+    # Half open, so a vertex shared by two edges is only crossed once
+    crosses = (r0 <= rows) != (r1 <= rows)
+    horizontal = r0 == r1
+    dr = torch.where(horizontal, torch.ones_like(r0), r1 - r0)
+    x = c0 + (rows - r0) * (c1 - c0) / dr
+
+    def scatter_columns(index, value):
+        # Columns right of the mask land in the extra last column, which is dropped
+        index = index.clamp(0, width).long()
+        counts = torch.zeros(
+            (*index.shape[:-1], width + 1), dtype=torch.int32, device=vertices.device
+        )
+        counts.scatter_add_(-1, index, value.int())
+        return counts[..., :width].cumsum(-1)
+
+    inside = scatter_columns(x.ceil(), crosses) % 2 == 1
+    # Columns [lo, hi] of each edge on each row, a single point unless the edge is horizontal
+    on_row = (torch.minimum(r0, r1) <= rows) & (rows <= torch.maximum(r0, r1))
+    lo = torch.where(horizontal, torch.minimum(c0, c1), x).ceil()
+    hi = torch.where(horizontal, torch.maximum(c0, c1), x).floor()
+    on_edge = on_row & (lo <= hi)
+    boundary = scatter_columns(
+        torch.cat([lo, hi + 1], -1), torch.cat([on_edge, -on_edge.int()], -1)
+    )
+    return inside | (boundary > 0)
+
+
 class CropCentroidPipeline(torch.nn.Module):
     def __init__(self, window_size, num_output_channels=1):
         super().__init__()
@@ -265,23 +382,29 @@ class CropCentroidPipeline(torch.nn.Module):
         )
 
     def forward(self, x):
-        # try:
-        return self.pipeline(x)
-        # except:
-        # return None
+        if is_invalid(x):
+            return INVALID
+        try:
+            return self.pipeline(x)
+        except Exception:
+            return INVALID
 
 
 class MaskToDistogramPipeline(torch.nn.Module):
-    def __init__(self, window_size, interp_size=128, matrix_normalised=False):
+    def __init__(
+        self, window_size, interp_size=128, matrix_normalised=False, batched=False
+    ):
         super().__init__()
         self.window_size = window_size
         self.interp_size = interp_size
+        self.matrix_normalised = matrix_normalised
+        to_distogram = BatchImageToDistogram if batched else ImageToDistogram
         self.pipeline = transforms.Compose(
             [
                 CropCentroidPipeline(self.window_size),
                 # transforms.ToTensor(),
                 # transforms.ToPILImage(),
-                ImageToDistogram(self.interp_size, matrix_normalised=matrix_normalised),
+                to_distogram(self.interp_size, matrix_normalised=matrix_normalised),
                 # transforms.ToTensor(),
                 # transforms.ToPILImage(),
                 # transforms.RandomCrop((512, 512)),
@@ -290,32 +413,41 @@ class MaskToDistogramPipeline(torch.nn.Module):
         )
 
     def forward(self, x):
-        # try:
-        return self.pipeline(x)
-        # except:
-        # return None
+        if is_invalid(x):
+            return INVALID
+        try:
+            return self.pipeline(x)
+        except Exception:
+            return INVALID
 
 
 class DistogramToMaskPipeline(torch.nn.Module):
     """
     Placeholder class
+    As with the other dataset transforms, samples that fail are returned as utils.INVALID
+    for the Collator to drop, and INVALID inputs pass straight through.
+    rasteriser="torch" fills the polygons with fill_polygons, batched. With method="classical"
+    and a distogram tensor the coordinates stay tensors on its device, so the masks are
+    filled there too; other methods go through numpy on the CPU.
     """
 
-    def __init__(self, window_size):
+    def __init__(self, window_size, method="MDS", rasteriser="skimage"):
         super().__init__()
         self.window_size = window_size
         self.pipeline = transforms.Compose(
             [
-                DistogramToCoords(self.window_size),
-                VerticesToMask(self.window_size),
+                DistogramToCoords(self.window_size, method=method),
+                VerticesToMask(self.window_size, rasteriser=rasteriser),
             ]
         )
 
     def forward(self, x):
-        # try:
-        return self.pipeline(x)
-        # except:
-        # return None
+        if is_invalid(x):
+            return INVALID
+        try:
+            return self.pipeline(x)
+        except Exception:
+            return INVALID
 
 
 class AsymmetricDistogramToMaskPipeline(torch.nn.Module):
@@ -323,13 +455,15 @@ class AsymmetricDistogramToMaskPipeline(torch.nn.Module):
     Placeholder class
     """
 
-    def __init__(self, window_size):
+    def __init__(self, window_size, method="MDS", rasteriser="skimage"):
         super().__init__()
         self.window_size = window_size
         self.pipeline = transforms.Compose(
             [
                 AsymmetricDistogramToSymmetricDistogram(),
-                DistogramToMaskPipeline(self.window_size),
+                DistogramToMaskPipeline(
+                    self.window_size, method=method, rasteriser=rasteriser
+                ),
             ]
         )
 
@@ -346,13 +480,13 @@ class AsymmetricDistogramToCoordsPipeline(torch.nn.Module):
     Placeholder class
     """
 
-    def __init__(self, window_size):
+    def __init__(self, window_size, method="MDS"):
         super().__init__()
         self.window_size = window_size
         self.pipeline = transforms.Compose(
             [
                 AsymmetricDistogramToSymmetricDistogram(),
-                DistogramToCoords(self.window_size),
+                DistogramToCoords(self.window_size, method=method),
             ]
         )
 
@@ -0,0 +1,110 @@
+import albumentations as A
+import numpy as np
+import pytest
+
+from .. import augmentations
+from ..augmentations import (
+    DEFAULT_AUGMENTATION,
+    DEFAULT_AUGMENTATION_LIST,
+    BankedElasticTransform,
+    VisionWrapper,
+    elastic_field_bank,
+    with_elastic_bank,
+)
+
+
+def ramps(height=64, width=80):
+    y, x = np.mgrid[:height, :width].astype(np.float32)
+    return np.dstack([x, y])
+
+
+def displacement_std(transform, n=16):
+    image = ramps()
+    displacements = [transform(image=image)["image"] - image for _ in range(n)]
+    return np.std([d[8:-8, 8:-8] for d in displacements])
+
+
+def test_banked_elastic_transform():
+    transform = BankedElasticTransform(alpha=50, sigma=5, alpha_affine=10, p=1)
+    image = np.random.randint(0, 255, (64, 80, 3), dtype=np.uint8)
+    mask = np.arange(64 * 80, dtype=np.int32).reshape(64, 80)
+    out = transform(image=image, mask=mask)
+    assert out["image"].shape == image.shape and out["image"].dtype == np.uint8
+    assert out["mask"].shape == mask.shape and not np.array_equal(out["mask"], mask)
+    # Nearest neighbour masks hold the labels of the input
+    assert np.isin(out["mask"], mask).all()
+
+
+def test_same_deformation_for_image_and_mask():
+    transform = BankedElasticTransform(alpha=50, sigma=5, alpha_affine=10, p=1)
+    image = ramps()
+    out = transform(image=image, mask=image.copy())
+    # Linear and nearest interpolation of the same coordinates are within a pixel
+    assert np.abs(out["image"] - out["mask"]).max() <= 1
+
+
+def test_bank_is_reused():
+    augmentations._field_banks.clear()
+    transform = BankedElasticTransform(alpha=50, sigma=5, bank_size=4, p=1)
+    transform(image=ramps())
+    transform(image=ramps())
+    assert len(augmentations._field_banks) == 1
+    bank = transform.bank(64, 80)
+    assert bank.shape == (4, 2, 256, 256) and bank.dtype == np.float32
+    # Larger images grow the fields
+    transform(image=ramps(300, 80))
+    assert transform.bank(300, 80).shape == (4, 2, 300, 300)
+
+
+def test_bank_dir(tmp_path):
+    bank = elastic_field_bank(bank_size=2, size=32, sigma=4, bank_dir=tmp_path)
+    (path,) = tmp_path.glob("*.npy")
+    augmentations._field_banks.clear()
+    loaded = elastic_field_bank(bank_size=2, size=32, sigma=4, bank_dir=tmp_path)
+    assert isinstance(loaded, np.memmap)
+    np.testing.assert_array_equal(loaded, bank)
+    # Smaller sizes reuse the saved bank, larger ones are saved next to it
+    augmentations._field_banks.clear()
+    smaller = elastic_field_bank(bank_size=2, size=16, sigma=4, bank_dir=tmp_path)
+    assert smaller.shape[-1] == 32 and list(tmp_path.glob("*.npy")) == [path]
+    larger = elastic_field_bank(bank_size=2, size=48, sigma=4, bank_dir=tmp_path)
+    assert larger.shape == (2, 2, 48, 48) and len(list(tmp_path.glob("*.npy"))) == 2
+    augmentations._field_banks.clear()
+    reused = elastic_field_bank(bank_size=2, size=40, sigma=4, bank_dir=tmp_path)
+    assert reused.shape[-1] == 48
+    # Other parameters get their own file
+    elastic_field_bank(bank_size=2, size=32, sigma=8, bank_dir=tmp_path)
+    assert len(list(tmp_path.glob("*.npy"))) == 3
+
+
+@pytest.mark.parametrize("same_dxdy", [False, True])
+def test_displacement_matches_elastic_transform(same_dxdy):
+    kwargs = dict(alpha=50, sigma=5, alpha_affine=0, same_dxdy=same_dxdy, p=1)
+    expected = displacement_std(A.ElasticTransform(**kwargs))
+    std = displacement_std(BankedElasticTransform(bank_size=8, **kwargs))
+    assert std == pytest.approx(expected, rel=0.2)
+
+
+def test_with_elastic_bank_serializes():
+    compose = A.Compose(with_elastic_bank(DEFAULT_AUGMENTATION_LIST, bank_size=8))
+    (elastic,) = [
+        t for t in compose.transforms if isinstance(t, BankedElasticTransform)
+    ]
+    assert (elastic.alpha, elastic.sigma, elastic.p) == (1, 50, 0.5)
+    assert elastic.bank_size == 8
+    loaded = A.from_dict(A.to_dict(compose))
+    assert isinstance(loaded.transforms[2], BankedElasticTransform)
+    assert loaded.transforms[2].bank_size == 8
+
+
+def test_vision_wrapper_elastic_bank(tmp_path):
+    wrapper = VisionWrapper(
+        A.to_dict(DEFAULT_AUGMENTATION), elastic_bank=True, elastic_bank_dir=tmp_path
+    )
+    transforms = wrapper.transform.transforms
+    assert not any(isinstance(t, A.ElasticTransform) for t in transforms)
+    (elastic,) = [t for t in transforms if isinstance(t, BankedElasticTransform)]
+    assert (elastic.alpha, elastic.sigma, elastic.alpha_affine) == (1, 50, 50)
+    assert elastic.bank_dir == tmp_path
+    image = np.random.default_rng(0).integers(0, 256, (64, 64, 3), dtype=np.uint8)
+    assert wrapper(image).shape == (3, 224, 224)
@@ -0,0 +1,184 @@
+from types import SimpleNamespace
+
+import albumentations as A
+import pytest
+import torch
+from albumentations.pytorch import ToTensorV2
+
+from .. import batch_augmentations as B
+from ..augmentations import DEFAULT_AUGMENTATION, VisionWrapper
+from ..lightning.dataloader import DataModule
+
+
+def spec(transform):
+    return A.to_dict(transform)["transform"]
+
+
+@pytest.fixture
+def images():
+    torch.manual_seed(0)
+    return torch.rand(8, 3, 32, 40)
+
+
+def test_split_default_transform_dict():
+    # RandomResizedCrop brings images to one size, it and what runs before stay per image
+    cpu, batch = B.split_transform_dict(A.to_dict(DEFAULT_AUGMENTATION))
+    assert [t["__class_fullname__"] for t in cpu["transform"]["transforms"]] == [
+        "OneOf",
+        "Rotate",
+        "ElasticTransform",
+        "RandomResizedCrop",
+        "ToFloat",
+        "ToTensorV2",
+    ]
+    assert [t["__class_fullname__"] for t in batch["transform"]["transforms"]] == [
+        "GaussNoise",
+        "RandomBrightnessContrast",
+    ]
+    cpu, batch = B.split_transform_dict(
+        A.to_dict(DEFAULT_AUGMENTATION), same_size=True
+    )
+    assert [t["__class_fullname__"] for t in cpu["transform"]["transforms"]] == [
+        "ToFloat",
+        "ToTensorV2",
+    ]
+    assert [t["__class_fullname__"] for t in batch["transform"]["transforms"]] == [
+        "OneOf",
+        "Rotate",
+        "ElasticTransform",
+        "RandomResizedCrop",
+        "GaussNoise",
+        "RandomBrightnessContrast",
+    ]
+    augment = B.BatchAugmentation(batch)
+    x = augment(torch.rand(4, 3, 64, 64))
+    assert x.shape == (4, 3, 224, 224)
+    assert x.min() >= 0 and x.max() <= 1
+    with pytest.raises(ValueError):
+        augment(torch.zeros(4, 3, 64, 64, dtype=torch.uint8))
+    with pytest.raises(ValueError):
+        B.BatchAugmentation(A.to_dict(DEFAULT_AUGMENTATION))
+
+
+def test_flips_per_sample(images):
+    x = images.repeat(8, 1, 1, 1)
+    flipped = B.from_spec(spec(A.HorizontalFlip(p=0.5)))(x)
+    is_flipped = (flipped == x.flip(-1)).flatten(1).all(1)
+    is_same = (flipped == x).flatten(1).all(1)
+    assert (is_flipped | is_same).all()
+    assert 0 < is_flipped.sum() < len(x)
+    vertical = B.from_spec(spec(A.VerticalFlip(p=1.0)))(images)
+    assert torch.equal(vertical, images.flip(-2))
+
+
+def test_one_of(images):
+    one_of = B.from_spec(
+        spec(A.OneOf([A.HorizontalFlip(p=1), A.VerticalFlip(p=1)], p=1.0))
+    )
+    x = one_of(images.repeat(8, 1, 1, 1))
+    originals = images.repeat(8, 1, 1, 1)
+    horizontal = (x == originals.flip(-1)).flatten(1).all(1)
+    vertical = (x == originals.flip(-2)).flatten(1).all(1)
+    assert (horizontal ^ vertical).all()
+    assert horizontal.any() and vertical.any()
+
+
+def test_rotate(images):
+    square = images[..., :32]
+    rotate = B.from_spec(spec(A.Rotate(limit=(90, 90), p=1.0)))
+    x = rotate(square)
+    torch.testing.assert_close(
+        x[..., 1:-1, 1:-1], torch.rot90(square, 1, (-2, -1))[..., 1:-1, 1:-1]
+    )
+
+
+def test_identity_geometry(images):
+    crop = B.from_spec(
+        spec(A.RandomResizedCrop(32, 40, scale=(1, 1), ratio=(1.25, 1.25), p=1.0))
+    )
+    torch.testing.assert_close(crop(images), images)
+    elastic = B.from_spec(
+        spec(A.ElasticTransform(alpha=0, sigma=5, alpha_affine=0, p=1.0))
+    )
+    torch.testing.assert_close(elastic(images), images)
+
+
+def test_random_resized_crop(images):
+    crop = B.from_spec(spec(A.RandomResizedCrop(16, 16, scale=(0.1, 0.3), p=1.0)))
+    boxes = crop.boxes(1000, 32, 40, images.device)
+    x0, y0, w, h = boxes.T
+    assert (x0 >= 0).all() and (x0 + w <= 40).all()
+    assert (y0 >= 0).all() and (y0 + h <= 32).all()
+    area = w * h / (32 * 40)
+    assert area.min() >= 0.08 and area.max() <= 0.32
+    assert crop(images).shape == (8, 3, 16, 16)
+
+
+def test_elastic_displacement():
+    elastic = B.from_spec(spec(A.ElasticTransform(alpha=50, sigma=5, alpha_affine=10)))
+    x = torch.rand(4, 1, 48, 48)
+    y = elastic.transform(x)
+    assert y.shape == x.shape
+    assert not torch.allclose(y, x)
+
+
+def test_pixel_transforms():
+    x = torch.full((256, 1, 16, 16), 0.5)
+    noise = B.from_spec(spec(A.GaussNoise(var_limit=(100, 100), p=1.0)))
+    std = (noise(x) - 0.5).std()
+    assert abs(std.item() - 10 / 255) < 1e-3
+    brightness = B.from_spec(
+        spec(
+            A.RandomBrightnessContrast(
+                brightness_limit=(0.1, 0.1), contrast_limit=(0.2, 0.2), p=1.0
+            )
+        )
+    )
+    torch.testing.assert_close(brightness(x), torch.full_like(x, 0.5 * 1.2 + 0.1))
+
+
+def test_vision_wrapper_batch(tmp_path):
+    transform_dict = A.to_dict(
+        A.Compose(
+            [
+                A.HorizontalFlip(p=0.5),
+                A.RandomResizedCrop(16, 16, p=1.0),
+                A.ToFloat(),
+                ToTensorV2(),
+            ]
+        )
+    )
+    wrapper = VisionWrapper(transform_dict, batch=True, same_size=True)
+    image = torch.randint(0, 255, (16, 16, 3), dtype=torch.uint8).numpy()
+    x = wrapper(image)
+    assert x.shape == (3, 16, 16) and x.dtype == torch.float32
+
+    dataset = torch.utils.data.TensorDataset(torch.rand(10, 3, 24, 24))
+    dataset.transform = wrapper
+    datamodule = DataModule(dataset, batch_size=4, num_workers=0)
+    assert datamodule.batch_transform is wrapper.batch_transform
+    batch = [torch.rand(4, 3, 24, 24), torch.zeros(4)]
+    # Only training batches are augmented
+    datamodule.trainer = SimpleNamespace(training=False)
+    assert datamodule.on_after_batch_transfer(batch, 0) is batch
+    datamodule.trainer = SimpleNamespace(training=True)
+    x, y = datamodule.on_after_batch_transfer(batch, 0)
+    assert x.shape == (4, 3, 16, 16) and y is batch[1]
+    # Image only and dict batches
+    assert datamodule.on_after_batch_transfer(batch[0], 0).shape == (4, 3, 16, 16)
+    out = datamodule.on_after_batch_transfer({"image": batch[0], "label": batch[1]}, 0)
+    assert out["image"].shape == (4, 3, 16, 16) and out["label"] is batch[1]
+    assert datamodule.on_after_batch_transfer(None, 0) is None
+
+
+def test_vision_wrapper_batch_mixed_sizes():
+    wrapper = VisionWrapper(A.to_dict(DEFAULT_AUGMENTATION), batch=True)
+    images = [
+        torch.randint(0, 255, size, dtype=torch.uint8).numpy()
+        for size in [(300, 300, 3), (256, 320, 3)]
+    ]
+    dataset = [(wrapper(image), 0) for image in images]
+    x, _ = torch.utils.data.default_collate(dataset)
+    assert x.shape == (2, 3, 224, 224)
+    x = wrapper.batch_transform(x)
+    assert x.shape == (2, 3, 224, 224)
@@ -105,3 +105,80 @@ def test_train(cfg):
 
 def test_check(cfg):
     cli.check(cfg)
+
+
+def test_infer(cfg, tmp_path):
+    cfg.inference.output = str(tmp_path)
+    cfg.inference.ckpt_path = "last"
+    # Nothing was trained, so there is no checkpoint to embed with
+    with pytest.raises(FileNotFoundError):
+        cli.infer(cfg)
+    cfg.inference.ckpt_path = None
+    writer = cli.infer(cfg)
+    assert writer.pending_shards() == []
+    assert writer.stats["images"] == len(cfg.dataloader.dataset)
+
+
+def test_app_help():
+    result = runner.invoke(cli.app, ["--help"])
+    assert result.exit_code == 0
+    for command in cli.hydra_commands:
+        assert command in result.output
+
+
+def test_evaluate(tmp_path):
+    import numpy as np
+    from ..inference import EmbeddingWriter
+
+    rng = np.random.default_rng(42)
+    label = np.repeat([0, 1], 20)
+    roots = [tmp_path / "a", tmp_path / "b"]
+    for root in roots:
+        writer = EmbeddingWriter(root, len(label), shard_size=16)
+        for shard in range(writer.num_shards):
+            index = np.asarray(writer.shard_indices(shard))
+            writer.write(
+                shard,
+                index=index,
+                embedding=rng.normal(label[index, None], 1, (len(index), 8)),
+                label=label[index],
+                path=[None] * len(index),
+            )
+    output = tmp_path / "scores.csv"
+    result = runner.invoke(
+        cli.app,
+        [
+            "evaluate",
+            *map(str, roots),
+            "--probe",
+            "linear",
+            "--n-jobs",
+            "1",
+            "--output",
+            str(output),
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    assert output.is_file()
+    assert str(roots[0]) in result.output
+
+
+def test_pack(tmp_path):
+    from hydra.core.global_hydra import GlobalHydra
+    from ..datasets import PackedDataset
+
+    # test_init_hydra_with_invalid_config_file leaves hydra initialized
+    GlobalHydra.instance().clear()
+    result = runner.invoke(
+        cli.app,
+        [
+            "pack",
+            str(tmp_path),
+            "+dataloader.dataset.size=4",
+            "+dataloader.dataset.image_size=[3,16,16]",
+            "--num-workers",
+            "0",
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    assert len(PackedDataset(tmp_path)) == 4
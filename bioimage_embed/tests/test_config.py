@@ -40,3 +40,12 @@ def test_train_check(bie):
 
 def test_bie_train(bie):
     bie.train()
+
+
+def test_recipe_shape_losses():
+    recipe = config.Recipe(triangle_inequality=True, triangle_inequality_weight=0.5)
+    assert recipe.triangle_inequality_weight == 0.5
+    recipe = config.Recipe(clockwise_order=True, clockwise_order_weight=0.5)
+    assert recipe.clockwise_order_weight == 0.5
+    with pytest.raises(ValueError):
+        config.Recipe(triangle_inequality_weight="heavy")
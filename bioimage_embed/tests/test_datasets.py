@@ -0,0 +1,472 @@
+import glob
+import json
+import os
+import pickle
+import re
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+from torch.utils.data import DataLoader
+from torchvision.datasets import FakeData, ImageFolder
+
+from ..datasets import (
+    DatasetGlob,
+    ImageCache,
+    NgffDataset,
+    SharedImageCache,
+    TiffDataset,
+    file_index,
+    glob_paths,
+    pack,
+)
+from ..datasets import index
+from ..datasets.index import glob_regex
+from ..datasets.nd import TiffPlane, chunk_crop_origin
+from ..lightning.dataloader import Collator
+from ..utils import INVALID, collate_none, is_invalid
+
+
+@pytest.fixture
+def image_folder(tmp_path):
+    rng = np.random.default_rng(42)
+    root = tmp_path / "images"
+    for label in ["a", "b"]:
+        (root / label).mkdir(parents=True)
+        for i in range(3):
+            size = (8 + i, 10)
+            image = rng.integers(0, 256, (*size, 3), dtype=np.uint8)
+            Image.fromarray(image).save(root / label / f"{i}.png")
+    return root
+
+
+def test_pack_image_folder(image_folder, tmp_path):
+    dataset = ImageFolder(image_folder)
+    packed = pack(dataset, tmp_path / "packed", num_workers=0)
+    assert len(packed) == len(dataset)
+    assert packed.data.dtype == np.uint8
+    assert np.array_equal(packed.targets, dataset.targets)
+    for (image, label), (expected, expected_label) in zip(packed, dataset):
+        assert isinstance(image, torch.Tensor)
+        assert np.array_equal(image.numpy(), np.asarray(expected))
+        assert label == expected_label
+    assert packed.image_paths == [path for path, _ in dataset.samples]
+
+
+def test_pack_uint16(tmp_path):
+    images = [np.full((4, 4), 1000 * i, dtype=np.uint16) for i in range(3)]
+    dataset = [(image, 0) for image in images]
+    packed = pack(dataset, tmp_path, num_workers=0)
+    assert packed.data.dtype == np.uint16
+    assert np.array_equal(packed[2][0].numpy(), images[2])
+
+
+def test_pack_dtype_from_source(tmp_path):
+    # PIL decodes 16 bit PNGs to int32, a dim first image still packs to uint16
+    images = [np.full((4, 4), value, dtype=np.int32) for value in (10, 1000)]
+    packed = pack([(image, 0) for image in images], tmp_path / "int32", num_workers=0)
+    assert packed.data.dtype == np.uint16
+    assert np.array_equal(packed[1][0].numpy(), images[1])
+    # 8 bit samples then 16 bit ones widen what was packed
+    images = [np.full((2, 3), 200, np.uint8), np.full((4, 4), 1000, np.uint16)]
+    packed = pack([(image, 0) for image in images], tmp_path / "mixed", num_workers=0)
+    assert packed.data.dtype == np.uint16
+    for (image, _), expected in zip(packed, images):
+        assert np.array_equal(image.numpy(), expected)
+    with pytest.raises(ValueError):
+        pack([(images[1], 0)], tmp_path / "fixed", num_workers=0, dtype=np.uint8)
+
+
+def test_pack_skips_invalid(tmp_path):
+    dataset = [
+        (np.zeros((2, 2), np.uint8), 0),
+        (INVALID, 1),
+        (np.ones((2, 2), np.uint8), 2),
+    ]
+    packed = pack(dataset, tmp_path, num_workers=0)
+    assert list(packed.source_indices) == [0, 2]
+    assert list(packed.targets) == [0, 2]
+
+
+def test_pack_rejects_floats(tmp_path):
+    with pytest.raises(ValueError):
+        pack([(np.zeros((2, 2)), 0)], tmp_path, num_workers=0)
+
+
+def test_packed_dataset_workers(tmp_path):
+    dataset = FakeData(size=8, image_size=(3, 16, 16))
+    packed = pack(dataset, tmp_path, num_workers=2)
+    assert packed.data.shape == (8 * 16 * 16 * 3,)
+    # The map is opened in each worker instead of being pickled with the dataset
+    assert pickle.loads(pickle.dumps(packed))._data is None
+    x, y = next(iter(DataLoader(packed, batch_size=8, num_workers=2)))
+    assert x.shape == (8, 16, 16, 3)
+    assert x.dtype == torch.uint8
+    assert torch.equal(x[3], torch.from_numpy(np.asarray(dataset[3][0])))
+
+
+def test_pack_dataset_glob(tmp_path):
+    # Two row images are not mistaken for (image, label) samples
+    for i in range(3):
+        image = np.full((2, 5), i, dtype=np.uint8)
+        Image.fromarray(image).save(tmp_path / f"{i}.png")
+    dataset = DatasetGlob(str(tmp_path / "*.png"), transform=None)
+    packed = pack(dataset, tmp_path / "packed", num_workers=0)
+    assert list(packed.targets) == [-1] * 3
+    assert packed.image_paths == dataset.image_paths
+    for i in range(3):
+        image = packed[i]
+        assert isinstance(image, torch.Tensor)
+        np.testing.assert_array_equal(image.numpy(), dataset[i])
+
+
+@pytest.fixture
+def tiff_folder(tmp_path):
+    tifffile = pytest.importorskip("tifffile")
+    rng = np.random.default_rng(42)
+    images = {
+        "gray": rng.integers(0, 2**16, (300, 260), dtype=np.uint16),
+        "rgb": rng.integers(0, 256, (200, 330, 3), dtype=np.uint8),
+    }
+    for label, image in images.items():
+        (tmp_path / label).mkdir()
+        path = tmp_path / label / "tiled.tif"
+        tifffile.imwrite(path, image, tile=(64, 64), compression="zlib")
+        tifffile.imwrite(tmp_path / label / "plain.tif", image)
+    return tmp_path, images
+
+
+@pytest.mark.parametrize("name", ["tiled", "plain"])
+@pytest.mark.parametrize("origin", [(0, 0), (70, 10), (150, 190), (190, 250)])
+def test_tiff_plane_read(tiff_folder, name, origin):
+    root, images = tiff_folder
+    for label, image in images.items():
+        plane = TiffPlane(root / label / f"{name}.tif")
+        assert (plane.array is None) == (name == "tiled")
+        y, x = origin
+        np.testing.assert_array_equal(
+            plane.read(y, x, 100, 90), image[y : y + 100, x : x + 90]
+        )
+
+
+def test_chunk_crop_origin():
+    rng = np.random.default_rng(0)
+    for _ in range(100):
+        y, x = chunk_crop_origin((300, 260), (64, 64), (32, 48), rng)
+        # Crops smaller than a tile stay in one tile
+        assert y // 64 == (y + 31) // 64 and x // 64 == (x + 47) // 64
+        assert y + 32 <= 300 and x + 48 <= 260
+        y, x = chunk_crop_origin((300, 260), (64, 64), (100, 100), rng)
+        assert y % 64 == 0 or y == 200
+        assert x % 64 == 0 or x == 160
+    assert chunk_crop_origin((16, 16), (64, 64), (32, 32), rng) == [0, 0]
+
+
+def test_tiff_dataset(tiff_folder):
+    root, images = tiff_folder
+    dataset = TiffDataset(root, crop_size=48, crops_per_image=3, seed=0)
+    assert len(dataset) == 12
+    assert dataset.classes == ["gray", "rgb"]
+    assert list(dataset.targets) == [0] * 6 + [1] * 6
+    # Images are sorted, gray/plain.tif then gray/tiled.tif
+    plane = dataset.handle(1)
+    segment = plane.segment
+    reads = []
+
+    def counting_segment(index):
+        reads.append(index)
+        return segment(index)
+
+    plane.segment = counting_segment
+    crop, label = dataset[3]
+    assert crop.shape == (48, 48) and label == 0
+    # One tile decoded for a crop smaller than a tile
+    assert len(reads) == 1
+    image, _ = dataset[9]
+    assert image.shape == (48, 48, 3) and image.dtype == np.uint8
+    # Handles are reopened after pickling, e.g. in DataLoader workers
+    assert pickle.loads(pickle.dumps(dataset))._handles == {}
+    x, y = next(iter(DataLoader(dataset, batch_size=4, num_workers=2)))
+    assert x.shape == (4, 48, 48)
+
+
+def test_tiff_dataset_pads_small_images(tmp_path):
+    tifffile = pytest.importorskip("tifffile")
+    tifffile.imwrite(tmp_path / "small.tif", np.ones((20, 30), dtype=np.uint8))
+    crop, label = TiffDataset(tmp_path, crop_size=32)[0]
+    assert crop.shape == (32, 32) and label == 0
+    assert crop[:20, :30].all() and not crop[20:].any() and not crop[:, 30:].any()
+
+
+def test_ngff_dataset(tmp_path):
+    zarr = pytest.importorskip("zarr")
+    image = np.random.default_rng(0).integers(0, 256, (2, 3, 100, 120), dtype=np.uint8)
+    group = zarr.open_group(str(tmp_path / "a" / "image.zarr"), mode="w")
+    group.create_dataset("0", data=image, chunks=(1, 1, 32, 32))
+    group.attrs["multiscales"] = [
+        {
+            "axes": [
+                {"name": "t", "type": "time"},
+                {"name": "c", "type": "channel"},
+                {"name": "y", "type": "space"},
+                {"name": "x", "type": "space"},
+            ],
+            "datasets": [{"path": "0"}],
+        }
+    ]
+    dataset = NgffDataset(tmp_path, crop_size=16, crops_per_image=2)
+    assert len(dataset) == 2
+    crop, label = dataset[0]
+    assert crop.shape == (16, 16, 3) and label == 0
+    # The crop is a window of one time point with channels last
+    windows = np.lib.stride_tricks.sliding_window_view(
+        image.transpose(0, 2, 3, 1), (16, 16, 3), axis=(1, 2, 3)
+    )
+    assert (windows == crop).all(axis=(-3, -2, -1)).any()
+
+
+def ngff_metadata(path, attrs):
+    path.mkdir(parents=True)
+    (path / ".zgroup").write_text(json.dumps({"zarr_format": 2}))
+    (path / ".zattrs").write_text(json.dumps(attrs))
+
+
+def test_ngff_dataset_labels(tmp_path):
+    # Only the metadata is read until a crop is, so this runs without zarr
+    multiscales = {"multiscales": [{"datasets": [{"path": "0"}]}]}
+    ngff_metadata(tmp_path / "single.zarr", multiscales)
+    dataset = NgffDataset(tmp_path / "single.zarr")
+    assert dataset.image_paths == [str(tmp_path / "single.zarr")]
+    assert list(dataset.targets) == [0] and dataset.classes == []
+
+    for label in ["control", "treated"]:
+        plate = tmp_path / "plates" / label / "plate.zarr"
+        ngff_metadata(plate, {"plate": {}})
+        for row in ["A", "B"]:
+            ngff_metadata(plate / row, {})
+            ngff_metadata(plate / row / "1", {"well": {}})
+            ngff_metadata(plate / row / "1" / "0", multiscales)
+    dataset = NgffDataset(tmp_path / "plates")
+    assert len(dataset) == 4
+    # Fields are labelled by the directory of their plate, not by their row
+    assert dataset.classes == ["control", "treated"]
+    assert list(dataset.targets) == [0, 0, 1, 1]
+    assert NgffDataset(tmp_path / "plates" / "control" / "plate.zarr").classes == []
+
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_image_cache_lru(shared):
+    arrays = [np.full((4, 4), i, dtype=np.uint16) for i in range(4)]
+    if shared:
+        cache = SharedImageCache(4, max_bytes=3 * 32, slot_bytes=32)
+    else:
+        cache = ImageCache(max_bytes=3 * 32)
+    for i in range(3):
+        cache.put(i, arrays[i])
+    np.testing.assert_array_equal(cache.get(0), arrays[0])
+    # 1 is now the least recently used
+    cache.put(3, arrays[3])
+    assert cache.get(1) is None
+    for i in (0, 2, 3):
+        assert cache.get(i).dtype == np.uint16
+        np.testing.assert_array_equal(cache.get(i), arrays[i])
+    cache.put(0, np.zeros(128, dtype=np.uint8))
+    stats = cache.reset()
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (7, 1, 1)
+    assert stats["skipped"] == 1
+    assert stats["hit_rate"] == 7 / 8
+    assert cache.stats()["hits"] == 0 and len(cache) == 3
+
+
+def test_shared_image_cache_pickling():
+    cache = SharedImageCache(4, max_bytes=64, slot_bytes=32)
+    cache.put(0, np.ones(4))
+    # Until shared, a pickled copy has a block of its own
+    copy = pickle.loads(pickle.dumps(cache))
+    assert copy.shm.name != cache.shm.name and len(copy) == 0
+    # Once shared, the lock can only be pickled to start workers
+    with pytest.raises(RuntimeError):
+        pickle.dumps(cache.share())
+
+
+def test_image_cache_returns_copies():
+    cache = ImageCache()
+    array = np.zeros(3)
+    cache.put(0, array)
+    array[0] = 1
+    cache.get(0)[1] = 1
+    assert not cache.get(0).any()
+
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_dataset_glob_cache(image_folder, shared):
+    dataset = DatasetGlob(
+        str(image_folder / "**" / "*.png"),
+        over_sampling=4,
+        transform=None,
+        cache_bytes=2**20,
+        cache_shared=shared,
+        cache_slot_bytes=1024,
+    )
+    assert len(dataset) == 24
+    images = [dataset[i] for i in range(len(dataset))]
+    for i, image in enumerate(images):
+        expected = np.array(Image.open(dataset.image_paths[i % 6]))
+        np.testing.assert_array_equal(image, expected)
+    stats = dataset.cache_stats()
+    assert (stats["hits"], stats["misses"]) == (18, 6)
+
+
+def test_dataset_glob_shared_cache_workers(image_folder):
+    dataset = DatasetGlob(
+        str(image_folder / "**" / "*.png"),
+        over_sampling=4,
+        transform=None,
+        cache_bytes=2**20,
+        cache_shared=True,
+        cache_slot_bytes=1024,
+    )
+    loader = DataLoader(dataset, batch_size=None, num_workers=2)
+    assert len(list(loader)) == 24
+    # Every worker reads and fills the one cache
+    stats = dataset.cache_stats()
+    assert stats["hits"] + stats["misses"] == 24
+    assert stats["misses"] <= 6 + 2
+
+
+@pytest.fixture
+def glob_folder(tmp_path):
+    rng = np.random.default_rng(0)
+    for i in range(10):
+        image = rng.integers(0, 256, (12, 16), dtype=np.uint8)
+        Image.fromarray(image).save(tmp_path / f"{i}.png")
+    return str(tmp_path / "*.png")
+
+
+def test_dataset_glob_batches(glob_folder):
+    dataset = DatasetGlob(glob_folder, over_sampling=2, transform=None, num_threads=4)
+    expected = np.stack([dataset[i] for i in range(len(dataset))])
+    batch = dataset[3:17:2]
+    assert isinstance(batch, np.ndarray) and batch.shape == (7, 12, 16)
+    np.testing.assert_array_equal(batch, expected[3:17:2])
+    np.testing.assert_array_equal(dataset[[19, 0, 5]], expected[[19, 0, 5]])
+    np.testing.assert_array_equal(dataset[-1], expected[-1])
+    with pytest.raises(IndexError):
+        dataset[20]
+    # The DataLoader fetches whole batches through __getitems__
+    x = next(iter(DataLoader(dataset, batch_size=8, num_workers=1)))
+    assert torch.equal(x, torch.from_numpy(expected[:8]))
+    # The stacked batch is taken as is, not copied row by row again
+    batch = dataset.__getitems__(range(8))
+    for collate in (collate_none, Collator()):
+        x = collate(batch)
+        assert x.data_ptr() == batch.ctypes.data
+        assert torch.equal(x, torch.from_numpy(expected[:8]))
+    x = next(iter(DataLoader(dataset, batch_size=8, collate_fn=collate_none)))
+    assert torch.equal(x, torch.from_numpy(expected[:8]))
+
+
+def test_dataset_glob_ragged_batch(glob_folder, tmp_path):
+    Image.fromarray(np.zeros((5, 5), dtype=np.uint8)).save(tmp_path / "small.png")
+    dataset = DatasetGlob(glob_folder.replace("*.png", "*"), transform=None)
+    batch = dataset[:]
+    assert isinstance(batch, list) and len(batch) == 11
+    assert sorted(image.shape for image in batch)[0] == (5, 5)
+
+
+def odd_invalid(image):
+    # INVALID for the images whose first pixel is odd
+    return {"image": INVALID if image[0, 0] % 2 else image}
+
+
+@pytest.mark.parametrize("invalid_first", [False, True])
+def test_dataset_glob_batch_keeps_invalid(tmp_path, invalid_first):
+    for i in range(4):
+        Image.fromarray(np.full((4, 4), i, dtype=np.uint8)).save(tmp_path / f"{i}.png")
+    dataset = DatasetGlob(str(tmp_path / "*.png"), transform=odd_invalid)
+    invalid = [i for i in range(4) if is_invalid(dataset[i])]
+    valid = [i for i in range(4) if i not in invalid]
+    indices = invalid + valid if invalid_first else valid + invalid
+    batch = dataset.__getitems__(indices)
+    assert [is_invalid(sample) for sample in batch] == [i in invalid for i in indices]
+    for i, sample in zip(indices, batch):
+        if i in valid:
+            np.testing.assert_array_equal(sample, dataset[i])
+    # The Collator drops them
+    collated = Collator()(batch)
+    assert collated.shape == (2, 4, 4) and (collated[:, 0, 0] % 2 == 0).all()
+
+
+def test_dataset_glob_mixed_dtype_batch(tmp_path):
+    Image.fromarray(np.full((4, 4), 10, dtype=np.uint8)).save(tmp_path / "0.png")
+    Image.fromarray(np.full((4, 4), 1000, dtype=np.uint16)).save(tmp_path / "1.png")
+    dataset = DatasetGlob(str(tmp_path / "*.png"), transform=None)
+    first = [os.path.basename(path) for path in dataset.image_paths].index("0.png")
+    batch = dataset[[first, 1 - first]]
+    # Not stacked into the uint8 of the first image, which would truncate the other
+    assert isinstance(batch, list)
+    assert [int(image.max()) for image in batch] == [10, 1000]
+
+
+def test_file_index_incremental(image_folder, tmp_path, monkeypatch):
+    index_dir = tmp_path / "index"
+    files = file_index(image_folder, index_dir, pattern="*.png", read_shapes=True)
+    assert len(files) == 6
+    assert files["label"].tolist() == ["a"] * 3 + ["b"] * 3
+    assert list(files["shape"].iloc[0]) == [8, 10, 3]
+
+    new = np.zeros((4, 4), dtype=np.uint8)
+    Image.fromarray(new).save(image_folder / "b" / "new.png")
+    (image_folder / "a" / "0.png").unlink()
+    (image_folder / "c" / "d").mkdir(parents=True)
+    (image_folder / "c" / "d" / "x.png").write_bytes(
+        (image_folder / "a" / "1.png").read_bytes()
+    )
+    listed = []
+    scan_dir = index._scan_dir
+
+    def counting_scan_dir(path, pattern, known, rescan):
+        result = scan_dir(path, pattern, known, rescan)
+        if result[2] is not None:
+            listed.append(path)
+        return result
+
+    monkeypatch.setattr(index, "_scan_dir", counting_scan_dir)
+    files = file_index(image_folder, index_dir, pattern="*.png", read_shapes=True)
+    # Only the directories that changed are listed again
+    assert sorted(listed) == sorted(
+        str(image_folder / name) for name in ("", "a", "b", "c", "c/d")
+    )
+    paths = [os.path.relpath(path, image_folder) for path in files["path"]]
+    assert paths == [
+        "a/1.png",
+        "a/2.png",
+        "b/0.png",
+        "b/1.png",
+        "b/2.png",
+        "b/new.png",
+        "c/d/x.png",
+    ]
+    assert list(files["shape"].iloc[5]) == [4, 4]
+    assert files["label"].iloc[-1] == "c"
+
+    listed.clear()
+    again = file_index(image_folder, index_dir, pattern="*.png", read_shapes=True)
+    assert listed == []
+    assert again["path"].tolist() == files["path"].tolist()
+    assert [list(shape) for shape in again["shape"]] == [
+        list(shape) for shape in files["shape"]
+    ]
+
+
+def test_glob_paths(image_folder, tmp_path):
+    expected = sorted(glob.glob(str(image_folder / "**" / "*.png"), recursive=True))
+    index_dir = tmp_path / "index"
+    assert sorted(glob_paths(str(image_folder / "**" / "*.png"), index_dir)) == expected
+    paths = glob_paths(str(image_folder / "a" / "[01].png"), index_dir)
+    assert sorted(paths) == expected[:2]
+    dataset = DatasetGlob(str(image_folder / "*" / "*.png"), index_dir=index_dir)
+    assert sorted(dataset.image_paths) == expected
+    assert re.match(glob_regex("**/*.png"), "x.png")
+    assert not re.match(glob_regex("*.png"), "a/x.png")
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ..evaluation import fold_indices, score_trials, scoring_df
+
+
+@pytest.fixture
+def y():
+    return np.repeat([0, 1, 2], 20)
+
+
+@pytest.fixture
+def trials(y):
+    rng = np.random.default_rng(42)
+    return {
+        "informative": rng.normal(y[:, None], 0.5, (len(y), 4)),
+        "noise": pd.DataFrame(rng.normal(0, 1, (len(y), 6))),
+    }
+
+
+@pytest.mark.parametrize("probe", ["forest", "linear"])
+def test_score_trials(trials, y, probe):
+    df = score_trials(trials, y, n_splits=3, probe=probe, n_jobs=1)
+    assert len(df) == 2 * 3
+    assert list(df.columns[:2]) == ["trial", "fold"]
+    means = df.groupby("trial")["test_accuracy"].mean()
+    assert means["informative"] > means["noise"]
+
+
+def test_score_trials_shared_folds(trials, y):
+    folds = fold_indices(y, n_splits=3)
+    df = score_trials(trials, y, folds=folds, probe="linear", n_jobs=1)
+    expected = scoring_df(trials["noise"], y, folds=folds, probe="linear", n_jobs=1)
+    scores = ["test_accuracy", "test_f1", "test_roc_auc"]
+    assert np.allclose(df[df.trial == "noise"][scores], expected[scores])
+
+
+def test_score_trials_parallel(trials, y):
+    expected = score_trials(trials, y, n_splits=3, n_jobs=1)
+    df = score_trials(trials, y, n_splits=3, n_jobs=2)
+    scores = [column for column in df if column.startswith("test_")]
+    pd.testing.assert_frame_equal(df[scores], expected[scores])
+
+
+def test_score_trials_cache(trials, y, tmp_path):
+    expected = score_trials(trials, y, n_splits=3, n_jobs=1, cache_dir=tmp_path)
+    # Cached folds are not refit, so even the fit times are identical
+    df = score_trials(trials, y, n_splits=3, n_jobs=1, cache_dir=tmp_path)
+    pd.testing.assert_frame_equal(df, expected)
+    changed = dict(trials, noise=trials["noise"] + 1)
+    df = score_trials(changed, y, n_splits=3, n_jobs=1, cache_dir=tmp_path)
+    assert (df.fit_time != expected.fit_time).any()
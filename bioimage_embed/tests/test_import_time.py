@@ -0,0 +1,59 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+# Only needed once a model is built or trained, never to import the package or run `bie --help`
+heavy_modules = [
+    "torch",
+    "pytorch_lightning",
+    "pythae",
+    "pl_bolts",
+    "timm",
+    "transformers",
+    "monai",
+    "albumentations",
+]
+# Cumulative self-reported import time of the CLI, in microseconds
+cli_budget = 300_000
+
+
+def importtime(module):
+    """
+    Cumulative import time per module from `python -X importtime`
+    """
+    env = {**os.environ, "PYTHONPATH": str(Path(__file__).parents[2])}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        env=env,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize(
+    "module", ["bioimage_embed", "bioimage_embed.cli", "bioimage_embed.config"]
+)
+def test_no_heavy_imports(module):
+    imported = importtime(module)
+    assert not set(heavy_modules) & set(imported)
+
+
+def test_datasets_skip_albumentations():
+    # Datasets need torch, but albumentations only comes with the augmentations
+    assert "albumentations" not in importtime("bioimage_embed.datasets")
+
+
+def test_cli_import_time():
+    assert importtime("bioimage_embed.cli")["bioimage_embed.cli"] < cli_budget
@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+import torch
+from torchvision import transforms
+from torchvision.datasets import FakeData
+
+from ..inference import EmbeddingWriter, read_embeddings, stream_embeddings
+from ..lightning import AEUnsupervised
+from ..models import create_model
+
+
+@pytest.fixture
+def input_dim():
+    return [3, 64, 64]
+
+
+@pytest.fixture
+def latent_dim():
+    return 16
+
+
+@pytest.fixture
+def dataset(input_dim):
+    return FakeData(
+        size=10,
+        image_size=input_dim,
+        num_classes=3,
+        transform=transforms.ToTensor(),
+    )
+
+
+@pytest.fixture
+def lit_model(input_dim, latent_dim):
+    # Vector quantised latents are deterministic, unlike the sampled z of a VAE
+    torch.manual_seed(42)
+    model = create_model("resnet18_vqvae", input_dim, latent_dim, pretrained=False)
+    return AEUnsupervised(model)
+
+
+def embed(lit_model, dataset, root, **kwargs):
+    return stream_embeddings(
+        lit_model, dataset, root, batch_size=3, num_workers=0, shard_size=4, **kwargs
+    )
+
+
+def test_stream_embeddings(lit_model, dataset, latent_dim, tmp_path):
+    writer = embed(lit_model, dataset, tmp_path)
+    assert writer.num_shards == 3
+    assert writer.pending_shards() == []
+    df = read_embeddings(tmp_path)
+    assert list(df.index) == list(range(len(dataset)))
+    assert np.stack(df["embedding"]).shape == (len(dataset), latent_dim)
+    assert list(df["label"]) == [dataset[i][1] for i in range(len(dataset))]
+    assert "reconstruction" not in df
+
+
+def test_stream_embeddings_unlabelled(lit_model, dataset, latent_dim, tmp_path):
+    images = [dataset[i][0] for i in range(len(dataset))]
+    embed(lit_model, images, tmp_path)
+    df = read_embeddings(tmp_path)
+    assert list(df["label"]) == [-1] * len(images)
+    assert np.stack(df["embedding"]).shape == (len(images), latent_dim)
+
+
+def test_stream_embeddings_matches_predict(lit_model, dataset, tmp_path):
+    embed(lit_model, dataset, tmp_path)
+    x = torch.stack([dataset[i][0] for i in range(len(dataset))])
+    with torch.inference_mode():
+        z = lit_model.embedding(lit_model.predict_step((x, None), 0))
+    df = read_embeddings(tmp_path)
+    assert np.allclose(np.stack(df["embedding"]), z.numpy(), atol=1e-5)
+
+
+def test_stream_embeddings_resume(lit_model, dataset, tmp_path):
+    embed(lit_model, dataset, tmp_path)
+    writer = EmbeddingWriter(tmp_path, len(dataset), shard_size=4)
+    first = writer.shard_path(0).stat().st_mtime_ns
+    writer.shard_path(1).unlink()
+    # A shard left half written by a crash is not read as part of the table
+    (tmp_path / ".shard-00001.parquet.123.tmp").write_bytes(b"PAR1")
+    assert len(read_embeddings(tmp_path)) == len(dataset) - 4
+    assert writer.pending_shards() == [1]
+    embed(lit_model, dataset, tmp_path)
+    assert writer.pending_shards() == []
+    assert writer.shard_path(0).stat().st_mtime_ns == first
+    assert len(read_embeddings(tmp_path)) == len(dataset)
+
+
+def test_stream_embeddings_resume_mismatch(lit_model, dataset, tmp_path):
+    embed(lit_model, dataset, tmp_path)
+    # A different shard size or dataset would mix shards of the two runs
+    with pytest.raises(ValueError):
+        EmbeddingWriter(tmp_path, len(dataset), shard_size=5)
+    with pytest.raises(ValueError):
+        EmbeddingWriter(tmp_path, len(dataset) + 1, shard_size=4)
+    (tmp_path / "_meta.json").unlink()
+    with pytest.raises(ValueError):
+        EmbeddingWriter(tmp_path, len(dataset), shard_size=4)
+
+
+def test_stream_reconstructions(lit_model, dataset, input_dim, tmp_path):
+    embed(lit_model, dataset, tmp_path, reconstructions=True)
+    df = read_embeddings(tmp_path)
+    assert len(df["reconstruction"].iloc[0]) == np.prod(input_dim)
+
+
+@pytest.mark.parametrize("channels_last,bf16", [(True, False), (False, True)])
+def test_stream_embeddings_fast_paths(lit_model, dataset, tmp_path, channels_last, bf16):
+    writer = embed(lit_model, dataset, tmp_path, channels_last=channels_last, bf16=bf16)
+    assert writer.stats["images"] == len(dataset)
+    assert writer.stats["images_per_sec"] > 0
+    assert np.isfinite(np.stack(read_embeddings(tmp_path)["embedding"])).all()
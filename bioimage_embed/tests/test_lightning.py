@@ -324,3 +324,172 @@ def test_sanity_check_stratified():
     print("Sampled Label Distribution:")
     for i, proportion in enumerate(sampled_distribution):
         print(f"Class {i}: {proportion*100:.2f}%")
+
+
+class TargetsDataset(torch.utils.data.Dataset):
+    """
+    ImageFolder-like dataset with `targets` metadata that counts sample loads
+    """
+
+    def __init__(self, targets, has_targets=True):
+        if has_targets:
+            self.targets = list(targets)
+        self._targets = list(targets)
+        self.loads = 0
+
+    def __len__(self):
+        return len(self._targets)
+
+    def __getitem__(self, index):
+        self.loads += 1
+        return torch.zeros(1), self._targets[index]
+
+
+def test_stratified_sampler_reads_metadata():
+    labels = [0] * 80 + [1] * 20
+    dataset = TargetsDataset(labels)
+    subset = torch.utils.data.Subset(dataset, list(range(50, 100)))
+    sampler = StratifiedSampler(subset)
+    assert dataset.loads == 0
+    assert np.array_equal(sampler.targets, labels[50:100])
+
+
+def test_datamodule_caches_targets():
+    dataset = TargetsDataset([0] * 80 + [1] * 20, has_targets=False)
+    datamodule = DataModule(dataset, batch_size=10, num_workers=0)
+    sampler = datamodule.train_dataloader().sampler
+    loads = dataset.loads
+    assert loads == len(dataset)
+    datamodule.setup()
+    datamodule.train_dataloader()
+    assert dataset.loads == loads
+    expected = [dataset[i][1] for i in datamodule.train_dataset.indices]
+    assert np.array_equal(sampler.targets, expected)
+
+
+class CountingTransform:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, image):
+        self.calls += 1
+        return image
+
+
+@pytest.fixture
+def image_folder(tmp_path):
+    from PIL import Image
+
+    for label in ["a", "b"]:
+        (tmp_path / label).mkdir()
+        for i in range(3):
+            Image.new("L", (8, 8)).save(tmp_path / label / f"{i}.png")
+    (tmp_path / "b" / "broken.png").write_bytes(b"not a png")
+    return tmp_path
+
+
+def test_validate_dataset_manifest(image_folder, tmp_path):
+    import json
+    import os
+    from torchvision.datasets import ImageFolder
+    from bioimage_embed.lightning.dataloader import validate_dataset
+
+    transform = CountingTransform()
+    dataset = ImageFolder(image_folder, transform=transform)
+    manifest = tmp_path / "manifest.json"
+    subset = validate_dataset(dataset, manifest=manifest, num_workers=0)
+    broken = [i for i, (path, _) in enumerate(dataset.samples) if "broken" in path]
+    assert subset.indices == [i for i in range(len(dataset)) if i not in broken]
+    samples = json.loads(manifest.read_text())["samples"]
+    assert "UnidentifiedImageError" in samples[dataset.samples[broken[0]][0]]["error"]
+
+    # Later runs only check files that changed
+    calls = transform.calls
+    again = validate_dataset(dataset, manifest=manifest, num_workers=0)
+    assert again.indices == subset.indices
+    assert transform.calls == calls
+    path = dataset.samples[0][0]
+    os.utime(path, (0, 0))
+    validate_dataset(dataset, manifest=manifest, num_workers=0)
+    assert transform.calls == calls + 1
+
+
+def test_validate_dataset_workers():
+    from bioimage_embed.lightning.dataloader import validate_dataset
+
+    class Failing(TargetsDataset):
+        def __getitem__(self, index):
+            if index % 3 == 0:
+                raise ValueError("bad sample")
+            return super().__getitem__(index)
+
+    subset = validate_dataset(Failing(range(10)), num_workers=2, chunksize=2)
+    assert subset.indices == [1, 2, 4, 5, 7, 8]
+
+
+class InvalidEvery(TargetsDataset):
+    """
+    Every `n`th sample comes back as (INVALID, label), as from ImageFolder with a failing transform
+    """
+
+    def __init__(self, targets, n=4):
+        super().__init__(targets)
+        self.n = n
+
+    def __getitem__(self, index):
+        from bioimage_embed.utils import INVALID
+
+        if index % self.n == 0:
+            return INVALID, self._targets[index]
+        return super().__getitem__(index)
+
+
+def test_validate_dataset_invalid_samples():
+    from bioimage_embed.lightning.dataloader import validate_dataset
+
+    # Transforms return INVALID rather than raise, those samples fail too
+    subset = validate_dataset(InvalidEvery(range(8), n=2), num_workers=0)
+    assert subset.indices == [1, 3, 5, 7]
+
+
+def test_collator_drops_invalid():
+    from bioimage_embed.lightning.dataloader import Collator
+    from bioimage_embed.utils import INVALID
+
+    collator = Collator()
+    sample = (torch.zeros(1), 0)
+    x, y = collator([sample, (INVALID, 1), None, sample])
+    assert len(x) == 2
+    assert collator([None, INVALID]) is None
+    assert collator.reset() == {"dropped": 4, "refilled": 0}
+    assert collator.stats() == {"dropped": 0, "refilled": 0}
+
+
+def test_collator_refill():
+    from bioimage_embed.lightning.dataloader import Collator
+    from bioimage_embed.utils import INVALID
+
+    collator = Collator(refill=True, reservoir_size=2)
+    batches = [[(torch.full((1,), i), i), (INVALID, 0)] for i in range(5)]
+    for batch in batches:
+        x, y = collator(batch)
+        assert len(x) == 2
+        assert set(y.tolist()) <= set(range(5))
+    assert len(collator.reservoir) == 2
+    assert collator.stats() == {"dropped": 5, "refilled": 5}
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_datamodule_counts_invalid_samples(num_workers):
+    dataset = InvalidEvery([0, 1] * 20)
+    datamodule = DataModule(
+        dataset, batch_size=4, num_workers=num_workers, sampler=None, refill=True
+    )
+    datamodule.train_dataset = dataset
+    batches = list(datamodule.init_dataloader(dataset, stage="train"))
+    assert all(len(x) == 4 for x, _ in batches)
+    assert datamodule.invalid_samples()["train"] == {"dropped": 10, "refilled": 10}
+    assert datamodule.invalid_samples()["train"] == {"dropped": 0, "refilled": 0}
+    val = list(datamodule.init_dataloader(dataset, stage="val"))
+    assert sum(len(x) for x, _ in val) == 30
+    assert datamodule.invalid_samples(reset=False)["val"]["dropped"] == 10
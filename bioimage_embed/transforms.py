@@ -12,6 +12,8 @@ from sklearn.metrics.pairwise import euclidean_distances
 from skimage.measure import find_contours
 from scipy.interpolate import interp1d
 
+from .utils import INVALID, is_invalid
+
 
 class cropCentroid(torch.nn.Module):
     def __init__(self, size):
@@ -239,10 +241,12 @@ class CropCentroidPipeline(torch.nn.Module):
         )
 
     def forward(self, x):
+        if is_invalid(x):
+            return INVALID
         try:
             return self.pipeline(x)
-        except:
-            return None
+        except Exception:
+            return INVALID
 
 
 class MaskToDistogramPipeline(torch.nn.Module):
@@ -263,10 +267,12 @@ class MaskToDistogramPipeline(torch.nn.Module):
         )
 
     def forward(self, x):
+        if is_invalid(x):
+            return INVALID
         try:
             return self.pipeline(x)
-        except:
-            return None
+        except Exception:
+            return INVALID
 
 
 class DistogramToMaskPipeline(torch.nn.Module):
@@ -285,10 +291,12 @@ class DistogramToMaskPipeline(torch.nn.Module):
         )
 
     def forward(self, x):
+        if is_invalid(x):
+            return INVALID
         try:
             return self.pipeline(x)
-        except:
-            return None
+        except Exception:
+            return INVALID
 
 
 class AsymmetricDistogramToMaskPipeline(torch.nn.Module):
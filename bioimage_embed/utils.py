@@ -1,12 +1,94 @@
-import torch
+import importlib
 from types import SimpleNamespace
 import pickle
 import base64
 import hashlib
 
 
+class LazyModule:
+    """
+    Stand-in for a module that is only imported on first attribute access,
+    for the heavy dependencies (pythae, pl_bolts, timm, monai...) that most code paths never touch.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self._name!r})"
+
+
+def lazy_import(name):
+    return LazyModule(name)
+
+
+class InvalidSample:
+    """
+    Sentinel returned by transforms for a sample that could not be loaded or transformed,
+    so it can be dropped at collation instead of raising inside a DataLoader worker.
+    There is a single instance, INVALID, which survives pickling to and from workers.
+    """
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __reduce__(self):
+        return (InvalidSample, ())
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return "INVALID"
+
+
+INVALID = InvalidSample()
+
+
+def is_invalid(sample) -> bool:
+    """
+    True for INVALID and None, and for (image, label) samples whose image is either,
+    as datasets like ImageFolder wrap the output of the transform with the label.
+    """
+    if sample is None or sample is INVALID:
+        return True
+    if isinstance(sample, tuple) and sample:
+        return sample[0] is None or sample[0] is INVALID
+    return False
+
+
+def stacked_batch(batch):
+    """
+    The tensor of a batch the dataset already stacked into one array or tensor
+    (e.g. by DatasetGlob.__getitems__), or None for a list of samples to collate.
+    """
+    import numpy as np
+    import torch
+
+    if isinstance(batch, np.ndarray):
+        return torch.from_numpy(batch)
+    if isinstance(batch, torch.Tensor):
+        return batch
+    return None
+
+
 def collate_none(batch):
-    batch = list(filter(lambda x: x is not None, batch))
+    import torch
+
+    stacked = stacked_batch(batch)
+    if stacked is not None:
+        return stacked
+    batch = [sample for sample in batch if not is_invalid(sample)]
     return torch.utils.data.dataloader.default_collate(batch)
 
 
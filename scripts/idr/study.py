@@ -20,12 +20,11 @@ from ray.train.lightning import (
     prepare_trainer,
 )
 import os
-import glob
+from bioimage_embed.datasets import glob_paths
 from PIL import Image
 from typing import List
 from torch.utils.data import Dataset
 import torch
-from joblib import Memory
 from pydantic.dataclasses import dataclass
 from pytorch_lightning import loggers as pl_loggers
 params = {
@@ -41,11 +40,9 @@ params = {
         "lr": 1e-3,
         "batch_size": 16,
     }
-memory = Memory(location='.', verbose=0)
-
-@memory.cache
 def get_file_list(glob_str):
-    return glob.glob(os.path.join(glob_str), recursive=True)
+    # Only the directories changed since the last run are listed again
+    return glob_paths(glob_str, index_dir="file_index")
 
 
 class GlobDataset(Dataset):
@@ -1,33 +1,19 @@
 # %%
 import seaborn as sns
-import pyefd
-from sklearn.discriminant_analysis import StandardScaler
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import (
-    cross_validate,
-    KFold,
-    train_test_split,
-)
-from sklearn.metrics import make_scorer
 import pandas as pd
-from sklearn import metrics
 import matplotlib as mpl
 from pathlib import Path
-from sklearn.pipeline import Pipeline
 from torch.autograd import Variable
 from types import SimpleNamespace
 import numpy as np
-from skimage import measure
 from pytorch_lightning.callbacks.model_checkpoint import ModelCheckpoint
 import pytorch_lightning as pl
 import torch
 from types import SimpleNamespace
 from pytorch_lightning.callbacks.early_stopping import EarlyStopping
-from umap import UMAP
 # Deal with the filesystem
 import torch.multiprocessing
 import logging
-from tqdm import tqdm
 
 logging.basicConfig(level=logging.INFO)
 
@@ -38,6 +24,7 @@ import bioimage_embed
 from pytorch_lightning import loggers as pl_loggers
 from torchvision import transforms
 from bioimage_embed.lightning import DataModule
+from bioimage_embed.lightning.dataloader import validate_dataset
 
 from torchvision import datasets
 from bioimage_embed.shapes.transforms import (
@@ -48,6 +35,9 @@ from bioimage_embed.shapes.transforms import (
     CoordsToDistogram,
     AsymmetricDistogramToCoordsPipeline,
 )
+from bioimage_embed.shapes.cache import TransformCache
+from bioimage_embed.shapes.features import shape_features
+from bioimage_embed.evaluation import score_trials
 import matplotlib.pyplot as plt
 
 from matplotlib import rc
@@ -70,83 +60,6 @@ def hashing_fn(args):
     return hashed_string
 
 
-def umap_plot(df, metadata, width=3.45, height=3.45 / 1.618):
-    umap_reducer = UMAP(n_neighbors=15, min_dist=0.1, n_components=2, random_state=42)
-    mask = np.random.rand(len(df)) < 0.7
-
-    semi_labels = df["Class"].copy()
-    semi_labels[~mask] = -1  # Assuming -1 indicates unknown label for semi-supervision
-
-    umap_embedding = umap_reducer.fit_transform(df, y=semi_labels)
-
-    ax = sns.relplot(
-        data=pd.DataFrame(umap_embedding, columns=["umap0", "umap1"]),
-        x="umap0",
-        y="umap1",
-        hue="Class",
-        palette="deep",
-        alpha=0.5,
-        edgecolor=None,
-        s=5,
-        height=height,
-        aspect=0.5 * width / height,
-    )
-
-    sns.move_legend(
-        ax,
-        "upper center",
-    )
-    ax.set(xlabel=None, ylabel=None)
-    sns.despine(left=True, bottom=True)
-    plt.tick_params(bottom=False, left=False, labelbottom=False, labelleft=False)
-    plt.tight_layout()
-    plt.savefig(metadata("umap_no_axes.pdf"))
-    # plt.show()
-    plt.close()
-
-
-def scoring_df(X, y):
-    # Split the data into training and test sets
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.2, random_state=42, shuffle=True, stratify=y
-    )
-    # Define a dictionary of metrics
-    scoring = {
-        "accuracy": make_scorer(metrics.balanced_accuracy_score),
-        "precision": make_scorer(metrics.precision_score, average="macro"),
-        "recall": make_scorer(metrics.recall_score, average="macro"),
-        "f1": make_scorer(metrics.f1_score, average="macro"),
-        "roc_auc": make_scorer(metrics.roc_auc_score, average="macro"),
-    }
-
-    # Create a random forest classifier
-    pipeline = Pipeline(
-        [
-            ("scaler", StandardScaler()),
-            #  ("pca", PCA(n_components=0.95, whiten=True, random_state=42)),
-            ("clf", RandomForestClassifier()),
-            # ("clf", DummyClassifier()),
-        ]
-    )
-
-    # Specify the number of folds
-    k_folds = 5
-
-    # Perform k-fold cross-validation
-    cv_results = cross_validate(
-        estimator=pipeline,
-        X=X,
-        y=y,
-        cv=StratifiedKFold(n_splits=k_folds),
-        scoring=scoring,
-        n_jobs=-1,
-        return_train_score=False,
-    )
-
-    # Put the results into a DataFrame
-    return pd.DataFrame(cv_results)
-
-
 def shape_embed_process():
     # Setting the font size
     mpl.rcParams["font.size"] = 10
@@ -225,26 +138,45 @@ def shape_embed_process():
 
     transform_mask_to_gray = transforms.Compose([transforms.Grayscale(1)])
 
-    transform_mask_to_crop = transforms.Compose(
-        [
-            # transforms.ToTensor(),
-            transform_mask_to_gray,
-            transform_crop,
-        ]
+    # Crops and coords are cached too, the baseline features below reuse them
+    transform_mask_to_crop = TransformCache(
+        transforms.Compose(
+            [
+                # transforms.ToTensor(),
+                transform_mask_to_gray,
+                transform_crop,
+            ]
+        ),
+        cache_dir=metadata("cache/crop"),
+        params={"stage": "crop", "window_size": window_size},
     )
 
-    transform_mask_to_coords = transforms.Compose(
-        [
-            transform_mask_to_crop,
-            transform_coords,
-        ]
+    transform_mask_to_coords = TransformCache(
+        transforms.Compose(
+            [
+                transform_mask_to_crop,
+                transform_coords,
+            ]
+        ),
+        cache_dir=metadata("cache/coords"),
+        params={"stage": "coords", "window_size": window_size},
     )
 
-    transform_mask_to_dist = transforms.Compose(
-        [
-            transform_mask_to_coords,
-            transform_coord_to_dist,
-        ]
+    # Crop -> contour -> spline -> distance matrix is deterministic,
+    # so compute it once and only rerun the random transforms each epoch
+    transform_mask_to_dist = TransformCache(
+        transforms.Compose(
+            [
+                transform_mask_to_coords,
+                transform_coord_to_dist,
+            ]
+        ),
+        cache_dir=metadata("cache/distogram"),
+        params={
+            "window_size": window_size,
+            "interp_size": interp_size,
+            "matrix_normalised": False,
+        },
     )
 
     gray2rgb = transforms.Lambda(lambda x: x.repeat(3, 1, 1))
@@ -264,19 +196,13 @@ def shape_embed_process():
         "transform_coords": transform_mask_to_coords,
     }
 
-    # Apply transform to find which images don't work
-    dataset = datasets.ImageFolder(train_data_path, transform=transform)
-
-    valid_indices = []
-    # Iterate through the dataset and apply the transform to each image
-    for idx in range(len(dataset)):
-        try:
-            image, label = dataset[idx]
-            # If the transform works without errors, add the index to the list of valid indices
-            valid_indices.append(idx)
-        except Exception as e:
-            # A better way to do with would be with batch collation
-            logger.warning(f"Error occurred for image {idx}: {e}")
+    # Apply transform to find which images don't work, the manifest lets later runs skip the scan
+    dataset = validate_dataset(
+        datasets.ImageFolder(train_data_path, transform=transform),
+        manifest=metadata("manifest.json"),
+        num_workers=args.num_workers,
+    )
+    valid_indices = dataset.indices
 
     train_data = {
         key: torch.utils.data.Subset(
@@ -286,11 +212,6 @@ def shape_embed_process():
         for key, value in transforms_dict.items()
     }
 
-    dataset = torch.utils.data.Subset(
-        datasets.ImageFolder(train_data_path, transform=transform),
-        valid_indices,
-    )
-
     for key, value in train_data.items():
         logger.info(key, len(value))
         plt.imshow(np.array(train_data[key][0][0]), cmap="gray")
@@ -448,93 +369,28 @@ def shape_embed_process():
 
     # %%
 
-    X = df_shape_embed.to_numpy()
-    y = df_shape_embed.index
-
-    properties = [
-        "area",
-        "perimeter",
-        "centroid",
-        "major_axis_length",
-        "minor_axis_length",
-        "orientation",
-    ]
-    dfs = []
-    # Distance matrix data
-    for i, data in enumerate(tqdm(train_data["transform_crop"])):
-        X, y = data
-        # Do regionprops here
-        # Calculate shape summary statistics using regionprops
-        # We're considering that the mask has only one object, so we take the first element [0]
-        # props = regionprops(np.array(X).astype(int))[0]
-        props_table = measure.regionprops_table(
-            np.array(X).astype(int), properties=properties
-        )
-
-        # Store shape properties in a dataframe
-        df = pd.DataFrame(props_table)
-
-        # Assuming the class or label is contained in 'y' variable
-        df["class"] = y
-        df.set_index("class", inplace=True)
-        dfs.append(df)
-
-    df_regionprops = pd.concat(dfs)
-
-    dfs = []
-    for i, data in enumerate(tqdm(train_data["transform_coords"])):
-        # Convert the tensor to a numpy array
-        X, y = data
-
-        # Feed it to PyEFD's calculate_efd function
-        coeffs = pyefd.elliptic_fourier_descriptors(X, order=10, normalize=False)
-        # coeffs_df = pd.DataFrame({'class': [y], 'norm_coeffs': [norm_coeffs.flatten().tolist()]})
-
-        norm_coeffs = pyefd.normalize_efd(coeffs)
-        df = pd.DataFrame(
-            {
-                "norm_coeffs": norm_coeffs.flatten().tolist(),
-                "coeffs": coeffs.flatten().tolist(),
-            }
-        ).T.rename_axis("coeffs")
-        df["class"] = y
-        df.set_index("class", inplace=True, append=True)
-        dfs.append(df)
-
-    df_pyefd = pd.concat(dfs)
+    df_features = shape_features(
+        crops=train_data["transform_crop"],
+        coords=train_data["transform_coords"],
+        num_workers=args.num_workers,
+    )
+    df_regionprops = df_features["regionprops"]
+    df_pyefd = df_features["efd"]
 
-    trials = [
-        {
-            "name": "mask_embed",
-            "features": df_shape_embed.to_numpy(),
-            "labels": df_shape_embed.index,
-        },
+    # All feature sets follow the order of valid_indices, so they share labels and folds
+    trial_df = score_trials(
         {
-            "name": "fourier_coeffs",
-            "features": df_pyefd.xs("coeffs", level="coeffs"),
-            "labels": df_pyefd.xs("coeffs", level="coeffs").index,
+            "mask_embed": df_shape_embed.to_numpy(),
+            "fourier_coeffs": df_pyefd,
+            "regionprops": df_regionprops,
         },
-        # {"name": "fourier_norm_coeffs",
-        #  "features": df_pyefd.xs("norm_coeffs", level="coeffs"),
-        #  "labels": df_pyefd.xs("norm_coeffs", level="coeffs").index
-        # }
-        {
-            "name": "regionprops",
-            "features": df_regionprops,
-            "labels": df_regionprops.index,
-        },
-    ]
-
-    trial_df = pd.DataFrame()
-    for trial in trials:
-        X = trial["features"]
-        y = trial["labels"]
-        trial["score_df"] = scoring_df(X, y)
-        trial["score_df"]["trial"] = trial["name"]
-        logger.info(trial["score_df"])
-        trial["score_df"].to_csv(metadata(f"{trial['name']}_score_df.csv"))
-        trial_df = pd.concat([trial_df, trial["score_df"]])
-    trial_df = trial_df.drop(["fit_time", "score_time"], axis=1)
+        df_features.index,
+        cache_dir=metadata("scores"),
+    )
+    for name, score_df in trial_df.groupby("trial"):
+        logger.info(score_df)
+        score_df.to_csv(metadata(f"{name}_score_df.csv"))
+    trial_df = trial_df.drop(["fold", "fit_time", "score_time"], axis=1)
 
     trial_df.to_csv(metadata("trial_df.csv"))
     trial_df.groupby("trial").mean().to_csv(metadata("trial_df_mean.csv"))